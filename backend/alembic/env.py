@@ -10,7 +10,7 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # --- Import Base and all models
-from models.database import Base
+from core.database import Base
 from models import *  # Ensures all models are registered for autogenerate
 
 # Alembic Config object, which provides access to .ini file
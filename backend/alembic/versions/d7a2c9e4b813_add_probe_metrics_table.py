@@ -0,0 +1,54 @@
+"""add probe_metrics table
+
+Revision ID: d7a2c9e4b813
+Revises: c41e7a5d2f60
+Create Date: 2026-10-18 11:02:17.530921
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a2c9e4b813'
+down_revision: Union[str, None] = 'c41e7a5d2f60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('probe_metrics',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('job_id', sa.String(), nullable=True),
+    sa.Column('scheduled_probe_id', sa.Integer(), nullable=True),
+    sa.Column('tool', sa.String(), nullable=False),
+    sa.Column('target', sa.String(), nullable=True),
+    sa.Column('success', sa.Boolean(), nullable=True),
+    sa.Column('duration_ms', sa.Float(), nullable=True),
+    sa.Column('rtt_min_ms', sa.Float(), nullable=True),
+    sa.Column('rtt_avg_ms', sa.Float(), nullable=True),
+    sa.Column('rtt_max_ms', sa.Float(), nullable=True),
+    sa.Column('rtt_stddev_ms', sa.Float(), nullable=True),
+    sa.Column('packet_loss_pct', sa.Float(), nullable=True),
+    sa.Column('hop_count', sa.Integer(), nullable=True),
+    sa.Column('http_status', sa.Integer(), nullable=True),
+    sa.Column('open_ports', sa.JSON(), nullable=True),
+    sa.Column('details', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['scheduled_probe_id'], ['scheduled_probes.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_probe_metrics_job_id'), 'probe_metrics', ['job_id'], unique=False)
+    op.create_index('ix_probe_metrics_tool_target_created_at', 'probe_metrics', ['tool', 'target', 'created_at'], unique=False)
+    op.create_index('ix_probe_metrics_scheduled_probe_id_created_at', 'probe_metrics', ['scheduled_probe_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_probe_metrics_scheduled_probe_id_created_at', table_name='probe_metrics')
+    op.drop_index('ix_probe_metrics_tool_target_created_at', table_name='probe_metrics')
+    op.drop_index(op.f('ix_probe_metrics_job_id'), table_name='probe_metrics')
+    op.drop_table('probe_metrics')
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import uuid
+
+from utils.settings import BROKER_BACKEND, DATABASE_URL
+
+logger = logging.getLogger("broker")
+
+# Unique per process; jobs and results addressed to this worker use it as channel
+WORKER_ID = f"w_{uuid.uuid4().hex[:12]}"
+
+NODES_CHANNEL = "probe_nodes"
+SCHEDULE_CHANNEL = "probe_schedule"
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more; larger messages
+# are parked in broker_payloads and only their row id is notified.
+PG_NOTIFY_LIMIT = 7900
+SCHEDULER_LOCK_KEY = 0x50524F4245  # "PROBE"
+
+
+def worker_channel(worker_id: str) -> str:
+    return f"probe_{worker_id}"
+
+
+class Broker:
+    """Delivers JSON messages between backend workers.
+
+    Channels are fire-and-forget pub/sub: every subscriber of a channel
+    gets each message published after it subscribed. Callbacks are
+    coroutine functions taking the decoded message.
+    """
+
+    def __init__(self):
+        self._subscribers = {}  # channel: [callback]
+        self._loop = None
+
+    def subscribe(self, channel: str, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: dict):
+        raise NotImplementedError
+
+    def publish_threadsafe(self, channel: str, message: dict):
+        """Publish from a sync endpoint running in the threadpool."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.publish(channel, message), self._loop)
+
+    async def try_acquire_leadership(self) -> bool:
+        """True if this worker should run singleton duties such as the scheduler."""
+        raise NotImplementedError
+
+    def _dispatch(self, channel: str, message: dict):
+        for callback in self._subscribers.get(channel, []):
+            task = self._loop.create_task(callback(message))
+            task.add_done_callback(_log_callback_error)
+
+
+def _log_callback_error(task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Broker callback failed: {task.exception()!r}")
+
+
+class InMemoryHub:
+    def __init__(self):
+        self.brokers = []
+        self.leader = None
+
+
+class InMemoryBroker(Broker):
+    """Single-process broker. Brokers sharing a hub behave like separate workers."""
+
+    def __init__(self, hub: InMemoryHub = None):
+        super().__init__()
+        self.hub = hub or InMemoryHub()
+        self.hub.brokers.append(self)
+
+    async def publish(self, channel: str, message: dict):
+        # Round-trip through JSON so in-process delivery matches the wire
+        payload = json.loads(json.dumps(message))
+        for broker in self.hub.brokers:
+            if broker._loop is not None and channel in broker._subscribers:
+                broker._loop.call_soon_threadsafe(broker._dispatch, channel, payload)
+
+    async def try_acquire_leadership(self) -> bool:
+        if self.hub.leader is None:
+            self.hub.leader = self
+        return self.hub.leader is self
+
+    async def stop(self):
+        if self.hub.leader is self:
+            self.hub.leader = None
+        if self in self.hub.brokers:
+            self.hub.brokers.remove(self)
+
+
+class PostgresBroker(Broker):
+    """Broker on Postgres LISTEN/NOTIFY, so any worker or replica sharing the DB can join."""
+
+    def __init__(self, dsn: str):
+        super().__init__()
+        self._dsn = dsn
+        self._listen_conn = None
+        self._pool = None
+
+    async def start(self):
+        import asyncpg
+
+        await super().start()
+        self._pool = await asyncpg.create_pool(self._dsn, min_size=1, max_size=5)
+        async with self._pool.acquire() as conn:
+            # Broadcast payloads have no single owner to delete them on receipt
+            await conn.execute(
+                "DELETE FROM broker_payloads WHERE created_at < now() - interval '1 hour'"
+            )
+        self._listen_conn = await asyncpg.connect(self._dsn)
+        for channel in self._subscribers:
+            await self._listen_conn.add_listener(channel, self._on_notify)
+
+    async def stop(self):
+        if self._listen_conn is not None:
+            await self._listen_conn.close()
+            self._listen_conn = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def publish(self, channel: str, message: dict):
+        payload = json.dumps(message)
+        async with self._pool.acquire() as conn:
+            if len(payload.encode()) > PG_NOTIFY_LIMIT:
+                ref = await conn.fetchval(
+                    "INSERT INTO broker_payloads (payload) VALUES ($1) RETURNING id", payload
+                )
+                payload = json.dumps({"_ref": ref})
+            await conn.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+    async def try_acquire_leadership(self) -> bool:
+        # Session-level lock on the listen connection: released if this worker dies
+        return await self._listen_conn.fetchval(
+            "SELECT pg_try_advisory_lock($1)", SCHEDULER_LOCK_KEY
+        )
+
+    def _on_notify(self, connection, pid, channel, payload):
+        message = json.loads(payload)
+        if "_ref" in message:
+            self._loop.create_task(self._dispatch_ref(channel, message["_ref"]))
+        else:
+            self._dispatch(channel, message)
+
+    async def _dispatch_ref(self, channel: str, ref: int):
+        async with self._pool.acquire() as conn:
+            if channel == worker_channel(WORKER_ID):
+                # Addressed to us alone, so we can clean it up
+                payload = await conn.fetchval(
+                    "DELETE FROM broker_payloads WHERE id = $1 RETURNING payload", ref
+                )
+            else:
+                payload = await conn.fetchval("SELECT payload FROM broker_payloads WHERE id = $1", ref)
+        if payload is None:
+            logger.error(f"Broker payload {ref} on {channel} is missing")
+            return
+        self._dispatch(channel, json.loads(payload))
+
+
+def create_broker() -> Broker:
+    if BROKER_BACKEND == "postgres":
+        return PostgresBroker(DATABASE_URL.replace("postgresql+psycopg2://", "postgresql://"))
+    return InMemoryBroker()
+
+
+broker = create_broker()
@@ -0,0 +1,121 @@
+import json
+import time
+from collections import OrderedDict
+
+from utils.settings import COALESCE_WINDOWS
+
+# Keys that choose where a probe runs or how it is reported, not what it measures
+IGNORED_PARAMS = {"target", "url", "ip_address", "region", "port", "max_age"}
+# Tools whose target is a URL, where case can matter past the host
+URL_TOOLS = {"curl", "http"}
+# Flights whose result never came (node lost) are forgotten after this long
+STALE_FLIGHT_SECONDS = 300
+
+
+def job_key(job_msg: dict, region: str = None, ignore=()):
+    """Normalized (tool, target, port, region, params) of a job: equal keys, same probe."""
+    tool = job_msg.get("job_type")
+    target = (job_msg.get("target") or "").strip()
+    if tool not in URL_TOOLS:
+        target = target.lower().rstrip(".")
+    params = {
+        k: v for k, v in (job_msg.get("params") or {}).items()
+        if k not in IGNORED_PARAMS and k not in ignore and v is not None
+    }
+    port = job_msg.get("port")
+    return (
+        tool,
+        target,
+        str(port) if port is not None else None,
+        region,
+        json.dumps(params, sort_keys=True, default=str),
+    )
+
+
+def coalesce_key(job_msg: dict, region: str = None):
+    """job_key for a job whose tool coalesces, else None."""
+    if not COALESCE_WINDOWS.get(job_msg.get("job_type")):
+        return None
+    return job_key(job_msg, region)
+
+
+class Flight:
+    """One node execution and every job waiting on its result."""
+
+    def __init__(self, key, leader, node_id, timeout):
+        self.key = key
+        self.leader = leader
+        self.node_id = node_id
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.followers = []
+        self.waiting = {leader}
+
+
+class Coalescer:
+    """Singleflight for node jobs.
+
+    The first job for a key is dispatched as usual and leads a flight. An
+    identical job arriving within its tool's window joins that flight
+    instead of going to a node, and gets a copy of the leader's result
+    under its own job_id. State is per worker, like pending_results.
+    """
+
+    def __init__(self):
+        self._by_key = {}     # key: Flight still open to joiners
+        self._flights = OrderedDict()  # leader job_id: Flight, oldest first
+        self._leaders = {}    # follower job_id: leader job_id
+
+    def join(self, key, job_id, timeout=None):
+        """Attach job_id to a running flight for key; returns the Flight or None."""
+        flight = self._by_key.get(key)
+        if flight is None:
+            return None
+        tool = key[0]
+        if time.monotonic() - flight.started > COALESCE_WINDOWS.get(tool, 0):
+            self._by_key.pop(key, None)
+            return None
+        # The node stops the leader once its timeout runs out, so only jobs
+        # allowing the run no more time than the leader's can share it
+        if flight.timeout is not None and (timeout is None or timeout > flight.timeout):
+            return None
+        flight.followers.append(job_id)
+        flight.waiting.add(job_id)
+        self._leaders[job_id] = flight.leader
+        return flight
+
+    def lead(self, key, job_id, node_id, timeout=None):
+        self._prune()
+        flight = Flight(key, job_id, node_id, timeout)
+        self._by_key[key] = flight
+        self._flights[job_id] = flight
+
+    def leader_of(self, job_id):
+        return self._leaders.get(job_id, job_id)
+
+    def leave(self, job_id) -> bool:
+        """A job stopped waiting. Returns True if no one is waiting on its execution any more."""
+        flight = self._flights.get(self.leader_of(job_id))
+        if flight is None:
+            return True
+        flight.waiting.discard(job_id)
+        return not flight.waiting
+
+    def finish(self, leader_id) -> list:
+        """The leader's result arrived; close its flight and return the follower job_ids."""
+        flight = self._flights.pop(leader_id, None)
+        if flight is None:
+            return []
+        if self._by_key.get(flight.key) is flight:
+            self._by_key.pop(flight.key)
+        for job_id in flight.followers:
+            self._leaders.pop(job_id, None)
+        return flight.followers
+
+    def _prune(self):
+        cutoff = time.monotonic() - STALE_FLIGHT_SECONDS
+        while self._flights and next(iter(self._flights.values())).started < cutoff:
+            self.finish(next(iter(self._flights)))
+
+
+coalescer = Coalescer()
@@ -1,15 +1,74 @@
-from sqlalchemy import create_engine
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "postgresql+psycopg2://postgres:postgres@db:5432/probeops"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+from utils.settings import DATABASE_URL, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_SIZE, DB_POOL_TIMEOUT
+
+# The one engine, session factory and Base of the backend. Stale connections
+# are caught by pool_pre_ping when they are checked out.
+POOL_OPTIONS = dict(
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+)
+
+engine = create_engine(DATABASE_URL, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Same database through asyncpg, for code running on the event loop
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql+psycopg2://", "postgresql+asyncpg://")
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **POOL_OPTIONS)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+_pool_counts = {}   # engine name: {event: count}
+_pool_lock = threading.Lock()
+
+def _count_pool_events(name, pool):
+    counts = _pool_counts[name] = {"connects": 0, "checkouts": 0, "invalidations": 0}
+
+    def bump(key):
+        def listener(*args):
+            with _pool_lock:
+                counts[key] += 1
+        return listener
+
+    event.listen(pool, "connect", bump("connects"))
+    event.listen(pool, "checkout", bump("checkouts"))
+    event.listen(pool, "invalidate", bump("invalidations"))
+
+_count_pool_events("sync", engine.pool)
+_count_pool_events("async", async_engine.sync_engine.pool)
+
+def pool_stats() -> dict:
+    """Current size and lifetime event counts of both connection pools."""
+    stats = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+        with _pool_lock:
+            counts = dict(_pool_counts[name])
+        stats[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            **counts,
+        }
+    return stats
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,4 +1,4 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
@@ -6,6 +6,7 @@ from models.user import User
 from core.database import get_db
 from utils.auth import get_user_by_username
 from utils.settings import SECRET_KEY, ALGORITHM
+from core.rate_limiter import enforce_rate_limit
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
@@ -30,6 +31,14 @@ def get_current_user(
         raise credentials_exception
     return user
 
+async def get_rate_limited_user(
+    request: Request,
+    current_user: User = Depends(get_current_user)
+) -> User:
+    """get_current_user, charging the request to the user's tier rate limits."""
+    await enforce_rate_limit(request, current_user.id)
+    return current_user
+
 def get_current_admin_user(
     current_user: User = Depends(get_current_user)
 ) -> User:
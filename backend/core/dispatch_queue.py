@@ -0,0 +1,204 @@
+import asyncio
+import math
+
+from core.node_selector import node_selector
+from utils.settings import MAX_QUEUE_WAIT_SECONDS, MAX_QUEUED_JOBS
+
+# Admission and ordering for user probes.
+#
+# A user may have at most their tier's max_concurrent_requests jobs on the
+# nodes; more wait here. Waiting jobs are served by priority class
+# (SubscriptionTier.request_priority, highest first) and, within a class,
+# by weighted fair queuing across users: every job gets a virtual finish
+# tag of max(class clock, user's last tag) + 1/weight and the lowest tag
+# goes next. A user submitting a thousand jobs therefore only delays others
+# by their fair share. Jobs that would wait too long are shed with a
+# QueueFull carrying a Retry-After estimate.
+
+USER_QUEUE_FACTOR = 2           # queued jobs allowed per user, as a multiple of the tier's cap
+RETRY_SECONDS = 0.1             # re-check node capacity while jobs wait
+SERVICE_TIME_ALPHA = 0.2        # EWMA weight for the Retry-After estimate
+MAX_RETRY_AFTER = 60
+
+
+class QueueFull(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(self, job_msg, meta, entitlement, region, timeout, use_cache, tag, seq):
+        self.job_msg = job_msg
+        self.meta = meta
+        self.entitlement = entitlement
+        self.region = region
+        self.timeout = timeout
+        self.use_cache = use_cache
+        self.tag = tag
+        self.seq = seq
+        self.enqueued_at = asyncio.get_running_loop().time()
+        self.started = asyncio.get_running_loop().create_future()
+
+
+class DispatchQueue:
+    """Per-worker queue in front of dispatch_job, see the module comment."""
+
+    def __init__(self, dispatch, abandon, no_node_error):
+        # dispatch_job, abandon_job and NoNodeAvailable from routers.probe_node_ws
+        self._dispatch = dispatch
+        self._abandon = abandon
+        self._no_node_error = no_node_error
+        self._classes = {}          # request_priority: [Ticket]
+        self._clock = {}            # request_priority: virtual time
+        self._finish = {}           # (request_priority, user_id): last virtual finish tag
+        self._running = {}          # user_id: jobs on the nodes
+        self._queued = {}           # user_id: jobs waiting here
+        self._seq = 0
+        self._service_time = 1.0
+        self._wakeup = None
+        self._pump_task = None
+
+    async def submit(self, job_msg, meta, entitlement, region=None, timeout=15, use_cache=True):
+        """Dispatch a user's job now or once it is their turn.
+
+        Returns (node_id, future, queue_time_seconds). Raises QueueFull when
+        the job can't be admitted or can't start within the wait limit, and
+        NoNodeAvailable when no node is connected at all.
+        """
+        user = entitlement.user_id
+        cls = entitlement.request_priority
+        loop = asyncio.get_running_loop()
+        if self._running.get(user, 0) < entitlement.max_concurrent_requests and not self._waiting_at_or_above(cls):
+            try:
+                node_id, future = await self._dispatch(
+                    job_msg, meta, region=region, timeout=timeout, use_cache=use_cache
+                )
+                self._track(user, future, loop.time())
+                return node_id, future, 0.0
+            except self._no_node_error:
+                # Nodes saturated: wait in line like everyone else
+                if not node_selector.has_nodes():
+                    raise
+
+        if self._queued.get(user, 0) >= entitlement.max_concurrent_requests * USER_QUEUE_FACTOR:
+            raise QueueFull("Too many queued requests for your plan", self.retry_after(entitlement))
+        if sum(self._queued.values()) >= MAX_QUEUED_JOBS:
+            raise QueueFull("Probe queue is full", self.retry_after(entitlement))
+
+        start = max(self._clock.get(cls, 0.0), self._finish.get((cls, user), 0.0))
+        tag = start + 1.0 / entitlement.weight
+        self._finish[(cls, user)] = tag
+        self._seq += 1
+        ticket = Ticket(job_msg, meta, entitlement, region, timeout, use_cache, tag, self._seq)
+        self._enqueue(ticket)
+        self._kick()
+
+        wait = min(MAX_QUEUE_WAIT_SECONDS, timeout)
+        try:
+            node_id, future = await asyncio.wait_for(asyncio.shield(ticket.started), wait)
+        except asyncio.TimeoutError:
+            if self._remove(ticket):
+                raise QueueFull("Probe queue is saturated", self.retry_after(entitlement))
+            # Being dispatched right now
+            node_id, future = await ticket.started
+        except asyncio.CancelledError:
+            if not self._remove(ticket):
+                # Dispatched, or about to be, for a caller that is gone
+                job_id = job_msg["job_id"]
+                ticket.started.add_done_callback(
+                    lambda started: started.exception() is None and self._abandon(job_id)
+                )
+            raise
+        return node_id, future, loop.time() - ticket.enqueued_at
+
+    def retry_after(self, entitlement) -> int:
+        queued = self._queued.get(entitlement.user_id, 0) + 1
+        seconds = self._service_time * queued / entitlement.max_concurrent_requests
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(seconds)))
+
+    def _waiting_at_or_above(self, cls):
+        return any(tickets for c, tickets in self._classes.items() if c >= cls)
+
+    def _track(self, user, future, started_at):
+        self._running[user] = self._running.get(user, 0) + 1
+        loop = asyncio.get_running_loop()
+
+        def release(_):
+            self._running[user] -= 1
+            if not self._running[user]:
+                self._running.pop(user)
+            self._service_time += SERVICE_TIME_ALPHA * (loop.time() - started_at - self._service_time)
+            self._kick()
+
+        future.add_done_callback(release)
+
+    def _enqueue(self, ticket):
+        user = ticket.entitlement.user_id
+        self._classes.setdefault(ticket.entitlement.request_priority, []).append(ticket)
+        self._queued[user] = self._queued.get(user, 0) + 1
+
+    def _remove(self, ticket) -> bool:
+        tickets = self._classes.get(ticket.entitlement.request_priority, [])
+        if ticket not in tickets:
+            return False
+        tickets.remove(ticket)
+        self._dequeued(ticket)
+        return True
+
+    def _dequeued(self, ticket):
+        user = ticket.entitlement.user_id
+        self._queued[user] -= 1
+        if not self._queued[user]:
+            self._queued.pop(user)
+            cls = ticket.entitlement.request_priority
+            if self._finish.get((cls, user), 0.0) <= self._clock.get(cls, 0.0):
+                self._finish.pop((cls, user), None)
+
+    def _kick(self):
+        if not any(self._classes.values()):
+            return
+        if self._pump_task is None or self._pump_task.done():
+            self._wakeup = asyncio.Event()
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+        self._wakeup.set()
+
+    async def _pump(self):
+        while any(self._classes.values()):
+            self._wakeup.clear()
+            if not await self._dispatch_next():
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), RETRY_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _dispatch_next(self) -> bool:
+        """Start the first waiting job that a node can take. Returns False if none could start."""
+        blocked = set()   # (tool, region) with no free node this round
+        for cls in sorted(self._classes, reverse=True):
+            for ticket in sorted(self._classes[cls], key=lambda t: (t.tag, t.seq)):
+                user = ticket.entitlement.user_id
+                key = (ticket.job_msg.get("job_type"), ticket.region)
+                if key in blocked or self._running.get(user, 0) >= ticket.entitlement.max_concurrent_requests:
+                    continue
+                self._classes[cls].remove(ticket)
+                self._dequeued(ticket)
+                self._clock[cls] = max(self._clock.get(cls, 0.0), ticket.tag - 1.0 / ticket.entitlement.weight)
+                remaining = max(1, ticket.timeout - (asyncio.get_running_loop().time() - ticket.enqueued_at))
+                try:
+                    node_id, future = await self._dispatch(
+                        ticket.job_msg, ticket.meta, region=ticket.region,
+                        timeout=remaining, use_cache=ticket.use_cache,
+                    )
+                except self._no_node_error:
+                    # Keeps its tag, so it is still first in line; try other tools/regions
+                    self._enqueue(ticket)
+                    blocked.add(key)
+                    continue
+                except Exception as e:
+                    ticket.started.set_exception(e)
+                    return True
+                self._track(user, future, asyncio.get_running_loop().time())
+                ticket.started.set_result((node_id, future))
+                return True
+        return False
@@ -0,0 +1,88 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from core.database import SessionLocal
+from models.subscription import SubscriptionTier, UserSubscription
+
+# Tier limits are read on every probe request, so they are cached per user
+# for a short while; a plan change takes effect within this many seconds.
+ENTITLEMENT_CACHE_SECONDS = 60
+
+# Users without an active subscription get the column defaults of SubscriptionTier
+DEFAULT_MAX_CONCURRENT_REQUESTS = 5
+DEFAULT_REQUEST_PRIORITY = 1
+DEFAULT_WEIGHT = 1
+RATE_LIMIT_WINDOWS = ("minute", "hour", "day", "month")
+
+
+class Entitlement:
+    """What one user's subscription tier allows at dispatch time."""
+
+    def __init__(self, user_id, tier=None):
+        self.user_id = user_id
+        self.tier_id = tier.id if tier else None
+        self.tier_name = tier.name if tier else None
+        self.max_concurrent_requests = (
+            tier.max_concurrent_requests if tier and tier.max_concurrent_requests else DEFAULT_MAX_CONCURRENT_REQUESTS
+        )
+        self.request_priority = (
+            tier.request_priority if tier and tier.request_priority is not None else DEFAULT_REQUEST_PRIORITY
+        )
+        # Share of the nodes against other users of the same priority class
+        self.weight = max(1, tier.priority or DEFAULT_WEIGHT) if tier else DEFAULT_WEIGHT
+        # window: requests allowed; windows without a limit are left out
+        self.rate_limits = {
+            window: getattr(tier, f"rate_limit_{window}")
+            for window in RATE_LIMIT_WINDOWS
+            if tier and getattr(tier, f"rate_limit_{window}")
+        }
+
+
+_cache = {}   # user_id: (loaded_at, Entitlement)
+_lock = threading.Lock()
+
+
+def load_entitlement(user_id) -> Entitlement:
+    if user_id is None:
+        return Entitlement(None)
+    db = SessionLocal()
+    try:
+        subscription = db.query(UserSubscription).filter(
+            UserSubscription.user_id == user_id,
+            UserSubscription.is_active.is_(True),
+        ).first()
+        if subscription is None or (
+            subscription.expires_at is not None and subscription.expires_at < datetime.now(timezone.utc)
+        ):
+            return Entitlement(user_id)
+        tier = db.query(SubscriptionTier).filter(SubscriptionTier.id == subscription.tier_id).first()
+        return Entitlement(user_id, tier)
+    finally:
+        db.close()
+
+
+def peek_entitlement(user_id):
+    """The cached Entitlement if it is still fresh, else None; never touches the DB."""
+    with _lock:
+        cached = _cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < ENTITLEMENT_CACHE_SECONDS:
+        return cached[1]
+    return None
+
+
+def get_entitlement(user_id) -> Entitlement:
+    """Cached load_entitlement; call from a threadpool, it may hit the DB."""
+    entitlement = peek_entitlement(user_id)
+    if entitlement is not None:
+        return entitlement
+    now = time.monotonic()
+    entitlement = load_entitlement(user_id)
+    with _lock:
+        _cache[user_id] = (now, entitlement)
+    return entitlement
+
+
+def forget_entitlement(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
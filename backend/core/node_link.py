@@ -0,0 +1,79 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger("node_link")
+
+# Protocol features this backend can speak; a node gets the intersection
+# with what it lists under "capabilities" at register time.
+SUPPORTED_CAPABILITIES = {"batch", "binary", "zlib", "resume", "cancel"}
+
+BATCH_FLUSH_SECONDS = 0.005
+BATCH_MAX_JOBS = 100
+
+
+def negotiate_capabilities(requested) -> set:
+    return SUPPORTED_CAPABILITIES & set(requested or ())
+
+
+class NodeLink:
+    """Outbound side of one node websocket.
+
+    Without the "batch" capability every job is its own frame, as before.
+    With it, jobs queued within BATCH_FLUSH_SECONDS of each other go out
+    together as one {"action": "jobs"} frame.
+    """
+
+    def __init__(self, websocket, capabilities=(), on_send_error=None):
+        self.websocket = websocket
+        self.capabilities = set(capabilities)
+        self._on_send_error = on_send_error
+        self._queue = []
+        self._flusher = None
+
+    async def send_job(self, job_msg: dict):
+        if "batch" not in self.capabilities:
+            await self.websocket.send_json(job_msg)
+            return
+        self._queue.append(job_msg)
+        if len(self._queue) >= BATCH_MAX_JOBS:
+            await self.flush()
+        elif self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(BATCH_FLUSH_SECONDS)
+        self._flusher = None
+        await self.flush()
+
+    async def flush(self):
+        batch, self._queue = self._queue, []
+        if not batch:
+            return
+        try:
+            await self.websocket.send_text(json.dumps({"action": "jobs", "jobs": batch}))
+        except Exception as e:
+            logger.error(f"Failed to send batch of {len(batch)} jobs: {e}")
+            if self._on_send_error:
+                await self._on_send_error(batch, e)
+
+    async def send_ack(self, job_ids: list):
+        """With "resume", confirm results so the node can drop them from its outbox."""
+        if "resume" in self.capabilities and job_ids:
+            await self.websocket.send_text(json.dumps({"action": "ack", "job_ids": job_ids}))
+
+    async def cancel_job(self, job_id: str) -> bool:
+        """Stop a job on the node. Returns True if it was still queued here and never sent."""
+        for i, job_msg in enumerate(self._queue):
+            if job_msg["job_id"] == job_id:
+                del self._queue[i]
+                return True
+        if "cancel" in self.capabilities:
+            await self.websocket.send_text(json.dumps({"action": "cancel", "job_id": job_id}))
+        return False
+
+    def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        return self._queue
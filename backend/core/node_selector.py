@@ -0,0 +1,175 @@
+import random
+import threading
+import time
+
+# ProbeNode.supported_tools uses a few capability names that differ from job types
+TOOL_ALIASES = {"http": "curl"}
+
+LATENCY_ALPHA = 0.2       # EWMA weight of the newest observation
+STALE_JOB_SECONDS = 300   # in-flight entries older than this are assumed lost
+REMOTE_NODE_TTL = 60      # nodes held by other workers expire without fresh announcements
+
+
+class NodeState:
+    def __init__(self, node_id, max_concurrent=10, supported_tools=None, priority=1, region=None,
+                 worker_id=None):
+        self.node_id = node_id
+        self.worker_id = worker_id  # None when this process holds the websocket
+        self.last_seen = time.monotonic()
+        self.max_concurrent = max(1, int(max_concurrent or 1))
+        self.supported_tools = set(supported_tools) if supported_tools else None
+        self.priority = priority or 1
+        self.region = region
+        self.in_flight = {}   # job_id: (tool, started_at)
+        self.latency = {}     # tool: EWMA seconds
+
+    def supports(self, tool):
+        return self.supported_tools is None or tool in self.supported_tools
+
+    def has_capacity(self):
+        return len(self.in_flight) < self.max_concurrent
+
+    def load(self):
+        return len(self.in_flight) / self.max_concurrent
+
+    def score(self, tool):
+        # Least loaded first, then higher priority, then faster for this tool
+        return (self.load(), -self.priority, self.latency.get(tool, 0.0))
+
+
+class NodeSelector:
+    """Tracks connected nodes and picks one per job with power-of-two choices."""
+
+    def __init__(self):
+        self._nodes = {}
+        self._jobs = {}  # job_id: node_id
+        self._lock = threading.Lock()
+
+    def add_node(self, node_id, max_concurrent=10, supported_tools=None, priority=1, region=None,
+                 worker_id=None):
+        with self._lock:
+            previous = self._nodes.get(node_id)
+            if previous and previous.worker_id is None and worker_id is not None:
+                # Another worker's announcement must not shadow our own socket
+                return
+            node = NodeState(node_id, max_concurrent, supported_tools, priority, region, worker_id)
+            if previous:
+                # Re-registration keeps jobs that are still running on the node
+                node.in_flight = previous.in_flight
+                node.latency = previous.latency
+            self._nodes[node_id] = node
+
+    def touch(self, node_id):
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node:
+                node.last_seen = time.monotonic()
+
+    def worker_for(self, node_id):
+        with self._lock:
+            node = self._nodes.get(node_id)
+            return node.worker_id if node else None
+
+    def has_node(self, node_id):
+        with self._lock:
+            return node_id in self._nodes
+
+    def has_nodes(self):
+        with self._lock:
+            return bool(self._nodes)
+
+    def local_nodes(self):
+        with self._lock:
+            return [n.node_id for n in self._nodes.values() if n.worker_id is None]
+
+    def remove_node(self, node_id, worker_id=None):
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is None or node.worker_id != worker_id:
+                return
+            self._nodes.pop(node_id)
+            for job_id in node.in_flight:
+                self._jobs.pop(job_id, None)
+
+    def select(self, tool, region=None, exclude=()):
+        with self._lock:
+            self._reap_stale()
+            candidates = [
+                n for n in self._nodes.values()
+                if n.node_id not in exclude
+                and n.supports(tool)
+                and n.has_capacity()
+                and (region is None or n.region == region)
+            ]
+            if not candidates:
+                return None
+            if len(candidates) > 2:
+                candidates = random.sample(candidates, 2)
+            return min(candidates, key=lambda n: n.score(tool)).node_id
+
+    def job_started(self, node_id, job_id, tool):
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node:
+                node.in_flight[job_id] = (tool, time.monotonic())
+                self._jobs[job_id] = node_id
+
+    def node_for(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def job_finished(self, job_id):
+        with self._lock:
+            node_id = self._jobs.pop(job_id, None)
+            node = self._nodes.get(node_id)
+            if not node or job_id not in node.in_flight:
+                return node_id
+            tool, started = node.in_flight.pop(job_id)
+            elapsed = time.monotonic() - started
+            previous = node.latency.get(tool)
+            node.latency[tool] = elapsed if previous is None else (
+                LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * previous
+            )
+            return node_id
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                node_id: {
+                    "in_flight": len(n.in_flight),
+                    "max_concurrent": n.max_concurrent,
+                    "priority": n.priority,
+                    "region": n.region,
+                    "worker_id": n.worker_id,
+                    "supported_tools": sorted(n.supported_tools) if n.supported_tools else None,
+                    "avg_latency_ms": {t: int(v * 1000) for t, v in n.latency.items()},
+                }
+                for node_id, n in self._nodes.items()
+            }
+
+    def _reap_stale(self):
+        now = time.monotonic()
+        for node_id, node in list(self._nodes.items()):
+            if node.worker_id is not None and now - node.last_seen > REMOTE_NODE_TTL:
+                self._nodes.pop(node_id)
+                for job_id in node.in_flight:
+                    self._jobs.pop(job_id, None)
+        cutoff = now - STALE_JOB_SECONDS
+        for node in self._nodes.values():
+            for job_id, (_, started) in list(node.in_flight.items()):
+                if started < cutoff:
+                    node.in_flight.pop(job_id)
+                    self._jobs.pop(job_id, None)
+
+
+def resolve_supported_tools(reported, configured):
+    """Tools a node reports it can run, minus any disabled on its ProbeNode row."""
+    tools = set(reported) if reported else None
+    if isinstance(configured, dict):
+        disabled = {TOOL_ALIASES.get(t, t) for t, enabled in configured.items() if not enabled}
+        if tools is not None:
+            tools -= disabled
+    return tools
+
+
+node_selector = NodeSelector()
@@ -0,0 +1,316 @@
+import math
+import time
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+from core.entitlements import get_entitlement, peek_entitlement
+from utils.settings import DATABASE_URL, RATE_LIMIT_BACKEND
+
+# SubscriptionTier.rate_limit_minute/hour/day/month, enforced per user.
+#
+# Every window is a sliding window counter: the count of the current fixed
+# bucket plus the previous bucket's count weighted by how much of it still
+# overlaps the window. On top of that a token bucket refilling at the
+# per-minute rate smooths bursts, so a minute's allowance can't all land in
+# the same second. Window counters live in a RateStore: in-process memory,
+# or Postgres so every worker and replica sees the same counts. Token
+# buckets are always local to the worker; a bucket that has refilled is
+# no different from a new one, so full buckets are dropped periodically.
+
+WINDOWS = {
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "month": 30 * 86400,
+}
+BURST_SECONDS = 10        # token bucket holds this many seconds' worth of the minute rate
+PRUNE_EVERY = 1000        # counter and bucket cleanup runs every this many checks
+
+
+def sliding_count(previous, current, window, now):
+    elapsed = now % window
+    return previous * (1 - elapsed / window) + current
+
+
+class MemoryRateStore:
+    def __init__(self):
+        self._counts = {}   # (user_id, window, bucket): requests
+        self._checks = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def acquire(self, user_id, limits, cost, now):
+        """Count `cost` requests if every window allows them.
+
+        Returns (allowed, {window: used}); when denied, `used` is the count
+        before this request and may stop at the window that refused it.
+        """
+        used = {}
+        for window, limit in limits.items():
+            size = WINDOWS[window]
+            bucket = int(now // size)
+            count = sliding_count(
+                self._counts.get((user_id, window, bucket - 1), 0),
+                self._counts.get((user_id, window, bucket), 0),
+                size, now,
+            )
+            used[window] = count
+            if count + cost > limit:
+                return False, used
+        for window in limits:
+            key = (user_id, window, int(now // WINDOWS[window]))
+            self._counts[key] = self._counts.get(key, 0) + cost
+            used[window] += cost
+        self._checks += 1
+        if self._checks % PRUNE_EVERY == 0:
+            self._prune(now)
+        return True, used
+
+    def _prune(self, now):
+        for key in list(self._counts):
+            _, window, bucket = key
+            if bucket < int(now // WINDOWS[window]) - 1:
+                del self._counts[key]
+
+
+class PostgresRateStore:
+    """Window counters in rate_limit_counters, shared by every worker on the database."""
+
+    def __init__(self, dsn):
+        self._dsn = dsn
+        self._pool = None
+        self._checks = 0
+
+    async def start(self):
+        import asyncpg
+
+        self._pool = await asyncpg.create_pool(self._dsn, min_size=1, max_size=5)
+
+    async def stop(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def acquire(self, user_id, limits, cost, now):
+        windows = list(limits)
+        buckets = [int(now // WINDOWS[w]) for w in windows]
+        expires = [(b + 2) * WINDOWS[w] for w, b in zip(windows, buckets)]
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    """
+                    INSERT INTO rate_limit_counters (user_id, window_name, bucket, count, expires_at)
+                    SELECT $1, w, b, $4, to_timestamp(e)
+                    FROM unnest($2::text[], $3::bigint[], $5::float8[]) AS t(w, b, e)
+                    ON CONFLICT (user_id, window_name, bucket)
+                    DO UPDATE SET count = rate_limit_counters.count + EXCLUDED.count
+                    RETURNING window_name, count
+                    """,
+                    user_id, windows, buckets, cost, expires,
+                )
+                current = {row["window_name"]: row["count"] for row in rows}
+                previous = {
+                    row["window_name"]: row["count"]
+                    for row in await conn.fetch(
+                        """
+                        SELECT window_name, count FROM rate_limit_counters
+                        WHERE user_id = $1 AND (window_name, bucket) IN (
+                            SELECT * FROM unnest($2::text[], $3::bigint[])
+                        )
+                        """,
+                        user_id, windows, [b - 1 for b in buckets],
+                    )
+                }
+                used = {
+                    w: sliding_count(previous.get(w, 0), current[w], WINDOWS[w], now) for w in windows
+                }
+                allowed = all(used[w] <= limits[w] for w in windows)
+                if not allowed:
+                    # Denied requests don't use up the allowance
+                    await conn.execute(
+                        """
+                        UPDATE rate_limit_counters SET count = count - $4
+                        WHERE user_id = $1 AND (window_name, bucket) IN (
+                            SELECT * FROM unnest($2::text[], $3::bigint[])
+                        )
+                        """,
+                        user_id, windows, buckets, cost,
+                    )
+                    used = {w: used[w] - cost for w in windows}
+            self._checks += 1
+            if self._checks % PRUNE_EVERY == 0:
+                await conn.execute("DELETE FROM rate_limit_counters WHERE expires_at < now()")
+        return allowed, used
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def level(self, now):
+        return min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+
+    def take(self, cost):
+        now = time.monotonic()
+        self.tokens = self.level(now)
+        self.updated = now
+        # A request costing more than the whole bucket may go into debt once it is full
+        if self.tokens < min(cost, self.capacity):
+            return False
+        self.tokens -= cost
+        return True
+
+    def refund(self, cost):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def wait_for(self, cost):
+        return max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, window, retry_after, headers):
+        super().__init__(f"Rate limit exceeded ({window})")
+        self.window = window
+        self.retry_after = retry_after
+        self.headers = headers
+
+
+class CostExceedsLimit(Exception):
+    """A single request costs more than a whole window allows, so no retry can succeed."""
+
+    def __init__(self, window, limit, cost):
+        super().__init__(f"Request costs {cost}, more than the {limit} per {window} your plan allows")
+        self.window = window
+        self.limit = limit
+        self.cost = cost
+
+
+class RateLimiter:
+    def __init__(self, store):
+        self.store = store
+        self._buckets = {}   # user_id: TokenBucket
+        self._checks = 0
+
+    def _bucket(self, user_id, per_minute):
+        rate = per_minute / 60
+        capacity = max(1, math.ceil(rate * BURST_SECONDS))
+        bucket = self._buckets.get(user_id)
+        if bucket is None or bucket.rate != rate:
+            bucket = self._buckets[user_id] = TokenBucket(rate, capacity)
+        return bucket
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for user_id, bucket in list(self._buckets.items()):
+            if bucket.level(now) >= bucket.capacity:
+                del self._buckets[user_id]
+
+    async def check(self, entitlement, cost=1):
+        """Charge `cost` requests to a user. Returns the rate-limit headers.
+
+        Raises RateLimitExceeded, or CostExceedsLimit if no window could ever fit `cost`.
+        """
+        limits = entitlement.rate_limits
+        if not limits:
+            return {}
+        for window, limit in limits.items():
+            if cost > limit:
+                raise CostExceedsLimit(window, limit, cost)
+        now = time.time()
+        self._checks += 1
+        if self._checks % PRUNE_EVERY == 0:
+            self._prune_buckets()
+        bucket = None
+        if "minute" in limits:
+            bucket = self._bucket(entitlement.user_id, limits["minute"])
+            if not bucket.take(cost):
+                retry_after = max(1, math.ceil(bucket.wait_for(cost)))
+                raise RateLimitExceeded("burst", retry_after, {
+                    **rate_limit_headers("minute", limits["minute"], 0, now),
+                    "Retry-After": str(retry_after),
+                })
+        try:
+            allowed, used = await self.store.acquire(entitlement.user_id, limits, cost, now)
+        except BaseException:
+            if bucket is not None:
+                bucket.refund(cost)
+            raise
+        if not allowed:
+            # Denied requests don't use up the burst allowance either
+            if bucket is not None:
+                bucket.refund(cost)
+            window = next(w for w in used if used[w] + cost > limits[w])
+            retry_after = max(1, math.ceil(WINDOWS[window] - now % WINDOWS[window]))
+            raise RateLimitExceeded(window, retry_after, {
+                **rate_limit_headers(window, limits[window], 0, now),
+                "Retry-After": str(retry_after),
+            })
+        # Report the window closest to running out
+        window = min(limits, key=lambda w: limits[w] - used[w])
+        remaining = max(0, math.floor(limits[window] - used[window]))
+        return rate_limit_headers(window, limits[window], remaining, now)
+
+
+def rate_limit_headers(window, limit, remaining, now):
+    size = WINDOWS[window]
+    return {
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(math.ceil(size - now % size)),
+        "X-RateLimit-Window": window,
+    }
+
+
+async def enforce_rate_limit(request: Request, user_id, cost=1):
+    """Charge a request to user_id; stashes the entitlement and headers on request.state."""
+    entitlement = peek_entitlement(user_id) or await run_in_threadpool(get_entitlement, user_id)
+    request.state.entitlement = entitlement
+    try:
+        headers = await rate_limiter.check(entitlement, cost)
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=e.headers)
+    except CostExceedsLimit as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    request.state.rate_limit_headers = headers
+    return entitlement
+
+
+class RateLimitHeadersMiddleware:
+    """Adds the headers enforce_rate_limit left in request.state to the response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        # request.state reads and writes this dict
+        state = scope.setdefault("state", {})
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = state.get("rate_limit_headers")
+                if headers:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (name.lower().encode(), value.encode()) for name, value in headers.items()
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+def create_rate_store():
+    if RATE_LIMIT_BACKEND == "postgres":
+        return PostgresRateStore(DATABASE_URL.replace("postgresql+psycopg2://", "postgresql://"))
+    return MemoryRateStore()
+
+
+rate_limiter = RateLimiter(create_rate_store())
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+from core.coalescer import job_key
+from utils.output_parsers import parse_output
+from utils.settings import RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTLS
+
+# Rough per-entry cost on top of the output itself (key tuple, dict, floats)
+ENTRY_OVERHEAD_BYTES = 256
+# Record TTLs above this are capped, so a huge TTL can't pin an entry for days
+MAX_DNS_TTL_SECONDS = 86400
+
+
+def cache_key(job_msg: dict, region: str = None):
+    """job_key of a cacheable job, or None. Cache options don't change what a probe measures."""
+    if not RESULT_CACHE_TTLS.get(job_msg.get("job_type")):
+        return None
+    return job_key(job_msg, region, ignore=("no_cache",))
+
+
+def result_ttl(tool: str, output) -> float:
+    ttl = RESULT_CACHE_TTLS.get(tool, 0)
+    if tool in ("dns", "rdns"):
+        min_ttl = parse_output(tool, output).get("details", {}).get("min_ttl")
+        if min_ttl is not None:
+            ttl = min(min_ttl, MAX_DNS_TTL_SECONDS)
+    return ttl
+
+
+class ResultCache:
+    """LRU of recent probe results, bounded by the total size of their outputs.
+
+    Only successful results are kept, each for its tool's TTL. Lookups may
+    ask for a younger result with max_age.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key: (stored_at, expires_at, node_id, result, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, max_age=None):
+        """(node_id, result, age in seconds) for a fresh entry, or None."""
+        try:
+            max_age = float(max_age) if max_age is not None else None
+        except (TypeError, ValueError):
+            max_age = None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._remove(key)
+                entry = None
+            if entry is None or (max_age is not None and now - entry[0] > max_age):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            stored_at, _, node_id, result, _ = entry
+            return node_id, dict(result), now - stored_at
+
+    def put(self, key, node_id, result, ttl):
+        if ttl <= 0 or not result.get("success") or result.get("cancelled"):
+            return
+        output = result.get("output") or ""
+        size = len(output) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (now, now + ttl, node_id, result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        # Caller holds self._lock
+        self._bytes -= self._entries.pop(key)[4]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+
+from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from core.database import async_engine
+from utils.settings import RESULT_WRITER_BATCH_SIZE, RESULT_WRITER_FLUSH_SECONDS
+
+logger = logging.getLogger("result_writer")
+
+# Callers waiting on their row (interactive requests) get it written within
+# this long, still batched with whatever else arrived meanwhile
+GROUP_COMMIT_SECONDS = 0.02
+RETRY_SECONDS = 1.0            # back-off while the database is unreachable
+MAX_BUFFERED_ROWS = 100_000    # beyond this the oldest rows are dropped
+DRAIN_TIMEOUT_SECONDS = 10
+
+
+def unreachable(e: Exception) -> bool:
+    """True for errors about the connection rather than the rows being written."""
+    return (
+        isinstance(e, (OSError, asyncio.TimeoutError, InterfaceError, OperationalError))
+        or getattr(e, "connection_invalidated", False)
+    )
+
+
+class ResultNotSaved(Exception):
+    """A waited row was dropped instead of written."""
+
+
+class ResultWriter:
+    """Write-behind buffer for result rows (JobResult, ProbeResult, ProbeMetric, UsageLog).
+
+    add() takes an unsaved ORM object and returns at once. Rows go out as
+    multi-row INSERTs, one transaction per flush, whenever a batch fills up
+    or the oldest buffered row has waited flush_seconds. Tables with a
+    unique job_id insert with ON CONFLICT (job_id) DO NOTHING, so a replayed
+    result can't fail the batch it lands in.
+    """
+
+    def __init__(self, batch_size=RESULT_WRITER_BATCH_SIZE, flush_seconds=RESULT_WRITER_FLUSH_SECONDS):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._rows = []       # (table, values, future or None), oldest first
+        self._flush_at = None
+        self._wakeup = None
+        self._task = None
+        self._closing = False
+        self.written = 0
+        self.dropped = 0
+
+    def add(self, obj, wait=False, urgent=None):
+        """Buffer obj for insertion.
+
+        With wait=True returns a future for the row's primary key once it is
+        committed, or None if a row with the same job_id already existed; it
+        raises ResultNotSaved if the row is dropped.
+        Waited rows are flushed within GROUP_COMMIT_SECONDS unless urgent=False.
+        """
+        if urgent is None:
+            urgent = wait
+        loop = asyncio.get_running_loop()
+        values = {}
+        for prop in inspect(obj).mapper.column_attrs:
+            value = getattr(obj, prop.key)
+            # Unset columns get their Column default, as with session.add()
+            if value is not None:
+                values[prop.columns[0].key] = value
+        future = loop.create_future() if wait else None
+        while len(self._rows) >= MAX_BUFFERED_ROWS:
+            self._drop(self._rows.pop(0), "result buffer full")
+        self._rows.append((obj.__table__, values, future))
+
+        flush_at = loop.time() + (GROUP_COMMIT_SECONDS if urgent else self.flush_seconds)
+        if self._flush_at is None or flush_at < self._flush_at:
+            self._flush_at = flush_at
+        self._kick(urgent=urgent or len(self._rows) >= self.batch_size)
+        return future
+
+    async def stop(self):
+        """Write out everything buffered; call on shutdown."""
+        self._closing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + DRAIN_TIMEOUT_SECONDS
+        # Commit callbacks may queue follow-up rows (metrics), which start a new task
+        while self._task is not None and not self._task.done():
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), max(0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                self._task.cancel()
+                for row in self._rows:
+                    self._drop(row, "shutdown")
+                self._rows = []
+                break
+            await asyncio.sleep(0)
+        logger.info(f"Result writer drained, {self.written} rows written, {self.dropped} dropped")
+
+    def stats(self):
+        return {"buffered": len(self._rows), "written": self.written, "dropped": self.dropped}
+
+    def _kick(self, urgent=False):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if urgent:
+            self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._rows:
+            delay = self._flush_at - loop.time() if self._flush_at is not None else 0
+            if delay > 0 and len(self._rows) < self.batch_size and not self._closing:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if not await self._flush():
+                await asyncio.sleep(RETRY_SECONDS)
+
+    async def _flush(self) -> bool:
+        """Write the oldest batch. Returns False if the database couldn't be reached."""
+        batch, self._rows = self._rows[:self.batch_size], self._rows[self.batch_size:]
+        if not self._rows:
+            self._flush_at = None
+        try:
+            await self._insert(batch)
+            return True
+        except Exception as e:
+            if unreachable(e):
+                return self._requeue(batch, e)
+            if len(batch) == 1:
+                self._drop(batch[0], e)
+                return True
+            logger.warning(f"Batch of {len(batch)} rows failed ({e}), writing them one by one")
+        # Isolate the bad rows so the rest of the batch still gets stored
+        for i, row in enumerate(batch):
+            try:
+                await self._insert([row])
+            except Exception as e:
+                if unreachable(e):
+                    return self._requeue(batch[i:], e)
+                self._drop(row, e)
+        return True
+
+    async def _insert(self, rows):
+        groups = {}   # (table, columns): rows; executemany needs the same keys in every row
+        for row in rows:
+            groups.setdefault((row[0], frozenset(row[1])), []).append(row)
+        resolved = []
+        async with async_engine.begin() as conn:
+            for (table, _), group in groups.items():
+                params = [values for _, values, _ in group]
+                stmt = insert(table)
+                conflict = "job_id" if "job_id" in table.c and table.c.job_id.unique else None
+                if conflict:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=[conflict])
+                if not any(future for _, _, future in group):
+                    await conn.execute(stmt, params)
+                    continue
+                pk = list(table.primary_key.columns)[0]
+                if conflict:
+                    # Skipped duplicates return nothing, so match rows up by job_id
+                    result = await conn.execute(stmt.returning(pk, table.c[conflict]), params)
+                    ids = {key: row_id for row_id, key in result}
+                    resolved += [(future, ids.get(values.get(conflict))) for _, values, future in group]
+                else:
+                    result = await conn.execute(stmt.returning(pk, sort_by_parameter_order=True), params)
+                    resolved += [(future, row_id) for (_, _, future), (row_id,) in zip(group, result)]
+        self.written += len(rows)
+        for future, row_id in resolved:
+            if future is not None and not future.done():
+                future.set_result(row_id)
+
+    def _requeue(self, batch, error) -> bool:
+        logger.warning(f"Database unreachable ({error}), keeping {len(batch)} rows for retry")
+        self._rows[:0] = batch
+        self._flush_at = asyncio.get_running_loop().time()
+        return False
+
+    def _drop(self, row, reason):
+        table, values, future = row
+        self.dropped += 1
+        logger.error(f"Dropped {table.name} row for job {values.get('job_id')}: {reason}")
+        if future is not None and not future.done():
+            future.set_exception(ResultNotSaved(f"Result not saved: {reason}"))
+
+
+result_writer = ResultWriter()
@@ -0,0 +1,97 @@
+import base64
+import json
+import struct
+import zlib
+
+# Binary result frames (capability "binary"):
+#
+#   MAGIC (4 bytes) | header length (uint32, big endian) | header JSON | payload
+#
+# The header is small JSON with the routing fields. For a single result it is
+# {"action": "result", "job_id": ..., "success": ...} and the payload is the
+# raw tool output. For a batch it is {"action": "results", "results": [...]}
+# where each entry also carries "length", and the payload is the outputs
+# concatenated in the same order. Outputs are never JSON-escaped, so the
+# backend only parses the header to route a result.
+#
+# With the "zlib" capability a node may compress an output; its header entry
+# then carries "enc": "zlib". The backend keeps the compressed bytes while
+# routing (base64 over the broker) and inflates only on delivery.
+MAGIC = b"PNB1"
+_PREFIX = struct.Struct(">4sI")
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encode_frame(header: dict, payload: bytes = b"") -> bytes:
+    header_bytes = json.dumps(header).encode()
+    return _PREFIX.pack(MAGIC, len(header_bytes)) + header_bytes + payload
+
+
+def decode_frame(frame: bytes):
+    """Split a frame into (header, payload) without touching the payload."""
+    if len(frame) < _PREFIX.size:
+        raise FrameError("Frame too short")
+    magic, header_len = _PREFIX.unpack_from(frame)
+    if magic != MAGIC:
+        raise FrameError("Bad frame magic")
+    start = _PREFIX.size
+    end = start + header_len
+    if end > len(frame):
+        raise FrameError("Truncated frame header")
+    header = json.loads(frame[start:end])
+    return header, memoryview(frame)[end:]
+
+
+def iter_results(frame: bytes):
+    """Yield (header, output bytes) for each result in a binary result frame."""
+    header, payload = decode_frame(frame)
+    if header.get("action") == "result":
+        yield header, payload
+        return
+    if header.get("action") != "results":
+        raise FrameError(f"Unexpected binary action: {header.get('action')}")
+    offset = 0
+    for entry in header.get("results", []):
+        length = entry.get("length", 0)
+        if offset + length > len(payload):
+            raise FrameError("Result payload shorter than declared")
+        yield entry, payload[offset:offset + length]
+        offset += length
+
+
+def result_from_frame(header: dict, output) -> dict:
+    return {
+        "job_id": header.get("job_id"),
+        "success": header.get("success", True),
+        "output": bytes(output),
+        "encoding": header.get("enc", "identity"),
+        "duration_ms": header.get("duration_ms"),
+        "origin": header.get("origin"),
+        "cancelled": header.get("cancelled", False),
+    }
+
+
+def output_text(result: dict) -> str:
+    """The output of a result as text, whatever form it travelled in."""
+    output = result.get("output")
+    encoding = result.get("encoding")
+    if encoding is None:
+        return output
+    if isinstance(output, str):
+        # bytes that went through the broker as base64
+        output = base64.b64decode(output)
+    if encoding == "zlib":
+        output = zlib.decompress(output)
+    elif encoding != "identity":
+        raise FrameError(f"Unknown output encoding: {encoding}")
+    return bytes(output).decode("utf-8", "replace")
+
+
+def portable_result(result: dict) -> dict:
+    """JSON-safe copy of a result that keeps raw/compressed output as base64."""
+    if isinstance(result.get("output"), (bytes, bytearray, memoryview)):
+        return {**result, "output": base64.b64encode(result["output"]).decode()}
+    return result
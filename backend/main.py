@@ -1,19 +1,27 @@
 # This is Backend main.py
 
+import asyncio
 from fastapi import FastAPI, Depends, APIRouter
+from fastapi.concurrency import run_in_threadpool
 from routers.auth import router as auth_router
 from schemas.user_schema import UserRead, UserLogin
-from core.dependencies import get_current_user
-from routers import users, probe_node_ws, api_keys, diagnostics, scheduled_probes
+from core.dependencies import get_current_user, get_current_admin_user
+from core.database import pool_stats
+from routers import users, probe_node_ws, api_keys, diagnostics, scheduled_probes, jobs
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from scheduler import scheduler, load_and_schedule_all_probes
+from scheduler import scheduler, load_and_schedule_all_probes, campaign_for_leadership
+from core.broker import broker
+from core.rate_limiter import rate_limiter, RateLimitHeadersMiddleware
+from core.result_writer import result_writer
+from core.result_cache import result_cache
 
 
 
 app = FastAPI()
 
 app.add_middleware(GZipMiddleware, minimum_size=1)
+app.add_middleware(RateLimitHeadersMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,6 +41,7 @@ def read_root():
 # Register your /auth endpoints
 app.include_router(auth_router, prefix="/auth")
 app.include_router(probe_node_ws.router)
+app.include_router(jobs.router)
 app.include_router(api_keys.router)
 
 # Protected route example
@@ -42,7 +51,29 @@ def read_protected(current_user: UserRead = Depends(get_current_user)):
 
 app.include_router(users.router)
 
+@app.get("/metrics/db")
+def read_db_metrics(current_user: UserRead = Depends(get_current_admin_user)):
+    return {
+        "pools": pool_stats(),
+        "result_writer": result_writer.stats(),
+        "result_cache": result_cache.stats(),
+    }
+
 @app.on_event("startup")
-def startup_event():
-    load_and_schedule_all_probes()
+async def startup_event():
+    await broker.start()
+    await rate_limiter.store.start()
+    await probe_node_ws.start_node_routing()
     scheduler.start()
+    await run_in_threadpool(load_and_schedule_all_probes)
+    app.state.leader_task = asyncio.create_task(campaign_for_leadership())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.leader_task.cancel()
+    await scheduler.shutdown()
+    # Results still buffered are written before the process exits
+    await result_writer.stop()
+    await broker.stop()
+    await rate_limiter.store.stop()
+
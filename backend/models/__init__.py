@@ -7,3 +7,6 @@ from .probe_result import ProbeResult
 from .job_result import JobResult
 from .probe_node import ProbeNode, NodeDiagnostic, NodeRegistrationToken
 from .logging import ApiUsageLog, UsageLog, SystemMetric
+from .broker_payload import BrokerPayload
+from .probe_metric import ProbeMetric
+from .rate_limit import RateLimitCounter
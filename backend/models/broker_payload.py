@@ -0,0 +1,11 @@
+from sqlalchemy import Column, BigInteger, DateTime, Text
+from datetime import datetime, timezone
+from core.database import Base
+
+class BrokerPayload(Base):
+    """Broker messages too large for a Postgres NOTIFY payload (see core/broker.py)."""
+    __tablename__ = "broker_payloads"
+
+    id = Column(BigInteger, primary_key=True)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
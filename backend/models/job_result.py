@@ -1,6 +1,6 @@
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
 from datetime import datetime, timezone
-from .database import Base  # Adjust import based on your project
+from core.database import Base
 
 class JobResult(Base):
     __tablename__ = "job_results"
@@ -1,7 +1,7 @@
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
-from .database import Base
+from core.database import Base
 
 class ApiUsageLog(Base):
     __tablename__ = "api_usage_logs"
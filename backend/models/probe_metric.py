@@ -0,0 +1,34 @@
+from sqlalchemy import Column, BigInteger, Integer, String, Boolean, DateTime, Float, ForeignKey, JSON, Index
+from datetime import datetime, timezone
+from core.database import Base
+
+class ProbeMetric(Base):
+    """Typed metrics parsed from one probe result (see utils/output_parsers.py).
+
+    One row per JobResult (by job_id) or ProbeResult (by scheduled_probe_id),
+    so latency and loss queries never have to read the output text.
+    """
+    __tablename__ = "probe_metrics"
+
+    id = Column(BigInteger, primary_key=True)
+    job_id = Column(String, index=True, nullable=True)
+    scheduled_probe_id = Column(Integer, ForeignKey("scheduled_probes.id", ondelete="CASCADE"), nullable=True)
+    tool = Column(String, nullable=False)
+    target = Column(String)
+    success = Column(Boolean)
+    duration_ms = Column(Float, nullable=True)
+    rtt_min_ms = Column(Float, nullable=True)
+    rtt_avg_ms = Column(Float, nullable=True)
+    rtt_max_ms = Column(Float, nullable=True)
+    rtt_stddev_ms = Column(Float, nullable=True)
+    packet_loss_pct = Column(Float, nullable=True)
+    hop_count = Column(Integer, nullable=True)
+    http_status = Column(Integer, nullable=True)
+    open_ports = Column(JSON, nullable=True)
+    details = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("ix_probe_metrics_tool_target_created_at", "tool", "target", "created_at"),
+        Index("ix_probe_metrics_scheduled_probe_id_created_at", "scheduled_probe_id", "created_at"),
+    )
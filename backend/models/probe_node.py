@@ -1,7 +1,7 @@
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON, Float
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
-from .database import Base
+from core.database import Base
 
 class ProbeNode(Base):
     __tablename__ = "probe_nodes"
@@ -1,7 +1,7 @@
 from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
-from .database import Base
+from core.database import Base
 
 class ProbeResult(Base):
     __tablename__ = "probe_results"
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, BigInteger, DateTime, Integer, String, Index
+from core.database import Base
+
+class RateLimitCounter(Base):
+    """Shared rate-limit window counters (see core/rate_limiter.py)."""
+    __tablename__ = "rate_limit_counters"
+
+    user_id = Column(Integer, primary_key=True)
+    window_name = Column(String, primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_rate_limit_counters_expires_at", "expires_at"),
+    )
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from models.database import get_db
+from core.database import get_db
 from models.user import User
 from schemas.user_schema import UserLogin, UserRead
 from utils.hashing import verify_password
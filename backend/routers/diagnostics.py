@@ -1,21 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from models.job_result import JobResult
 from models.user import User
+from utils.output_parsers import build_probe_metric
+from utils.usage import build_usage_log
 from datetime import datetime
 from typing import Dict, Any
 import uuid
+import time
 import asyncio
 
 from core.database import get_db
-from core.dependencies import get_current_user
+from core.result_writer import result_writer, ResultNotSaved
+from core.dependencies import get_current_user, get_rate_limited_user
+from core.dispatch_queue import QueueFull
 
-from routers.probe_node_ws import connected_nodes, pending_results, pending_meta
+from routers.probe_node_ws import (
+    ClientDisconnected, dispatch_queue, NoNodeAvailable, PROBE_TIMEOUT, wait_for_result,
+)
+from core.node_selector import node_selector
 
 router = APIRouter()
 
 from pydantic import BaseModel
-from sqlalchemy.exc import IntegrityError
 
 class DiagnosticRequest(BaseModel):
     tool: str
@@ -30,16 +37,17 @@ class DiagnosticResponse(BaseModel):
     port: int | None = None
     execution_time: int | None = None
     created_at: datetime
+    cached: bool = False
+    cache_age: float | None = None
 
 @router.post("/run", response_model=DiagnosticResponse)
 async def run_diagnostic(
     req: DiagnosticRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    current_user: User = Depends(get_rate_limited_user)
 ):
-    if not connected_nodes:
+    if not node_selector.has_nodes():
         raise HTTPException(status_code=503, detail="No probe nodes connected")
-    node_id = next(iter(connected_nodes.keys()))
 
     # Always generate a fresh job_id for each run
     job_id = str(uuid.uuid4())
@@ -67,28 +75,33 @@ async def run_diagnostic(
         "params": params
     }
 
-    loop = asyncio.get_running_loop()
-    future = loop.create_future()
-    pending_results[job_id] = future
-    pending_meta[job_id] = {
+    meta = {
         "job_type": tool,
         "target": target,
         "params": params,
         "user_id": current_user.id
     }
-
-    await connected_nodes[node_id].send_json(job_msg)
-    print(f"JOB SENT to node {node_id} for job_id: {job_id}")
+    entitlement = request.state.entitlement
+    started = time.monotonic()
+    try:
+        node_id, future, queue_time = await dispatch_queue.submit(
+            job_msg, meta, entitlement, region=params.get("region"), timeout=PROBE_TIMEOUT
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except NoNodeAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    print(f"JOB SENT to node {node_id} for job_id: {job_id} after {queue_time:.3f}s in queue")
 
     try:
-        output = await asyncio.wait_for(future, timeout=15)
+        output = await wait_for_result(job_id, future, max(1, PROBE_TIMEOUT - queue_time), request)
         print(f"DEBUG: output for job_id {job_id} =", output)
 
         # Defensive handling
         if isinstance(output, dict):
             status_str = "success" if output.get("success") else "failure"
             result_str = output.get("output", "")
-            duration = output.get("duration", 0)
+            duration = int(output.get("duration_ms") or 0)
         elif isinstance(output, str):
             status_str = "success"
             result_str = output
@@ -98,13 +111,7 @@ async def run_diagnostic(
             result_str = str(output)
             duration = 0
 
-        # --- SANITY CHECK for duplicate job_id before save ---
-        existing = db.query(JobResult).filter_by(job_id=job_id).first()
-        if existing:
-            print(f"WARN: JobResult with job_id={job_id} already exists in DB! Not saving duplicate.")
-            raise HTTPException(status_code=400, detail="Duplicate job detected by existence check.")
-
-        # Save as JobResult (ad-hoc/manual run)
+        # Save as JobResult (ad-hoc/manual run); a job_id already in the DB is not inserted again
         print(f"SAVING TO DB: job_id={job_id}, user={current_user.id}, status={status_str}")
         job_result = JobResult(
             job_id=job_id,
@@ -117,17 +124,26 @@ async def run_diagnostic(
             created_at=datetime.utcnow(),
         )
         try:
-            db.add(job_result)
-            db.commit()
-            db.refresh(job_result)
-            print(f"SUCCESS: job_id={job_id} committed to DB.")
-        except IntegrityError as e:
-            db.rollback()
+            result_id = await result_writer.add(job_result, wait=True)
+        except ResultNotSaved as e:
             print(f"DB Error: {e}")
+            raise HTTPException(status_code=503, detail="Probe finished but its result could not be saved. Please retry.")
+        if result_id is None:
+            print(f"WARN: JobResult with job_id={job_id} already exists in DB! Not saving duplicate.")
             raise HTTPException(status_code=400, detail="Duplicate job detected. Please retry.")
+        result_writer.add(build_probe_metric(
+            tool, target, result_str, status_str == "success", duration or None, job_id=job_id,
+        ))
+        result_writer.add(build_usage_log(
+            entitlement, "/diagnostics/run", status_str == "success",
+            response_time_ms=round((time.monotonic() - started) * 1000, 1),
+            queue_time_ms=round(queue_time * 1000, 1),
+            ip_address=request.client.host if request.client else None,
+        ))
+        print(f"SUCCESS: job_id={job_id} committed to DB.")
 
         return DiagnosticResponse(
-            id=job_result.id,
+            id=result_id,
             tool=tool,
             target=target,
             status=status_str,
@@ -135,12 +151,15 @@ async def run_diagnostic(
             port=port,
             execution_time=duration,
             created_at=job_result.created_at,
+            cached=isinstance(output, dict) and output.get("cached", False),
+            cache_age=output.get("cache_age") if isinstance(output, dict) else None,
         )
     except asyncio.TimeoutError:
-        pending_results.pop(job_id, None)
-        pending_meta.pop(job_id, None)
         print(f"TIMEOUT: No result from probe node for job_id={job_id}")
         raise HTTPException(status_code=504, detail="Probe node did not return result in time.")
+    except ClientDisconnected:
+        print(f"CANCELLED: client went away, job_id={job_id} cancelled on node {node_id}")
+        raise HTTPException(status_code=499, detail="Client closed request.")
 
 @router.get("/history", response_model=list[DiagnosticResponse])
 def get_history(
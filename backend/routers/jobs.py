@@ -0,0 +1,184 @@
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from utils.apikey import get_api_key, get_rate_limited_api_key
+from core.database import AsyncSessionLocal
+from core.broker import broker, WORKER_ID
+from core.node_selector import node_selector
+from core.dispatch_queue import QueueFull
+from models.job_result import JobResult
+from routers.probe_node_ws import (
+    dispatch_queue, NoNodeAvailable, queue_full_response, wait_for_result,
+    build_probe_job, save_background_result, job_result_dict,
+)
+from utils.usage import save_usage_log
+from typing import List
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger("jobs")
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+JOBS_CHANNEL = "probe_jobs"
+SUBMITTED_JOB_TIMEOUT = 120   # submitted jobs can wait longer than held-open requests
+SSE_KEEPALIVE_SECONDS = 15
+SSE_MAX_STREAM_SECONDS = 600
+
+job_watchers = {}    # job_id: set of asyncio.Queue waiting for that job
+_job_tasks = set()   # keeps completion tasks alive until they finish
+
+
+async def load_job_result(job_id: str, user_id: int):
+    async with AsyncSessionLocal() as db:
+        row = await db.scalar(select(JobResult).where(
+            JobResult.job_id == job_id, JobResult.user_id == user_id
+        ))
+        return jsonable_encoder(job_result_dict(row)) if row else None
+
+def notify_watchers(job_id: str, payload: dict):
+    for queue in job_watchers.get(job_id, ()):
+        queue.put_nowait(payload)
+
+async def complete_submitted_job(job_id: str, future, meta: dict, entitlement, queue_time: float):
+    """Wait for a submitted job, persist it and tell anyone streaming it."""
+    loop = asyncio.get_running_loop()
+    started = loop.time() - queue_time
+    try:
+        result = await wait_for_result(job_id, future, SUBMITTED_JOB_TIMEOUT)
+    except asyncio.TimeoutError:
+        result = {"output": "Probe timeout, node did not respond in time", "success": False}
+    output, success = result.get("output"), result.get("success", True)
+    try:
+        # Stored before anyone is told, so streams reading the row back find it
+        await save_background_result(job_id, meta, output, success, result.get("duration_ms"), urgent=True)
+    except Exception as e:
+        logger.error(f"Could not save result of job {job_id}: {e}")
+    save_usage_log(
+        entitlement, "/jobs", success,
+        response_time_ms=round((loop.time() - started) * 1000, 1),
+        queue_time_ms=round(queue_time * 1000, 1),
+        api_key_id=meta.get("api_key_id"),
+    )
+    notify_watchers(job_id, {
+        "job_id": job_id,
+        "job_type": meta.get("job_type"),
+        "target": meta.get("target"),
+        "port": meta.get("port"),
+        "output": output,
+        "success": success,
+        "cached": result.get("cached", False),
+        "user_id": meta.get("user_id"),
+    })
+    # Streams held by other workers read the row back from the DB
+    await broker.publish(JOBS_CHANNEL, {"type": "job_done", "job_id": job_id, "worker_id": WORKER_ID})
+
+async def on_job_event(msg: dict):
+    if msg.get("worker_id") == WORKER_ID or msg["job_id"] not in job_watchers:
+        return
+    notify_watchers(msg["job_id"], {"job_id": msg["job_id"], "from_db": True})
+
+broker.subscribe(JOBS_CHANNEL, on_job_event)
+
+
+@router.post("", status_code=202)
+async def submit_job(data: dict, request: Request, api_key=Depends(get_rate_limited_api_key)):
+    """Queue a probe and return at once; fetch the result via /jobs/events or /job-result."""
+    if not node_selector.has_nodes():
+        return JSONResponse({"error": "No probe nodes connected"}, status_code=503)
+    job_msg, meta, error = build_probe_job(data, api_key)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+    job_id = job_msg["job_id"]
+    entitlement = request.state.entitlement
+    try:
+        node_id, future, queue_time = await dispatch_queue.submit(
+            job_msg, meta, entitlement, region=data.get("region"), timeout=SUBMITTED_JOB_TIMEOUT
+        )
+    except QueueFull as e:
+        return queue_full_response(e)
+    except NoNodeAvailable as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+
+    task = asyncio.create_task(complete_submitted_job(job_id, future, meta, entitlement, queue_time))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return JSONResponse({
+        "job_id": job_id,
+        "status": "queued",
+        "events_url": f"/jobs/events?job_id={job_id}",
+        "result_url": f"/job-result/{job_id}",
+    }, status_code=202)
+
+
+@router.get("/events")
+async def stream_job_results(
+    request: Request,
+    job_id: List[str] = Query(...),
+    api_key=Depends(get_api_key),
+):
+    """Server-Sent Events stream with one `result` event per requested job.
+
+    The stream closes once every job has reported (or after
+    SSE_MAX_STREAM_SECONDS), so one connection can follow many jobs.
+    """
+    user_id = api_key.user_id
+    remaining = set(job_id)
+    queue = asyncio.Queue()
+    for jid in remaining:
+        job_watchers.setdefault(jid, set()).add(queue)
+
+    def format_event(event: str, payload: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(jsonable_encoder(payload))}\n\n"
+
+    async def events():
+        try:
+            # Jobs that finished before we subscribed are already in the DB
+            for jid in list(remaining):
+                row = await load_job_result(jid, user_id)
+                if row:
+                    remaining.discard(jid)
+                    yield format_event("result", row)
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + SSE_MAX_STREAM_SECONDS
+            while remaining and loop.time() < deadline:
+                if await request.is_disconnected():
+                    return
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                jid = payload["job_id"]
+                if jid not in remaining:
+                    continue
+                if payload.get("from_db"):
+                    payload = await load_job_result(jid, user_id)
+                    if payload is None:
+                        continue
+                elif payload.get("user_id") != user_id:
+                    continue
+                else:
+                    # Shared with other streams' queues, so copy rather than pop
+                    payload = {k: v for k, v in payload.items() if k != "user_id"}
+                remaining.discard(jid)
+                yield format_event("result", payload)
+
+            for jid in remaining:
+                yield format_event("timeout", {"job_id": jid})
+        finally:
+            for jid in job_id:
+                watchers = job_watchers.get(jid)
+                if watchers:
+                    watchers.discard(queue)
+                    if not watchers:
+                        job_watchers.pop(jid, None)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
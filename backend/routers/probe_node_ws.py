@@ -1,13 +1,28 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from utils.apikey import get_api_key
-from core.database import get_db
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from utils.apikey import get_api_key, get_rate_limited_api_key
+from core.database import get_async_db, SessionLocal
+from core.result_writer import result_writer
 from models.job_result import JobResult
+from models.probe_node import ProbeNode
+from core.node_selector import node_selector, resolve_supported_tools
+from core.broker import broker, worker_channel, WORKER_ID, NODES_CHANNEL
+from core.node_link import NodeLink, negotiate_capabilities
+from core.coalescer import coalescer, coalesce_key
+from core.result_cache import cache_key, result_cache, result_ttl
+from core.dispatch_queue import DispatchQueue, QueueFull
+from core.rate_limiter import enforce_rate_limit
+from utils.usage import build_usage_log, save_usage_log
+from core.wire import iter_results, result_from_frame, output_text, portable_result
+from utils.output_parsers import build_probe_metric
 import json
 import time
 import uuid
 import asyncio
+from collections import OrderedDict
 from datetime import datetime
 import logging
 
@@ -21,75 +36,451 @@ connected_nodes = {}  # node_id: websocket
 node_status = {}      # node_id: last_seen_timestamp
 pending_results = {}  # job_id: asyncio.Future
 pending_meta = {}     # job_id: dict
+job_origins = {}      # job_id: worker that dispatched a job running on one of our nodes
+local_node_config = {}  # node_id: scheduling attributes announced to other workers
+node_links = {}       # node_id: NodeLink (outbound framing for that websocket)
+# Meta of jobs whose caller gave up, so a result replayed after a node
+# reconnects can still be stored as a background result
+late_meta = OrderedDict()        # job_id: (abandoned_at, meta)
+delivered_jobs = OrderedDict()   # job_id: None, recent results already handled
+cache_keys = OrderedDict()       # job_id: (result cache key, node_id) of cacheable jobs out on nodes
+LATE_RESULT_SECONDS = 3600
+RECENT_JOBS_MAX = 10000
+_cancel_tasks = set()  # keeps cancel sends alive until they finish
 
 router = APIRouter()
 
+DEFAULT_MAX_CONCURRENT_PROBES = 10
+PROBE_TIMEOUT = 15
+# How often a held-open request checks whether its client is still there
+DISCONNECT_POLL_SECONDS = 1.0
+
+class NoNodeAvailable(Exception):
+    pass
+
+class ClientDisconnected(Exception):
+    pass
+
+def load_node_config(node_name: str, msg: dict) -> dict:
+    """Scheduling attributes for a node: the ProbeNode row wins over what the node reports."""
+    config = {
+        "max_concurrent": int(msg.get("max_concurrent_probes") or DEFAULT_MAX_CONCURRENT_PROBES),
+        "supported_tools": msg.get("supported_tools"),
+        "priority": 1,
+        "region": msg.get("region"),
+    }
+    db = SessionLocal()
+    try:
+        node = db.query(ProbeNode).filter(ProbeNode.name == node_name).first()
+        if node:
+            config["max_concurrent"] = node.max_concurrent_probes or config["max_concurrent"]
+            config["priority"] = node.priority or 1
+            config["region"] = node.region or config["region"]
+            config["supported_tools"] = resolve_supported_tools(
+                config["supported_tools"], node.supported_tools
+            )
+    except Exception as e:
+        logger.error(f"Could not load ProbeNode config for {node_name}: {e}")
+    finally:
+        db.close()
+    return config
+
+async def send_to_node(node_id: str, job_msg: dict, origin: str):
+    """Send a job to a node whose websocket this worker holds."""
+    link = node_links.get(node_id)
+    if link is None:
+        raise NoNodeAvailable(f"Node {node_id} is not connected to this worker")
+    job_origins[job_msg["job_id"]] = origin
+    # The node echoes the origin back, so a result replayed to another worker still finds home
+    await link.send_job({**job_msg, "origin": origin})
+
+async def fail_unsent_jobs(jobs: list, error):
+    for job_msg in jobs:
+        await route_result(job_msg["job_id"], {
+            "output": f"Failed to send job to node: {error}",
+            "success": False,
+        })
+
+async def forward_job(node_id: str, job_msg: dict):
+    """Send a job to a node, via the broker if another worker holds its websocket."""
+    worker_id = node_selector.worker_for(node_id)
+    if worker_id is None:
+        await send_to_node(node_id, job_msg, WORKER_ID)
+    else:
+        await broker.publish(worker_channel(worker_id), {
+            "type": "job",
+            "node_id": node_id,
+            "origin": WORKER_ID,
+            "job": job_msg,
+        })
+
+async def dispatch_job(job_msg: dict, meta: dict, region: str = None, timeout: float = None,
+                       use_cache: bool = True):
+    """Pick a node for job_msg, register its result future and send it.
+
+    The node may be held by another worker, in which case the job goes
+    through the broker and the result comes back the same way. With a
+    timeout the job carries a deadline, so the node doesn't start it, or
+    keep it running, after the caller stops waiting. A recent cached
+    result (core/result_cache.py) comes back at once, marked "cached",
+    unless params ask for no_cache or a smaller max_age. An identical job
+    already running shares its result instead of being sent again (see
+    core/coalescer.py). Returns (node_id, future). Raises NoNodeAvailable
+    when no connected node supports the tool and has spare capacity.
+    """
+    job_id = job_msg["job_id"]
+    if timeout is not None:
+        job_msg["deadline"] = round(time.time() + timeout, 3)
+    loop = asyncio.get_running_loop()
+    params = job_msg.get("params") or {}
+    ckey = cache_key(job_msg, region) if use_cache else None
+    if ckey and not params.get("no_cache"):
+        hit = result_cache.get(ckey, params.get("max_age"))
+        if hit is not None:
+            node_id, result, age = hit
+            future = loop.create_future()
+            future.set_result({**result, "cached": True, "cache_age": round(age, 1)})
+            return node_id, future
+    key = coalesce_key(job_msg, region)
+    flight = coalescer.join(key, job_id, timeout) if key else None
+    if flight is not None:
+        future = loop.create_future()
+        pending_results[job_id] = future
+        pending_meta[job_id] = meta
+        logger.info(f"Job {job_id} shares the run of identical job {flight.leader}")
+        return flight.node_id, future
+
+    tool = job_msg.get("job_type")
+    node_id = node_selector.select(tool, region=region)
+    if node_id is None:
+        raise NoNodeAvailable(f"No probe node available for {tool}")
+
+    future = loop.create_future()
+    pending_results[job_id] = future
+    pending_meta[job_id] = meta
+    node_selector.job_started(node_id, job_id, tool)
+    if key:
+        coalescer.lead(key, job_id, node_id, timeout)
+    if ckey:
+        cache_keys[job_id] = (ckey, node_id)
+        if len(cache_keys) > RECENT_JOBS_MAX:
+            cache_keys.popitem(last=False)
+    try:
+        await forward_job(node_id, job_msg)
+    except Exception as e:
+        pending_results.pop(job_id, None)
+        pending_meta.pop(job_id, None)
+        node_selector.job_finished(job_id)
+        cache_keys.pop(job_id, None)
+        for follower in coalescer.finish(job_id):
+            hand_over_result(follower, {"output": f"Failed to send job to node: {e}", "success": False})
+        raise
+    return node_id, future
+
+async def cancel_on_node(node_id: str, job_id: str):
+    """Ask a node to stop a job, via the broker if another worker holds its websocket."""
+    worker_id = node_selector.worker_for(node_id)
+    try:
+        if worker_id is not None:
+            await broker.publish(worker_channel(worker_id), {
+                "type": "cancel", "node_id": node_id, "job_id": job_id,
+            })
+            return
+        link = node_links.get(node_id)
+        if link is not None and await link.cancel_job(job_id):
+            # Never left our batch queue, so no result will come back for it
+            await route_result(job_id, {"output": "Job cancelled", "success": False, "cancelled": True})
+    except Exception as e:
+        logger.error(f"Could not cancel job {job_id} on {node_id}: {e}")
+
+def abandon_job(job_id: str):
+    """Stop waiting for a job and cancel it on its node.
+
+    Its meta is kept in case the node finished before the cancel arrived
+    and the result turns up late.
+    """
+    future = pending_results.pop(job_id, None)
+    if future is not None and not future.done():
+        # Releases the user's slot in the dispatch queue
+        future.cancel()
+    meta = pending_meta.pop(job_id, None)
+    if meta is not None:
+        late_meta[job_id] = (time.time(), meta)
+    cutoff = time.time() - LATE_RESULT_SECONDS
+    while late_meta and (len(late_meta) > RECENT_JOBS_MAX or next(iter(late_meta.values()))[0] < cutoff):
+        late_meta.popitem(last=False)
+    if not coalescer.leave(job_id):
+        # Identical jobs are still waiting on the same run
+        return
+    leader = coalescer.leader_of(job_id)
+    node_id = node_selector.node_for(leader)
+    if node_id is not None:
+        task = asyncio.get_running_loop().create_task(cancel_on_node(node_id, leader))
+        _cancel_tasks.add(task)
+        task.add_done_callback(_cancel_tasks.discard)
+
+dispatch_queue = DispatchQueue(dispatch_job, abandon_job, NoNodeAvailable)
+
+def queue_full_response(e: QueueFull) -> JSONResponse:
+    return JSONResponse(
+        {"error": str(e), "retry_after": e.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+async def wait_for_result(job_id: str, future, timeout: float, request: Request = None):
+    """Wait for a dispatched job's result, cancelling the job if we stop waiting.
+
+    Raises asyncio.TimeoutError after `timeout` seconds, and
+    ClientDisconnected if the client behind `request` goes away first.
+    The job is also cancelled when the waiting task itself is.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            if request is None:
+                return await asyncio.wait_for(future, remaining)
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), min(remaining, DISCONNECT_POLL_SECONDS))
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    raise ClientDisconnected(job_id)
+    except BaseException:
+        abandon_job(job_id)
+        raise
+
+def save_background_result(job_id: str, meta: dict, output, success, duration_ms=None, urgent=False):
+    """Queue a result for the DB; the result writer inserts it with the next batch.
+
+    Returns a future for the JobResult id, None if the job_id was already stored.
+    """
+    saved = result_writer.add(JobResult(
+        job_id=job_id,
+        job_type=meta.get("job_type"),
+        target=meta.get("target"),
+        port=meta.get("port"),
+        output=output,
+        success=success,
+        created_at=datetime.utcnow(),
+        api_key_id=meta.get("api_key_id"),
+        user_id=meta.get("user_id")
+    ), wait=True, urgent=urgent)
+    add_metric_when_saved(saved, build_probe_metric(
+        meta.get("job_type"), meta.get("target"), output, success, duration_ms, job_id=job_id,
+    ))
+    return saved
+
+def add_metric_when_saved(saved, metric):
+    """Queue a ProbeMetric once its JobResult is inserted; a duplicate delivery adds none."""
+    def on_saved(saved):
+        if not saved.cancelled() and saved.exception() is None and saved.result() is not None:
+            result_writer.add(metric)
+    saved.add_done_callback(on_saved)
+
+def hand_over_result(job_id: str, result: dict):
+    """Resolve the caller's future, or store the result if no caller is waiting."""
+    if result.get("cancelled") and job_id not in pending_results:
+        # Stopped because its caller gave up; there is nothing worth storing
+        pending_meta.pop(job_id, None)
+        late_meta.pop(job_id, None)
+        logger.info(f"Job {job_id} cancelled on its node")
+        return
+
+    # ----- Only save to DB if not a UI/manual job -----
+    if job_id in pending_results:
+        # UI/manual job: set future, API endpoint will handle DB save!
+        future = pending_results.pop(job_id)
+        if not future.done():
+            future.set_result(result)
+        pending_meta.pop(job_id, None)
+    else:
+        # API token/background job, or one whose caller already gave up: save to DB here
+        meta = pending_meta.pop(job_id, None)
+        if meta is None:
+            meta = late_meta.pop(job_id, (None, {}))[1]
+        save_background_result(
+            job_id, meta, result.get("output"), result.get("success", True), result.get("duration_ms")
+        )
+
+async def deliver_result(job_id: str, result: dict):
+    """Hand a result to whoever on this worker is waiting for it."""
+    node_selector.job_finished(job_id)
+    if job_id in delivered_jobs:
+        # A node replayed a result we already handled
+        logger.info(f"Ignoring duplicate result for job {job_id}")
+        return
+    delivered_jobs[job_id] = None
+    if len(delivered_jobs) > RECENT_JOBS_MAX:
+        delivered_jobs.popitem(last=False)
+    # Binary/compressed outputs are turned into text only here, at the consumer
+    result = {
+        "output": output_text(result),
+        "success": result.get("success", True),
+        "duration_ms": result.get("duration_ms"),
+        "cancelled": result.get("cancelled", False),
+    }
+    cached = cache_keys.pop(job_id, None)
+    if cached is not None:
+        ckey, node_id = cached
+        result_cache.put(ckey, node_id, dict(result), result_ttl(ckey[0], result["output"]))
+    # Jobs coalesced onto this one each get their own copy
+    for waiting_id in [job_id, *coalescer.finish(job_id)]:
+        hand_over_result(waiting_id, dict(result))
+
+async def route_result(job_id: str, result: dict, origin: str = None):
+    """Send a result from one of our nodes back to the worker that dispatched it."""
+    origin = job_origins.pop(job_id, None) or origin or WORKER_ID
+    if origin == WORKER_ID:
+        await deliver_result(job_id, result)
+    else:
+        await broker.publish(worker_channel(origin), {
+            "type": "result",
+            "job_id": job_id,
+            "result": portable_result(result),
+        })
+
+async def announce_node(node_id: str, event: str):
+    config = local_node_config.get(node_id, {})
+    await broker.publish(NODES_CHANNEL, {
+        "type": event,
+        "node_id": node_id,
+        "worker_id": WORKER_ID,
+        "last_seen": node_status.get(node_id, time.time()),
+        **config,
+    })
+
+async def on_worker_message(msg: dict):
+    if msg["type"] == "job":
+        job_msg = msg["job"]
+        try:
+            await send_to_node(msg["node_id"], job_msg, msg["origin"])
+        except Exception as e:
+            # Node left this worker after the sender picked it; fail fast
+            await broker.publish(worker_channel(msg["origin"]), {
+                "type": "result",
+                "job_id": job_msg["job_id"],
+                "result": {"output": f"Dispatch failed: {e}", "success": False},
+            })
+    elif msg["type"] == "result":
+        await deliver_result(msg["job_id"], msg["result"])
+    elif msg["type"] == "cancel":
+        await cancel_on_node(msg["node_id"], msg["job_id"])
+
+async def on_node_event(msg: dict):
+    if msg.get("worker_id") == WORKER_ID:
+        return
+    if msg["type"] == "sync":
+        for node_id in list(connected_nodes):
+            await announce_node(node_id, "node_up")
+        return
+    node_id = msg["node_id"]
+    if msg["type"] == "node_down":
+        node_selector.remove_node(node_id, worker_id=msg["worker_id"])
+        if node_id not in connected_nodes:
+            node_status.pop(node_id, None)
+        return
+    if msg["type"] == "node_heartbeat" and node_selector.worker_for(node_id) == msg["worker_id"]:
+        node_selector.touch(node_id)
+    else:
+        node_selector.add_node(
+            node_id,
+            max_concurrent=msg.get("max_concurrent"),
+            supported_tools=msg.get("supported_tools"),
+            priority=msg.get("priority"),
+            region=msg.get("region"),
+            worker_id=msg["worker_id"],
+        )
+    if node_id not in connected_nodes:
+        node_status[node_id] = msg.get("last_seen", time.time())
+
+broker.subscribe(worker_channel(WORKER_ID), on_worker_message)
+broker.subscribe(NODES_CHANNEL, on_node_event)
+
+async def start_node_routing():
+    # Ask the other workers which nodes they hold
+    await broker.publish(NODES_CHANNEL, {"type": "sync", "worker_id": WORKER_ID})
+
+async def handle_node_result(msg: dict):
+    job_id = msg.get("job_id")
+    output = msg.get("output")
+    success = msg.get("success", True)
+    logger.debug(f"Job {job_id} result ({len(output or '')} bytes, success={success})")
+    result = {
+        "output": output,
+        "success": success,
+        # Pass more fields if needed
+    }
+    if msg.get("encoding"):
+        result["encoding"] = msg["encoding"]
+    if msg.get("duration_ms") is not None:
+        result["duration_ms"] = msg["duration_ms"]
+    if msg.get("cancelled"):
+        result["cancelled"] = True
+    await route_result(job_id, result, msg.get("origin"))
+
 @router.websocket("/ws/node")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     node_id = None
     try:
         while True:
-            data = await websocket.receive_text()
-            logger.info(f"Data received from probe node: {data}")
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             try:
+                if message.get("bytes") is not None:
+                    # Binary results: route on the header, never JSON-parse the output
+                    job_ids = []
+                    for header, output in iter_results(message["bytes"]):
+                        await handle_node_result(result_from_frame(header, output))
+                        job_ids.append(header.get("job_id"))
+                    if node_id in node_links:
+                        await node_links[node_id].send_ack(job_ids)
+                    continue
+                data = message.get("text")
+                logger.debug(f"Data received from probe node: {data}")
                 msg = json.loads(data)
                 if msg.get("action") == "register":
                     node_id = msg.get("node_name", "unknown")
+                    config = await run_in_threadpool(load_node_config, node_id, msg)
+                    if config["supported_tools"] is not None:
+                        config["supported_tools"] = sorted(config["supported_tools"])
+                    capabilities = negotiate_capabilities(msg.get("capabilities"))
                     connected_nodes[node_id] = websocket
+                    node_links[node_id] = NodeLink(websocket, capabilities, fail_unsent_jobs)
+                    local_node_config[node_id] = config
+                    node_status[node_id] = time.time()
+                    node_selector.add_node(node_id, **config)
                     await websocket.send_text(json.dumps({
-                        "message": f"Node {node_id} registered successfully!"
+                        "action": "registered",
+                        "message": f"Node {node_id} registered successfully!",
+                        "max_concurrent_probes": config["max_concurrent"],
+                        "capabilities": sorted(capabilities),
                     }))
+                    await announce_node(node_id, "node_up")
                     logger.info(f"Probe node registered: {node_id}")
                 elif msg.get("action") == "heartbeat":
                     node_id = msg.get("node_name", "unknown")
                     logger.info(f"Heartbeat received from {node_id}")
                     node_status[node_id] = time.time()
+                    node_selector.touch(node_id)
+                    await announce_node(node_id, "node_heartbeat")
                     for nid, last_seen in node_status.items():
                         logger.info(f"Node: {nid}, last seen at: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_seen))}")
                 elif msg.get("action") == "result":
-                    job_id = msg.get("job_id")
-                    output = msg.get("output")
-                    success = msg.get("success", True)
-                    logger.info(f"Job {job_id} result:\n{output}")
-
-                    # ----- Only save to DB if not a UI/manual job -----
-                    if job_id in pending_results:
-                        # UI/manual job: set future, API endpoint will handle DB save!
-                        future = pending_results.pop(job_id)
-                        if not future.done():
-                            future.set_result({
-                                "output": output,
-                                "success": success,
-                                # Pass more fields if needed
-                            })
-                        pending_meta.pop(job_id, None)
-                    else:
-                        # API token/background job: save to DB here
-                        meta = pending_meta.pop(job_id, {})
-                        try:
-                            db: Session = next(get_db())
-                            job_row = JobResult(
-                                job_id=job_id,
-                                job_type=meta.get("job_type"),
-                                target=meta.get("target"),
-                                port=meta.get("port"),
-                                output=output,
-                                success=success,
-                                created_at=datetime.utcnow(),
-                                api_key_id=meta.get("api_key_id"),
-                                user_id=meta.get("user_id")
-                            )
-                            db.add(job_row)
-                            db.commit()
-                            logger.info(f"Saved job result {job_id} to DB (API/background job)")
-                        except Exception as e:
-                            logger.error(f"Error saving job result: {e}")
-                        finally:
-                            try:
-                                db.close()
-                            except Exception:
-                                pass
+                    await handle_node_result(msg)
+                    if node_id in node_links:
+                        await node_links[node_id].send_ack([msg.get("job_id")])
+                elif msg.get("action") == "results":
+                    # Batch frame: results the node coalesced within its flush window
+                    for result_msg in msg.get("results", []):
+                        await handle_node_result(result_msg)
+                    if node_id in node_links:
+                        await node_links[node_id].send_ack([r.get("job_id") for r in msg.get("results", [])])
             except Exception as e:
                 logger.error(f"Exception in probe node WebSocket: {e}")
                 await websocket.send_text(json.dumps({
@@ -97,8 +488,12 @@ async def websocket_endpoint(websocket: WebSocket):
                 }))
     except WebSocketDisconnect:
         logger.warning(f"Node disconnected: {node_id}")
-        if node_id and node_id in connected_nodes:
+        if node_id and connected_nodes.get(node_id) is websocket:
             del connected_nodes[node_id]
+            await fail_unsent_jobs(node_links.pop(node_id).close(), "node disconnected")
+            node_selector.remove_node(node_id)
+            await announce_node(node_id, "node_down")
+            local_node_config.pop(node_id, None)
         if node_id and node_id in node_status:
             del node_status[node_id]
 
@@ -106,11 +501,13 @@ async def websocket_endpoint(websocket: WebSocket):
 @router.get("/nodes")
 def list_nodes():
     result = []
+    stats = node_selector.snapshot()
     for node_id, last_seen in node_status.items():
         result.append({
             "node_id": node_id,
             "last_seen": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_seen)),
-            "seconds_since_last_seen": int(time.time() - last_seen)
+            "seconds_since_last_seen": int(time.time() - last_seen),
+            **stats.get(node_id, {}),
         })
     return JSONResponse(result)
 
@@ -122,7 +519,7 @@ async def send_job(data: dict):
     target = data.get("target")
     port = data.get("port")
 
-    if node_id not in connected_nodes:
+    if not node_selector.has_node(node_id):
         return {"error": "Node not connected"}
 
     job_id = str(uuid.uuid4())
@@ -136,25 +533,21 @@ async def send_job(data: dict):
         job_msg["port"] = port
 
     print(f"SENDING JOB: {job_id} to node {node_id} from /send-job endpoint")
-    await connected_nodes[node_id].send_json(job_msg)
+    node_selector.job_started(node_id, job_id, job_type)
+    await forward_job(node_id, job_msg)
     return {"status": "job sent", "job_id": job_id}
 
-# The main /probe endpoint (API key auth, result logging)
-@router.post("/probe")
-async def run_probe(
-    data: dict,
-    api_key=Depends(get_api_key),
-    db: Session = Depends(get_db)
-):
-    if not connected_nodes:
-        return JSONResponse({"error": "No probe nodes connected"}, status_code=503)
-    node_id = next(iter(connected_nodes.keys()))
+def build_probe_job(data: dict, api_key):
+    """Validate a {type, target, port} probe request.
+
+    Returns (job_msg, meta, error); error is a message for a 400 response.
+    """
     job_type = data.get("type")
     target = data.get("target")
     port = data.get("port")
 
     if not job_type or not target:
-        return JSONResponse({"error": "Missing 'type' or 'target'"}, status_code=400)
+        return None, None, "Missing 'type' or 'target'"
 
     job_id = str(uuid.uuid4())
     job_msg = {
@@ -165,50 +558,195 @@ async def run_probe(
     }
     if job_type == "port_check":
         if not port:
-            return JSONResponse({"error": "Missing 'port' for port_check"}, status_code=400)
+            return None, None, "Missing 'port' for port_check"
         job_msg["port"] = port
+    if data.get("params"):
+        job_msg["params"] = data["params"]
 
-    # Register a future for the result, plus meta for saving to DB
-    loop = asyncio.get_running_loop()
-    future = loop.create_future()
-    pending_results[job_id] = future
-    pending_meta[job_id] = {
+    # Meta for saving the result to DB
+    meta = {
         "job_type": job_type,
         "target": target,
         "port": port,
         "api_key_id": getattr(api_key, "id", None),
         "user_id": getattr(api_key, "user_id", None),
     }
+    return job_msg, meta, None
 
-    print(f"SENDING JOB: {job_id} to node {node_id} from /probe endpoint")
-    await connected_nodes[node_id].send_json(job_msg)
+def job_result_dict(result: JobResult) -> dict:
+    return {
+        "job_id": result.job_id,
+        "job_type": result.job_type,
+        "target": result.target,
+        "port": result.port,
+        "output": result.output,
+        "success": result.success,
+        "created_at": result.created_at
+    }
 
+# The main /probe endpoint (API key auth, result logging)
+@router.post("/probe")
+async def run_probe(
+    data: dict,
+    request: Request,
+    api_key=Depends(get_rate_limited_api_key),
+):
+    if not node_selector.has_nodes():
+        return JSONResponse({"error": "No probe nodes connected"}, status_code=503)
+    job_msg, meta, error = build_probe_job(data, api_key)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+    job_id = job_msg["job_id"]
+    job_type = job_msg["job_type"]
+    target = job_msg["target"]
+    entitlement = request.state.entitlement
+    started = time.monotonic()
+
+    try:
+        node_id, future, queue_time = await dispatch_queue.submit(
+            job_msg, meta, entitlement, region=data.get("region"), timeout=PROBE_TIMEOUT
+        )
+    except QueueFull as e:
+        return queue_full_response(e)
+    except NoNodeAvailable as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    print(f"SENT JOB: {job_id} to node {node_id} from /probe endpoint")
+
+    output = None
     try:
-        output = await asyncio.wait_for(future, timeout=15)
+        output = await wait_for_result(job_id, future, max(1, PROBE_TIMEOUT - queue_time), request)
         return {
             "job_id": job_id,
             "node_id": node_id,
             "type": job_type,
             "target": target,
-            "output": output
+            "output": output,
+            "cached": output.get("cached", False),
+            "cache_age": output.get("cache_age"),
         }
     except asyncio.TimeoutError:
-        pending_results.pop(job_id, None)
-        pending_meta.pop(job_id, None)
         return JSONResponse({"error": "Probe timeout, node did not respond in time"}, status_code=504)
+    except ClientDisconnected:
+        logger.info(f"Client went away, cancelled job {job_id}")
+        return JSONResponse({"error": "Client closed request"}, status_code=499)
+    finally:
+        save_usage_log(
+            entitlement, "/probe", bool(output and output.get("success")),
+            response_time_ms=round((time.monotonic() - started) * 1000, 1),
+            queue_time_ms=round(queue_time * 1000, 1),
+            api_key_id=api_key.id,
+            ip_address=request.client.host if request.client else None,
+        )
+
+BULK_MAX_ITEMS = 1000
+BULK_DEFAULT_CONCURRENCY = 20
+BULK_MAX_CONCURRENCY = 100
+BULK_ITEM_TIMEOUT = 30
+
+BULK_ROW_EXTRAS = ("duration_ms", "queue_time_ms")
+
+def save_job_results(rows: list, entitlement=None):
+    """Queue many JobResult rows, with their metrics and usage, for the result writer."""
+    for row in rows:
+        saved = result_writer.add(
+            JobResult(**{k: v for k, v in row.items() if k not in BULK_ROW_EXTRAS}), wait=True, urgent=False
+        )
+        add_metric_when_saved(saved, build_probe_metric(
+            row["job_type"], row["target"], row["output"], row["success"],
+            row.get("duration_ms"), job_id=row["job_id"],
+        ))
+        if entitlement is not None:
+            result_writer.add(build_usage_log(
+                entitlement, "/probe/bulk", row["success"],
+                queue_time_ms=row.get("queue_time_ms"), api_key_id=row["api_key_id"],
+            ))
+    if rows:
+        logger.info(f"Queued {len(rows)} bulk job results")
+
+# Bulk variant of /probe: results stream back as NDJSON as each one finishes
+@router.post("/probe/bulk")
+async def run_probe_bulk(data: dict, request: Request, api_key=Depends(get_api_key)):
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return JSONResponse({"error": "Missing 'items' list"}, status_code=400)
+    if len(items) > BULK_MAX_ITEMS:
+        return JSONResponse({"error": f"At most {BULK_MAX_ITEMS} items per request"}, status_code=400)
+    if not node_selector.has_nodes():
+        return JSONResponse({"error": "No probe nodes connected"}, status_code=503)
+    # Every item counts against the plan's rate limits
+    entitlement = await enforce_rate_limit(request, api_key.user_id, cost=len(items))
+    # More in flight than the plan allows would only wait in the dispatch queue
+    concurrency = min(
+        int(data.get("concurrency") or BULK_DEFAULT_CONCURRENCY),
+        BULK_MAX_CONCURRENCY,
+        entitlement.max_concurrent_requests,
+    )
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    rows = []
+
+    async def run_item(index: int, item: dict) -> dict:
+        if not isinstance(item, dict):
+            return {"index": index, "error": "Item must be an object"}
+        job_msg, meta, error = build_probe_job(item, api_key)
+        if error:
+            return {"index": index, "error": error}
+        job_id = job_msg["job_id"]
+        line = {"index": index, "job_id": job_id, "type": meta["job_type"], "target": meta["target"]}
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + BULK_ITEM_TIMEOUT
+            while True:
+                try:
+                    node_id, future, queue_time = await dispatch_queue.submit(
+                        job_msg, meta, entitlement, region=item.get("region"),
+                        timeout=max(1, deadline - loop.time()),
+                    )
+                    break
+                except (NoNodeAvailable, QueueFull) as e:
+                    # Nodes are saturated; wait for capacity instead of failing the item
+                    if loop.time() >= deadline:
+                        return {**line, "error": str(e)}
+                    await asyncio.sleep(0.1)
+            try:
+                # A client disconnect cancels this task, which cancels the job too
+                result = await wait_for_result(job_id, future, max(1, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                result = {"output": "Probe timeout, node did not respond in time", "success": False}
+        output, success = result.get("output"), result.get("success", True)
+        rows.append({
+            "job_id": job_id,
+            "job_type": meta["job_type"],
+            "target": meta["target"],
+            "port": meta["port"],
+            "output": output,
+            "success": success,
+            "created_at": datetime.utcnow(),
+            "api_key_id": meta["api_key_id"],
+            "user_id": meta["user_id"],
+            "duration_ms": result.get("duration_ms"),
+            "queue_time_ms": round(queue_time * 1000, 1),
+        })
+        if result.get("cached"):
+            line.update(cached=True, cache_age=result["cache_age"])
+        return {**line, "node_id": node_id, "success": success, "output": output}
+
+    async def stream():
+        tasks = [asyncio.create_task(run_item(i, item)) for i, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Includes partial runs on disconnect
+            save_job_results(list(rows), entitlement)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 # Endpoint to fetch job result by job_id
 @router.get("/job-result/{job_id}")
-def get_job_result(job_id: str, db: Session = Depends(get_db)):
-    result = db.query(JobResult).filter(JobResult.job_id == job_id).first()
+async def get_job_result(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    result = await db.scalar(select(JobResult).where(JobResult.job_id == job_id))
     if not result:
         return JSONResponse({"error": "Not found"}, status_code=404)
-    return {
-        "job_id": result.job_id,
-        "job_type": result.job_type,
-        "target": result.target,
-        "port": result.port,
-        "output": result.output,
-        "success": result.success,
-        "created_at": result.created_at
-    }
+    return job_result_dict(result)
@@ -11,7 +11,7 @@ from schemas.scheduled_probe_schema import (
 from core.dependencies import get_current_user
 from models.user import User
 from typing import List
-from scheduler import schedule_probe, scheduler
+from scheduler import schedule_probe, unschedule_probe
 
 router = APIRouter()
 
@@ -44,8 +44,8 @@ def create_scheduled_probe(
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A probe with this name already exists.")
     db.refresh(new_probe)
     if new_probe.is_active:
-        # Just schedule; scheduler will run the first probe immediately (see scheduler.py)
-        schedule_probe(new_probe)
+        # First run goes out now; later runs follow the probe's phase (see scheduler.py)
+        schedule_probe(new_probe, run_now=True)
     # Return with eager-loaded results
     return db.query(ScheduledProbe).options(
         joinedload(ScheduledProbe.probe_results)
@@ -83,10 +83,7 @@ def update_scheduled_probe(
     if probe.is_active:
         schedule_probe(probe)
     else:
-        try:
-            scheduler.remove_job(f"scheduled_probe_{probe.id}")
-        except Exception:
-            pass
+        unschedule_probe(probe.id)
     return db.query(ScheduledProbe).options(
         joinedload(ScheduledProbe.probe_results)
     ).filter(ScheduledProbe.id == probe.id).first()
@@ -107,10 +104,7 @@ def toggle_scheduled_probe(
     if probe.is_active:
         schedule_probe(probe)
     else:
-        try:
-            scheduler.remove_job(f"scheduled_probe_{probe.id}")
-        except Exception:
-            pass
+        unschedule_probe(probe.id)
     return db.query(ScheduledProbe).options(
         joinedload(ScheduledProbe.probe_results)
     ).filter(ScheduledProbe.id == probe.id).first()
@@ -127,8 +121,5 @@ def delete_scheduled_probe(
         raise HTTPException(status_code=404, detail="Scheduled probe not found")
     db.delete(probe)
     db.commit()
-    try:
-        scheduler.remove_job(f"scheduled_probe_{probe.id}")
-    except Exception:
-        pass
+    unschedule_probe(probe_id)
     return {"message": "Probe deleted"}
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from utils.hashing import hash_password
-from core.dependencies import get_db, get_current_user, get_current_admin_user
+from core.database import get_db
+from core.dependencies import get_current_user, get_current_admin_user
 from models.user import User
 from schemas.user_schema import UserRead
 from typing import List
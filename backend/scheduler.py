@@ -1,99 +1,314 @@
 import asyncio
-from routers.probe_node_ws import connected_nodes, pending_results, pending_meta
+import heapq
+import time
+import uuid
+from routers.probe_node_ws import dispatch_job, wait_for_result
+from core.node_selector import node_selector
 from models.probe_result import ProbeResult
-from sqlalchemy.orm import Session
 from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
 from models.scheduled_probe import ScheduledProbe
 from core.database import SessionLocal
-from threading import Thread
+from core.result_writer import result_writer
+from core.broker import broker, SCHEDULE_CHANNEL, WORKER_ID
+from utils.settings import SCHEDULER_MAX_DISPATCH_PER_SECOND
+from utils.output_parsers import build_probe_metric
 
-scheduler = BackgroundScheduler()
+SCHEDULED_PROBE_TIMEOUT = 30
+GOLDEN_RATIO_FRACTION = 0.6180339887498949
+PHASE_SLACK_SECONDS = 1.0
+LEADER_RETRY_SECONDS = 15
 
-def run_scheduled_probe(probe_id: int):
-    db = SessionLocal()
-    try:
-        probe = db.query(ScheduledProbe).filter(ScheduledProbe.id == probe_id, ScheduledProbe.is_active == True).first()
-        if not probe:
-            print(f"[Scheduler] Scheduled probe {probe_id} not found or not active.")
-            return
 
-        if not connected_nodes:
-            print("[Scheduler] No probe nodes connected!")
-            return
-        node_id = next(iter(connected_nodes.keys()))
-
-        job_id = f"scheduled_{probe.id}_{int(datetime.utcnow().timestamp())}"
-        job_msg = {
-            "action": "job",
-            "job_id": job_id,
-            "job_type": probe.tool,
-            "target": probe.target,
-            "params": {
-                "target": probe.target
-            }
+def phase_offset(probe_id: int, interval: float) -> float:
+    """Deterministic offset of a probe within its interval.
+
+    Multiples of the golden ratio mod 1 are spread close to evenly for
+    consecutive ids, so probes sharing an interval don't bunch up.
+    """
+    return ((probe_id * GOLDEN_RATIO_FRACTION) % 1.0) * interval
+
+def next_phase_time(probe_id: int, interval: float, now: float) -> float:
+    """Next wall-clock time after now that falls on the probe's phase."""
+    offset = phase_offset(probe_id, interval)
+    cycles = (now - offset) // interval + 1
+    return offset + cycles * interval
+
+
+class ScheduleEntry:
+    def __init__(self, probe_id, tool, target, user_id, interval_minutes, run_now=False):
+        self.probe_id = probe_id
+        self.tool = tool
+        self.target = target
+        self.user_id = user_id
+        self.interval_minutes = interval_minutes
+        self.interval = max(1, interval_minutes or 1) * 60
+        self.run_now = run_now
+        self.version = 0
+        self.running = False
+
+    @classmethod
+    def from_probe(cls, probe: ScheduledProbe, run_now: bool = False):
+        # Plain copies so the entry outlives the ORM session it came from
+        return cls(probe.id, probe.tool, probe.target, probe.user_id, probe.interval_minutes, run_now)
+
+    def to_dict(self):
+        return {
+            "probe_id": self.probe_id,
+            "tool": self.tool,
+            "target": self.target,
+            "user_id": self.user_id,
+            "interval_minutes": self.interval_minutes,
+            "run_now": self.run_now,
         }
 
-        async def async_job():
-            loop = asyncio.get_event_loop()
-            future = loop.create_future()
-            pending_results[job_id] = future
-            pending_meta[job_id] = {
-                "job_type": probe.tool,
-                "target": probe.target,
-                "scheduled_probe_id": probe.id,
-                "user_id": probe.user_id,
-            }
-            await connected_nodes[node_id].send_json(job_msg)
-            try:
-                output = await asyncio.wait_for(future, timeout=30)
-                result_row = ProbeResult(
-                    scheduled_probe_id=probe.id,
-                    result=output.get("output") if isinstance(output, dict) else str(output),
-                    status="success" if (isinstance(output, dict) and output.get("success", True)) else "failure",
-                    execution_time=0,
-                    created_at=datetime.utcnow(),
+
+class ProbeScheduler:
+    """Runs scheduled probes as coroutines on the application event loop.
+
+    Next-run times live in a heap keyed by loop time. Rescheduling or
+    removing a probe bumps its entry version, which makes any heap item
+    for the old version stale; stale items are dropped when popped.
+
+    Each probe runs on a fixed wall-clock phase within its interval (see
+    phase_offset), so restarts resume the same cadence instead of firing
+    everything at once, and a token bucket caps the dispatch rate.
+
+    Every worker keeps the full schedule, but only the leader (see
+    Broker.try_acquire_leadership) dispatches runs.
+    """
+
+    def __init__(self, max_dispatch_per_second: float = SCHEDULER_MAX_DISPATCH_PER_SECOND):
+        self._heap = []       # (run_at, probe_id, version)
+        self._entries = {}    # probe_id: ScheduleEntry
+        self._rate = max(0.1, max_dispatch_per_second)
+        # Room for at least one dispatch, or rates below 1/s would never reach a whole token
+        self._capacity = max(1.0, self._rate)
+        self._tokens = self._capacity
+        self._refilled_at = 0.0
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self._jobs = set()
+        self.is_leader = False
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def shutdown(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._jobs, return_exceptions=True)
+            self._task = None
+
+    def add_probe(self, probe: ScheduledProbe, run_now: bool = False):
+        self.add_entry(ScheduleEntry.from_probe(probe, run_now))
+
+    def add_entry(self, entry: ScheduleEntry):
+        self._call(self._add, entry)
+
+    def remove_probe(self, probe_id: int):
+        self._call(self._remove, probe_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _call(self, fn, *args):
+        # Route callers from sync endpoints (threadpool) onto the loop
+        if self._loop is None:
+            fn(*args)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _now(self):
+        return self._loop.time() if self._loop else 0.0
+
+    def _add(self, entry: ScheduleEntry):
+        previous = self._entries.get(entry.probe_id)
+        if previous:
+            entry.version = previous.version + 1
+            entry.running = previous.running
+        self._entries[entry.probe_id] = entry
+        if entry.run_now:
+            run_at = self._now()
+        else:
+            run_at = self._loop_time_for(next_phase_time(entry.probe_id, entry.interval, time.time()))
+        heapq.heappush(self._heap, (run_at, entry.probe_id, entry.version))
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _loop_time_for(self, wall_time: float) -> float:
+        return self._now() + max(0.0, wall_time - time.time())
+
+    def _take_token(self, now: float) -> bool:
+        self._tokens = min(self._capacity, self._tokens + (now - self._refilled_at) * self._rate)
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _remove(self, probe_id: int):
+        # Leaves the heap item behind; it is discarded as stale when popped
+        self._entries.pop(probe_id, None)
+
+    async def _run(self):
+        while True:
+            now = self._now()
+            throttled = False
+            while self._heap and self._heap[0][0] <= now:
+                run_at, probe_id, version = self._heap[0]
+                entry = self._entries.get(probe_id)
+                if entry is None or entry.version != version:
+                    heapq.heappop(self._heap)
+                    continue
+                if self.is_leader and not self._take_token(now):
+                    throttled = True
+                    break
+                heapq.heappop(self._heap)
+                # Stay on the probe's phase even if this run was delayed. The
+                # small lead keeps clock skew from re-picking the current slot.
+                next_run = self._loop_time_for(
+                    next_phase_time(probe_id, entry.interval, time.time() + PHASE_SLACK_SECONDS)
                 )
-                db.add(result_row)
-                db.commit()
-                print(f"[Scheduler] Saved ProbeResult for scheduled_probe_id={probe.id}")
-            except Exception as e:
-                print(f"[Scheduler] Error running scheduled probe: {e}")
+                heapq.heappush(self._heap, (next_run, probe_id, version))
+                if not self.is_leader:
+                    continue
+                if entry.running:
+                    print(f"[Scheduler] Probe {probe_id} still running, skipping this run.")
+                    continue
+                self._spawn(entry)
+
+            if throttled:
+                timeout = (1 - self._tokens) / self._rate
+            else:
+                timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _spawn(self, entry: ScheduleEntry):
+        async def run():
+            entry.running = True
+            try:
+                await run_scheduled_probe(entry)
             finally:
-                pending_results.pop(job_id, None)
-                pending_meta.pop(job_id, None)
+                entry.running = False
 
-        asyncio.run(async_job())
+        task = self._loop.create_task(run())
+        self._jobs.add(task)
+        task.add_done_callback(self._jobs.discard)
 
-    except Exception as e:
-        print(f"[Scheduler] Exception in run_scheduled_probe: {e}")
-    finally:
-        db.close()
 
-def schedule_probe(probe: ScheduledProbe):
-    job_id = f"scheduled_probe_{probe.id}"
+scheduler = ProbeScheduler()
+
+
+def save_probe_result(entry: ScheduleEntry, output, elapsed_ms: float):
+    """Store a scheduled run; execution_time is in milliseconds."""
+    probe_id = entry.probe_id
+    text = output.get("output") if isinstance(output, dict) else str(output)
+    success = isinstance(output, dict) and output.get("success", True)
+    # The node's own timing excludes queueing and the round trip; fall back to ours
+    duration_ms = (output.get("duration_ms") if isinstance(output, dict) else None) or elapsed_ms
+    result_writer.add(ProbeResult(
+        scheduled_probe_id=probe_id,
+        result=text,
+        status="success" if success else "failure",
+        execution_time=int(round(duration_ms)),
+        created_at=datetime.utcnow(),
+    ))
+    result_writer.add(build_probe_metric(
+        entry.tool, entry.target, text, success, duration_ms, scheduled_probe_id=probe_id,
+    ))
+    print(f"[Scheduler] Queued ProbeResult for scheduled_probe_id={probe_id}")
+
+async def run_scheduled_probe(entry: ScheduleEntry):
+    if not node_selector.has_nodes():
+        print("[Scheduler] No probe nodes connected!")
+        return
+
+    # Two runs of one probe can start within the same second (run_now, a
+    # leader handover), and a repeated job_id would be dropped as a duplicate
+    job_id = f"scheduled_{entry.probe_id}_{int(datetime.utcnow().timestamp())}_{uuid.uuid4().hex[:8]}"
+    job_msg = {
+        "action": "job",
+        "job_id": job_id,
+        "job_type": entry.tool,
+        "target": entry.target,
+        "params": {
+            "target": entry.target
+        }
+    }
+    meta = {
+        "job_type": entry.tool,
+        "target": entry.target,
+        "scheduled_probe_id": entry.probe_id,
+        "user_id": entry.user_id,
+    }
     try:
-        scheduler.remove_job(job_id)
-    except Exception:
-        pass
-    scheduler.add_job(
-        run_scheduled_probe,
-        'interval',
-        minutes=probe.interval_minutes,
-        id=job_id,
-        args=[probe.id],
-        replace_existing=True,
-        misfire_grace_time=60,
-        next_run_time=datetime.utcnow(),   # schedule to run immediately and then on interval
-    )
-    # Run the first probe immediately (in a background thread, non-blocking!)
-    Thread(target=run_scheduled_probe, args=(probe.id,)).start()
+        started = time.monotonic()
+        # Monitoring wants a fresh measurement every run, never a cached one
+        node_id, future = await dispatch_job(
+            job_msg, meta, timeout=SCHEDULED_PROBE_TIMEOUT, use_cache=False
+        )
+        output = await wait_for_result(job_id, future, SCHEDULED_PROBE_TIMEOUT)
+        elapsed_ms = (time.monotonic() - started) * 1000
+        save_probe_result(entry, output, elapsed_ms)
+    except Exception as e:
+        print(f"[Scheduler] Error running scheduled probe {entry.probe_id}: {e}")
+
+def schedule_probe(probe: ScheduledProbe, run_now: bool = False):
+    entry = ScheduleEntry.from_probe(probe, run_now)
+    scheduler.add_entry(entry)
+    # Keep the other workers' copies in sync in case one of them leads
+    broker.publish_threadsafe(SCHEDULE_CHANNEL, {
+        "type": "schedule", "worker_id": WORKER_ID, "entry": entry.to_dict(),
+    })
+
+def unschedule_probe(probe_id: int):
+    scheduler.remove_probe(probe_id)
+    broker.publish_threadsafe(SCHEDULE_CHANNEL, {
+        "type": "unschedule", "worker_id": WORKER_ID, "probe_id": probe_id,
+    })
+
+async def on_schedule_event(msg: dict):
+    if msg.get("worker_id") == WORKER_ID:
+        return
+    if msg["type"] == "schedule":
+        scheduler.add_entry(ScheduleEntry(**msg["entry"]))
+    elif msg["type"] == "unschedule":
+        scheduler.remove_probe(msg["probe_id"])
+
+broker.subscribe(SCHEDULE_CHANNEL, on_schedule_event)
+
+async def campaign_for_leadership():
+    """Retry until this worker owns the scheduler lock; the lock is held for life."""
+    while not scheduler.is_leader:
+        try:
+            scheduler.is_leader = await broker.try_acquire_leadership()
+        except Exception as e:
+            print(f"[Scheduler] Leadership check failed: {e}")
+        if scheduler.is_leader:
+            print(f"[Scheduler] Worker {WORKER_ID} is running scheduled probes.")
+            return
+        await asyncio.sleep(LEADER_RETRY_SECONDS)
 
 def load_and_schedule_all_probes():
     db = SessionLocal()
     try:
         active_probes = db.query(ScheduledProbe).filter(ScheduledProbe.is_active == True).all()
         for probe in active_probes:
-            schedule_probe(probe)
+            # Every worker loads the table itself, so no broadcast here
+            scheduler.add_probe(probe)
     finally:
         db.close()
@@ -9,4 +9,6 @@ export PGPASSWORD='postgres'  # Only if needed
 
 # python seed_user.py  # Optional
 
-exec uvicorn main:app --host 0.0.0.0 --port 8000
+# More than one worker needs BROKER_BACKEND=postgres so jobs can reach
+# nodes connected to another worker
+exec uvicorn main:app --host 0.0.0.0 --port 8000 --workers "${UVICORN_WORKERS:-1}"
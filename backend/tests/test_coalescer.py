@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from core.coalescer import Coalescer, coalesce_key
+from routers import probe_node_ws
+
+
+def ping(job_id):
+    return {"action": "job", "job_id": job_id, "job_type": "ping", "target": "example.com", "params": {}}
+
+
+def test_same_timeout_at_different_instants_joins():
+    coalescer = Coalescer()
+    key = coalesce_key(ping("a"))
+    coalescer.lead(key, "a", "node-1", timeout=15)
+    time.sleep(0.01)
+    flight = coalescer.join(key, "b", timeout=15)
+    assert flight is not None and flight.leader == "a"
+    assert coalescer.finish("a") == ["b"]
+
+
+def test_longer_timeout_does_not_join():
+    coalescer = Coalescer()
+    key = coalesce_key(ping("a"))
+    coalescer.lead(key, "a", "node-1", timeout=15)
+    assert coalescer.join(key, "b", timeout=30) is None
+    assert coalescer.join(key, "c", timeout=None) is None
+    assert coalescer.join(key, "d", timeout=5) is not None
+
+
+def test_dispatch_job_coalesces_identical_requests(monkeypatch):
+    sent = []
+
+    async def forward_job(node_id, job_msg):
+        sent.append(job_msg["job_id"])
+
+    monkeypatch.setattr(probe_node_ws, "forward_job", forward_job)
+    monkeypatch.setattr(probe_node_ws.node_selector, "select", lambda tool, region=None: "node-1")
+    monkeypatch.setattr(probe_node_ws, "coalescer", Coalescer())
+
+    async def run():
+        _, first = await probe_node_ws.dispatch_job(ping("job-1"), {}, timeout=15)
+        await asyncio.sleep(0.01)
+        _, second = await probe_node_ws.dispatch_job(ping("job-2"), {}, timeout=15)
+        await probe_node_ws.deliver_result("job-1", {"output": "pong", "success": True})
+        return await asyncio.wait_for(asyncio.gather(first, second), 1)
+
+    first, second = asyncio.run(run())
+    assert sent == ["job-1"]
+    assert first["output"] == second["output"] == "pong"
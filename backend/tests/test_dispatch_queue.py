@@ -0,0 +1,173 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core import dispatch_queue as queue_module
+from core.dispatch_queue import DispatchQueue, QueueFull
+
+
+class NoNode(Exception):
+    pass
+
+
+class FakeNodes:
+    """dispatch_job stand-in with `free` node slots; records the jobs it starts."""
+
+    def __init__(self, free=0):
+        self.free = free
+        self.started = []
+        self.futures = {}
+
+    async def dispatch(self, job_msg, meta, region=None, timeout=15, use_cache=True):
+        if self.free <= 0:
+            raise NoNode()
+        self.free -= 1
+        self.started.append(job_msg["job_id"])
+        future = asyncio.get_running_loop().create_future()
+        self.futures[job_msg["job_id"]] = future
+        return "node-1", future
+
+    def finish(self, job_id):
+        self.free += 1
+        self.futures[job_id].set_result({"output": "ok"})
+
+
+def user(user_id, max_concurrent=10, priority=0, weight=1):
+    return SimpleNamespace(
+        user_id=user_id, max_concurrent_requests=max_concurrent, request_priority=priority, weight=weight,
+    )
+
+
+def job(job_id):
+    return {"job_id": job_id, "job_type": "ping", "target": "example.com"}
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    monkeypatch.setattr(queue_module, "node_selector", SimpleNamespace(has_nodes=lambda: True))
+    return FakeNodes()
+
+
+def make_queue(nodes):
+    return DispatchQueue(nodes.dispatch, abandon=lambda job_id: None, no_node_error=NoNode)
+
+
+def test_weighted_fair_order_within_a_class(nodes):
+    async def run():
+        queue = make_queue(nodes)
+        heavy, light = user(1, weight=2), user(2, weight=1)
+        submissions = [(heavy, "h1"), (light, "l1"), (heavy, "h2"), (light, "l2"), (heavy, "h3"), (heavy, "h4")]
+        tasks = []
+        for entitlement, job_id in submissions:
+            tasks.append(asyncio.ensure_future(queue.submit(job(job_id), {}, entitlement)))
+            await asyncio.sleep(0)
+        nodes.free = len(tasks)
+        queue._kick()
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+
+    asyncio.run(run())
+    # Finish tags: h 0.5, 1.0, 1.5, 2.0 and l 1.0, 2.0; ties go to the earlier submission
+    assert nodes.started == ["h1", "l1", "h2", "h3", "l2", "h4"]
+
+
+def test_higher_priority_class_goes_first(nodes):
+    async def run():
+        queue = make_queue(nodes)
+        tasks = [asyncio.ensure_future(queue.submit(job("free"), {}, user(1, priority=0)))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(queue.submit(job("paid"), {}, user(2, priority=5))))
+        await asyncio.sleep(0)
+        nodes.free = 1
+        queue._kick()
+        await asyncio.wait_for(tasks[1], 1)
+        assert nodes.started == ["paid"]
+        nodes.finish("paid")
+        await asyncio.wait_for(tasks[0], 1)
+
+    asyncio.run(run())
+    assert nodes.started == ["paid", "free"]
+
+
+def test_user_cap_holds_jobs_until_one_finishes(nodes):
+    nodes.free = 5
+
+    async def run():
+        queue = make_queue(nodes)
+        entitlement = user(1, max_concurrent=1)
+        _, first, queue_time = await queue.submit(job("j1"), {}, entitlement)
+        assert queue_time == 0.0
+        second = asyncio.ensure_future(queue.submit(job("j2"), {}, entitlement))
+        await asyncio.sleep(0.05)
+        assert nodes.started == ["j1"]
+        nodes.finish("j1")
+        _, _, queue_time = await asyncio.wait_for(second, 1)
+        assert queue_time > 0
+
+    asyncio.run(run())
+    assert nodes.started == ["j1", "j2"]
+
+
+def test_cancelled_future_releases_the_slot(nodes):
+    nodes.free = 5
+
+    async def run():
+        queue = make_queue(nodes)
+        entitlement = user(1, max_concurrent=1)
+        _, first, _ = await queue.submit(job("j1"), {}, entitlement)
+        second = asyncio.ensure_future(queue.submit(job("j2"), {}, entitlement))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        assert queue._running == {1: 1}
+
+    asyncio.run(run())
+    assert nodes.started == ["j1", "j2"]
+
+
+def test_per_user_queue_limit(nodes):
+    async def run():
+        queue = make_queue(nodes)
+        entitlement = user(1, max_concurrent=1)
+        waiting = []
+        for i in range(queue_module.USER_QUEUE_FACTOR):
+            waiting.append(asyncio.ensure_future(queue.submit(job(f"j{i}"), {}, entitlement)))
+            await asyncio.sleep(0)
+        with pytest.raises(QueueFull) as e:
+            await queue.submit(job("extra"), {}, entitlement)
+        assert e.value.retry_after >= 1
+        # Other users are not affected by one user's backlog
+        other = asyncio.ensure_future(queue.submit(job("other"), {}, user(2)))
+        await asyncio.sleep(0)
+        assert queue._queued == {1: queue_module.USER_QUEUE_FACTOR, 2: 1}
+        for task in waiting + [other]:
+            task.cancel()
+        await asyncio.gather(*waiting, other, return_exceptions=True)
+        assert queue._queued == {}
+
+    asyncio.run(run())
+
+
+def test_wait_past_timeout_is_shed(nodes):
+    async def run():
+        queue = make_queue(nodes)
+        with pytest.raises(QueueFull):
+            await asyncio.wait_for(queue.submit(job("j1"), {}, user(1), timeout=0.1), 1)
+        assert queue._queued == {}
+        nodes.free = 1
+        await asyncio.sleep(queue_module.RETRY_SECONDS * 2)
+        assert nodes.started == []
+
+    asyncio.run(run())
+
+
+def test_no_connected_nodes_is_not_queued(nodes, monkeypatch):
+    monkeypatch.setattr(queue_module, "node_selector", SimpleNamespace(has_nodes=lambda: False))
+
+    async def run():
+        queue = make_queue(nodes)
+        with pytest.raises(NoNode):
+            await queue.submit(job("j1"), {}, user(1))
+        assert queue._queued == {}
+
+    asyncio.run(run())
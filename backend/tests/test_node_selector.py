@@ -0,0 +1,68 @@
+import random
+
+from core import node_selector as selector_module
+from core.node_selector import NodeSelector
+
+
+def loaded_selector(loads, max_concurrent=4):
+    """A selector whose nodes each run `loads[node_id]` ping jobs."""
+    selector = NodeSelector()
+    for node_id, load in loads.items():
+        selector.add_node(node_id, max_concurrent=max_concurrent)
+        for i in range(load):
+            selector.job_started(node_id, f"{node_id}-job-{i}", "ping")
+    return selector
+
+
+def test_picks_the_less_loaded_of_two():
+    selector = loaded_selector({"busy": 3, "idle": 1})
+    assert {selector.select("ping") for _ in range(20)} == {"idle"}
+
+
+def test_never_picks_the_most_loaded_node():
+    random.seed(1)
+    selector = loaded_selector({"a": 0, "b": 1, "c": 2, "d": 3})
+    picks = [selector.select("ping") for _ in range(200)]
+    assert "d" not in picks
+    # Power of two choices still spreads jobs beyond the single best node
+    assert picks.count("a") > picks.count("b") > picks.count("c") > 0
+
+
+def test_full_nodes_are_skipped_until_a_job_finishes():
+    selector = loaded_selector({"a": 2, "b": 2}, max_concurrent=2)
+    assert selector.select("ping") is None
+    assert selector.job_finished("b-job-0") == "b"
+    assert selector.select("ping") == "b"
+
+
+def test_filters_by_tool_region_and_exclude():
+    selector = NodeSelector()
+    selector.add_node("eu", supported_tools={"ping"}, region="eu")
+    selector.add_node("us", supported_tools={"ping", "dns"}, region="us")
+    assert selector.select("dns") == "us"
+    assert selector.select("ping", region="eu") == "eu"
+    assert selector.select("ping", exclude=("us",)) == "eu"
+    assert selector.select("curl") is None
+
+
+def test_equal_load_prefers_priority_then_latency():
+    selector = NodeSelector()
+    selector.add_node("low", priority=1)
+    selector.add_node("high", priority=5)
+    assert selector.select("ping") == "high"
+
+    selector = loaded_selector({"slow": 0, "fast": 0})
+    selector._nodes["slow"].latency["ping"] = 2.0
+    selector._nodes["fast"].latency["ping"] = 0.1
+    assert selector.select("ping") == "fast"
+
+
+def test_stale_jobs_free_their_slot(monkeypatch):
+    selector = loaded_selector({"a": 1}, max_concurrent=1)
+    assert selector.select("ping") is None
+    now = selector_module.time.monotonic()
+    monkeypatch.setattr(
+        selector_module.time, "monotonic", lambda: now + selector_module.STALE_JOB_SECONDS + 1
+    )
+    assert selector.select("ping") == "a"
+    assert selector.node_for("a-job-0") is None
@@ -0,0 +1,196 @@
+import json
+
+import pytest
+
+from utils.output_parsers import parse_output
+
+# Samples follow the probe node engines' output: text by default
+# (icmp_ping.format_ping, traceroute.format_traceroute/format_mtr,
+# dns_client.format_short, port_scanner.format_port_check/format_nmap),
+# or the raw result as JSON with params.format == "json".
+
+PING_TEXT = """\
+PING example.com (93.184.216.34) 56(84) bytes of data.
+64 bytes from 93.184.216.34: icmp_seq=1 time=11.2 ms
+64 bytes from 93.184.216.34: icmp_seq=2 time=12.8 ms
+64 bytes from 93.184.216.34: icmp_seq=3 time=12 ms
+
+--- example.com ping statistics ---
+3 packets transmitted, 3 received, 0% packet loss
+rtt min/avg/max/mdev = 11.200/12.000/12.800/0.653 ms"""
+
+PING_ALL_LOST = """\
+PING example.com (93.184.216.34) 56(84) bytes of data.
+
+--- example.com ping statistics ---
+4 packets transmitted, 0 received, 100% packet loss"""
+
+PING_UNRESOLVED = """\
+ping: Could not resolve nowhere.invalid: [Errno -2] Name or service not known
+
+--- nowhere.invalid ping statistics ---
+0 packets transmitted, 0 received, 100% packet loss"""
+
+PING_JSON = json.dumps([
+    {"target": "a.example", "sent": 2, "received": 2,
+     "min_ms": 10.0, "avg_ms": 11.0, "max_ms": 12.0, "stddev_ms": 1.0},
+    {"target": "b.example", "sent": 2, "received": 1,
+     "min_ms": 20.0, "avg_ms": 20.0, "max_ms": 20.0, "stddev_ms": 0.0},
+])
+
+TRACEROUTE_TEXT = """\
+traceroute to example.com (93.184.216.34), 30 hops max, 84 byte packets
+ 1  192.168.1.1  0.512 ms  0.498 ms  0.530 ms
+ 2  *  *  *
+ 3  93.184.216.34  11.100 ms  11.300 ms  11.200 ms"""
+
+TRACEROUTE_UNREACHED = """\
+traceroute to example.com (93.184.216.34), 30 hops max, 84 byte packets
+ 1  192.168.1.1  0.512 ms  0.498 ms  0.530 ms
+ 2  *  *  *"""
+
+MTR_TEXT = """\
+HOST: node-1                       Loss%   Snt   Last   Avg  Best  Wrst StDev
+  1.|-- 192.168.1.1                  0.0%     3    0.5   0.5   0.5   0.5   0.0
+  2.|-- 93.184.216.34               33.3%     3   11.2  11.1  11.0  11.2   0.1"""
+
+TRACEROUTE_JSON = json.dumps({
+    "target": "example.com", "address": "93.184.216.34", "rounds": 3, "reached": True,
+    "hops": [
+        {"ttl": 1, "loss_pct": 0.0, "min_ms": 0.5, "avg_ms": 0.5, "max_ms": 0.6, "stddev_ms": 0.1},
+        {"ttl": 2, "loss_pct": 0.0, "min_ms": 11.0, "avg_ms": 11.2, "max_ms": 11.5, "stddev_ms": 0.2},
+    ],
+})
+
+DIG_TEXT = """\
+; <<>> DiG 9.18.18 <<>> example.com
+;; ->>HEADER<<- opcode: QUERY, status: NOERROR, id: 4242
+
+;; ANSWER SECTION:
+example.com.		300	IN	A	93.184.216.34
+
+;; Query time: 23 msec"""
+
+DNS_JSON = json.dumps({
+    "query": "example.com.", "type": "A", "rcode": "NOERROR", "cached": False,
+    "answers": [
+        {"name": "example.com.", "type": "A", "ttl": 300, "data": "93.184.216.34"},
+        {"name": "example.com.", "type": "A", "ttl": 120, "data": "93.184.216.35"},
+    ],
+    "query_time_ms": 18.5,
+})
+
+DNS_JSON_CACHED = json.dumps({
+    "query": "example.com.", "type": "A", "rcode": "NOERROR", "cached": True,
+    "answers": [{"name": "example.com.", "type": "A", "ttl": 60, "data": "93.184.216.34"}],
+    "query_time_ms": 0,
+})
+
+DNS_JSON_NXDOMAIN = json.dumps({
+    "query": "nowhere.invalid.", "type": "A", "rcode": "NXDOMAIN", "cached": False,
+    "answers": [], "query_time_ms": 9.1,
+})
+
+NMAP_TEXT = """\
+Nmap scan report for example.com (93.184.216.34)
+Host is up (0.012s latency).
+Not shown: 998 closed tcp ports (conn-refused)
+PORT      STATE    SERVICE
+80/tcp    open     http
+443/tcp   open     https
+
+Scan done: 1 IP address (1 host up) scanned in 0.52 seconds"""
+
+NMAP_JSON = json.dumps([
+    {"target": "a.example", "open": [443, 80], "closed": [22], "filtered": [], "rtt_ms": 12.0},
+    {"target": "b.example", "open": [], "closed": [], "filtered": [80, 443], "rtt_ms": None},
+])
+
+
+@pytest.mark.parametrize("tool, output, expected", [
+    ("ping", PING_TEXT, {
+        "packet_loss_pct": 0.0, "rtt_min_ms": 11.2, "rtt_avg_ms": 12.0,
+        "rtt_max_ms": 12.8, "rtt_stddev_ms": 0.653,
+        "details": {"sent": 3, "received": 3},
+    }),
+    ("ping", PING_ALL_LOST, {"packet_loss_pct": 100.0, "details": {"sent": 4, "received": 0}}),
+    ("ping", PING_UNRESOLVED, {"packet_loss_pct": None, "details": {"sent": 0, "received": 0}}),
+    ("ping", PING_JSON, {
+        "packet_loss_pct": 25.0, "rtt_min_ms": 10.0, "rtt_avg_ms": 14.0,
+        "rtt_max_ms": 20.0, "rtt_stddev_ms": None,
+        "details": {"sent": 4, "received": 3, "targets": 2, "reachable": 2},
+    }),
+    ("ping", "[]", {"packet_loss_pct": None, "details": {"sent": 0, "received": 0}}),
+    ("traceroute", TRACEROUTE_TEXT, {
+        "hop_count": 3, "rtt_min_ms": 11.1, "rtt_avg_ms": 11.2,
+        "rtt_max_ms": 11.3, "rtt_stddev_ms": None, "details": {"reached": True},
+    }),
+    ("traceroute", TRACEROUTE_UNREACHED, {"hop_count": 2, "details": {"reached": False}}),
+    ("traceroute", MTR_TEXT, {
+        "hop_count": 2, "packet_loss_pct": 33.3, "rtt_min_ms": 11.0, "rtt_avg_ms": 11.1,
+        "rtt_max_ms": 11.2, "rtt_stddev_ms": 0.1, "details": {"rounds": 3},
+    }),
+    ("traceroute", TRACEROUTE_JSON, {
+        "hop_count": 2, "packet_loss_pct": 0.0, "rtt_min_ms": 11.0, "rtt_avg_ms": 11.2,
+        "rtt_max_ms": 11.5, "rtt_stddev_ms": 0.2, "details": {"reached": True, "rounds": 3},
+    }),
+    ("traceroute", json.dumps({"target": "example.com", "hops": []}), {"hop_count": 0}),
+    ("dns", "93.184.216.34\n93.184.216.35", {"details": {"rcode": "NOERROR", "answers": 2}}),
+    ("dns", ";; status: NXDOMAIN", {"details": {"rcode": "NXDOMAIN", "answers": 0}}),
+    ("dns", DIG_TEXT, {"rtt_avg_ms": 23.0, "details": {"rcode": "NOERROR"}}),
+    ("dns", DNS_JSON, {
+        "rtt_avg_ms": 18.5,
+        "details": {"rcode": "NOERROR", "answers": 2, "cached": False, "min_ttl": 120},
+    }),
+    ("dns", DNS_JSON_CACHED, {
+        "rtt_avg_ms": None,
+        "details": {"rcode": "NOERROR", "answers": 1, "cached": True, "min_ttl": 60},
+    }),
+    ("rdns", DNS_JSON_NXDOMAIN, {
+        "rtt_avg_ms": 9.1, "details": {"rcode": "NXDOMAIN", "answers": 0, "cached": False},
+    }),
+    ("port_check", "Port 443 open on example.com (93.184.216.34), connect time 12.5 ms", {
+        "open_ports": [443], "rtt_avg_ms": 12.5, "details": {"state": "open"},
+    }),
+    ("port_check", "Port 22 closed on example.com (93.184.216.34) (connection refused)",
+     {"details": {"state": "closed"}}),
+    ("port_check", "Port 25 filtered on example.com (93.184.216.34) (no response)",
+     {"details": {"state": "filtered"}}),
+    ("port_check", json.dumps({"open": [443], "closed": [], "filtered": [], "rtt_ms": 12.5}), {
+        "open_ports": [443], "rtt_avg_ms": 12.5, "details": {"state": "open"},
+    }),
+    ("port_check", json.dumps({"open": [], "closed": [22], "filtered": [], "rtt_ms": None}),
+     {"open_ports": [], "details": {"state": "closed"}}),
+    ("port_check", json.dumps({"open": [], "closed": [], "filtered": [25], "rtt_ms": None}),
+     {"open_ports": [], "details": {"state": "filtered"}}),
+    ("nc", "Connection to example.com (93.184.216.34) 443 port [tcp/https] succeeded!",
+     {"open_ports": [443], "details": {"state": "open"}}),
+    ("nmap", NMAP_TEXT, {"open_ports": [80, 443], "rtt_avg_ms": 12.0, "details": {"hosts_up": 1}}),
+    ("nmap", NMAP_JSON, {
+        "open_ports": [80, 443], "rtt_avg_ms": 12.0,
+        "details": {"hosts": 2, "hosts_up": 1, "closed": 1, "filtered": 2},
+    }),
+])
+def test_parse_engine_output(tool, output, expected):
+    assert parse_output(tool, output) == expected
+
+
+@pytest.mark.parametrize("tool, output", [
+    ("ping", ""),
+    ("ping", None),
+    ("ping", "ping: unknown host"),
+    ("traceroute", ""),
+    ("traceroute", "{not json"),
+    ("dns", ""),
+    ("port_check", ""),
+    ("port_check", "Could not resolve nowhere.invalid: [Errno -2] Name or service not known"),
+    ("nmap", ""),
+    ("whois", "anything"),
+])
+def test_unparseable_output_yields_no_metrics(tool, output):
+    assert parse_output(tool, output) == {}
+
+
+def test_malformed_json_never_raises():
+    # Missing keys the parser expects; the failure is swallowed, not raised
+    assert parse_output("nmap", json.dumps([{"open": [80]}])) == {}
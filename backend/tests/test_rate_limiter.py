@@ -0,0 +1,55 @@
+import asyncio
+import types
+
+import pytest
+
+from core import rate_limiter as limiter_module
+from core.entitlements import Entitlement
+from core.rate_limiter import PRUNE_EVERY, CostExceedsLimit, MemoryRateStore, RateLimitExceeded, RateLimiter
+
+
+def entitlement(minute=None, hour=None, user_id=7):
+    tier = types.SimpleNamespace(
+        id=1, name="test", max_concurrent_requests=5, request_priority=1, priority=1,
+        rate_limit_minute=minute, rate_limit_hour=hour, rate_limit_day=None, rate_limit_month=None,
+    )
+    return Entitlement(user_id, tier)
+
+
+def test_denied_requests_refund_burst_tokens():
+    limiter = RateLimiter(MemoryRateStore())
+    plan = entitlement(minute=600, hour=3)
+
+    async def run():
+        for _ in range(3):
+            await limiter.check(plan)
+        for _ in range(5):
+            with pytest.raises(RateLimitExceeded):
+                await limiter.check(plan)
+
+    asyncio.run(run())
+    assert limiter._buckets[7].tokens == pytest.approx(97, abs=0.1)
+
+
+def test_cost_above_window_limit_is_rejected():
+    limiter = RateLimiter(MemoryRateStore())
+    with pytest.raises(CostExceedsLimit):
+        asyncio.run(limiter.check(entitlement(minute=60), cost=61))
+
+
+def test_refilled_buckets_are_dropped(monkeypatch):
+    limiter = RateLimiter(MemoryRateStore())
+    now = [1000.0]
+    monkeypatch.setattr(limiter_module.time, "monotonic", lambda: now[0])
+
+    async def run():
+        for user_id in range(1, PRUNE_EVERY):
+            await limiter.check(entitlement(minute=60, user_id=user_id))
+        assert len(limiter._buckets) == PRUNE_EVERY - 1
+        # A minute later every bucket but the active user's has refilled
+        now[0] += 60
+        await limiter.check(entitlement(minute=60, user_id=1))
+
+    asyncio.run(run())
+    assert list(limiter._buckets) == [1]
+    assert limiter._buckets[1].tokens == limiter._buckets[1].capacity - 1
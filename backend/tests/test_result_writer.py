@@ -0,0 +1,125 @@
+import asyncio
+import contextlib
+import types
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql
+
+import core.result_writer as result_writer_module
+from core.entitlements import Entitlement
+from core.result_writer import ResultNotSaved, ResultWriter
+from routers import diagnostics, probe_node_ws
+
+
+class FakeConnection:
+    """Records inserts; job_results rows whose job_id was stored before are skipped."""
+
+    def __init__(self, stored):
+        self.stored = stored
+
+    async def execute(self, stmt, params):
+        table = stmt.table.name
+        sql = str(stmt.compile(dialect=postgresql.dialect()))
+        returned = []
+        for values in params:
+            if table == "job_results" and values["job_id"] in self.stored["job_results"]:
+                continue
+            self.stored.setdefault(table, []).append(values.get("job_id"))
+            returned.append((len(self.stored[table]), values.get("job_id")))
+        return returned if "RETURNING" in sql else None
+
+
+class FakeEngine:
+    def __init__(self):
+        self.stored = {"job_results": []}
+
+    @contextlib.asynccontextmanager
+    async def begin(self):
+        yield FakeConnection(self.stored)
+
+
+def test_duplicate_result_adds_no_second_metric(monkeypatch):
+    engine = FakeEngine()
+    writer = ResultWriter(batch_size=10, flush_seconds=0.01)
+    monkeypatch.setattr(result_writer_module, "async_engine", engine)
+    monkeypatch.setattr(probe_node_ws, "result_writer", writer)
+    meta = {"job_type": "ping", "target": "example.com"}
+
+    async def run():
+        first = await probe_node_ws.save_background_result("job-1", meta, "pong", True, urgent=True)
+        second = await probe_node_ws.save_background_result("job-1", meta, "pong", True, urgent=True)
+        await writer.stop()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is not None and second is None
+    assert engine.stored["job_results"] == ["job-1"]
+    assert engine.stored["probe_metrics"] == ["job-1"]
+
+
+def test_stop_writes_rows_queued_by_commit_callbacks(monkeypatch):
+    engine = FakeEngine()
+    writer = ResultWriter(batch_size=10, flush_seconds=5)
+    monkeypatch.setattr(result_writer_module, "async_engine", engine)
+    monkeypatch.setattr(probe_node_ws, "result_writer", writer)
+
+    async def run():
+        probe_node_ws.save_background_result("job-2", {"job_type": "ping"}, "pong", True)
+        await writer.stop()
+
+    asyncio.run(run())
+    assert engine.stored["probe_metrics"] == ["job-2"]
+
+
+class FailingEngine:
+    """Every insert fails on the data, not the connection, so rows are dropped."""
+
+    @contextlib.asynccontextmanager
+    async def begin(self):
+        raise ValueError("bad row")
+        yield
+
+
+def test_dropped_row_raises_result_not_saved(monkeypatch):
+    writer = ResultWriter(batch_size=10, flush_seconds=0.01)
+    monkeypatch.setattr(result_writer_module, "async_engine", FailingEngine())
+    monkeypatch.setattr(probe_node_ws, "result_writer", writer)
+
+    async def run():
+        saved = probe_node_ws.save_background_result("job-3", {"job_type": "ping"}, "pong", True, urgent=True)
+        with pytest.raises(ResultNotSaved):
+            await saved
+        await writer.stop()
+
+    asyncio.run(run())
+    assert writer.stats()["dropped"] == 1
+
+
+def test_run_diagnostic_returns_503_when_result_is_dropped(monkeypatch):
+    writer = ResultWriter(batch_size=10, flush_seconds=0.01)
+    monkeypatch.setattr(result_writer_module, "async_engine", FailingEngine())
+    monkeypatch.setattr(diagnostics, "result_writer", writer)
+    monkeypatch.setattr(diagnostics.node_selector, "has_nodes", lambda: True)
+
+    async def submit(job_msg, meta, entitlement, region=None, timeout=None):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result({"output": "pong", "success": True})
+        return "node-1", future, 0.0
+
+    monkeypatch.setattr(diagnostics.dispatch_queue, "submit", submit)
+    request = types.SimpleNamespace(
+        state=types.SimpleNamespace(entitlement=Entitlement(1)), client=None,
+        is_disconnected=lambda: asyncio.sleep(0, result=False),
+    )
+    user = types.SimpleNamespace(id=1)
+
+    async def run():
+        with pytest.raises(HTTPException) as error:
+            await diagnostics.run_diagnostic(
+                diagnostics.DiagnosticRequest(tool="ping", params={"target": "example.com"}), request, user,
+            )
+        await writer.stop()
+        return error.value
+
+    assert asyncio.run(run()).status_code == 503
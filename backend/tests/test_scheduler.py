@@ -0,0 +1,38 @@
+import asyncio
+
+import scheduler as scheduler_module
+from scheduler import ProbeScheduler, ScheduleEntry
+
+
+def test_dispatch_rate_below_one_per_second():
+    scheduler = ProbeScheduler(max_dispatch_per_second=0.5)
+    assert scheduler._take_token(0.0)
+    assert not scheduler._take_token(1.0)
+    # One token every 2 seconds
+    assert scheduler._take_token(2.0)
+    assert not scheduler._take_token(2.5)
+
+
+def test_dispatch_rate_allows_bursts_up_to_rate():
+    scheduler = ProbeScheduler(max_dispatch_per_second=3)
+    assert [scheduler._take_token(0.0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_runs_in_the_same_second_get_distinct_job_ids(monkeypatch):
+    job_ids = []
+
+    async def dispatch_job(job_msg, meta, **kwargs):
+        job_ids.append(job_msg["job_id"])
+        raise RuntimeError("not dispatched")
+
+    monkeypatch.setattr(scheduler_module, "dispatch_job", dispatch_job)
+    monkeypatch.setattr(scheduler_module.node_selector, "has_nodes", lambda: True)
+    entry = ScheduleEntry(42, "ping", "example.com", 1, 5)
+
+    async def run():
+        await scheduler_module.run_scheduled_probe(entry)
+        await scheduler_module.run_scheduled_probe(entry)
+
+    asyncio.run(run())
+    assert len(set(job_ids)) == 2
+    assert all(job_id.startswith("scheduled_42_") for job_id in job_ids)
@@ -0,0 +1,106 @@
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+from core import wire
+
+# The node's encoder lives in probe_node/wire.py, outside the backend package
+_spec = importlib.util.spec_from_file_location(
+    "node_wire", Path(__file__).resolve().parents[2] / "probe_node" / "wire.py"
+)
+node_wire = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(node_wire)
+
+
+def delivered(frame):
+    """Results as the backend hands them on: decoded, routed as JSON, then read back."""
+    results = [wire.result_from_frame(h, out) for h, out in wire.iter_results(frame)]
+    return [json.loads(json.dumps(wire.portable_result(r))) for r in results]
+
+
+@pytest.mark.parametrize("encode_frame", [wire.encode_frame, node_wire.encode_frame])
+def test_frame_round_trip(encode_frame):
+    frame = encode_frame({"action": "result", "job_id": "j1"}, b"\x00raw bytes\xff")
+    header, payload = wire.decode_frame(frame)
+    assert header == {"action": "result", "job_id": "j1"}
+    assert bytes(payload) == b"\x00raw bytes\xff"
+
+
+def test_single_result_round_trip():
+    output = "PING example.com\n64 bytes from 93.184.216.34: time=11.2 ms ✓"
+    frame = node_wire.encode_result({
+        "action": "result", "job_id": "j1", "success": True, "output": output, "duration_ms": 12.5,
+    })
+    [result] = delivered(frame)
+    assert result["job_id"] == "j1"
+    assert result["success"] is True
+    assert result["duration_ms"] == 12.5
+    assert result["encoding"] == "identity"
+    assert wire.output_text(result) == output
+
+
+def test_batch_round_trip():
+    msgs = [
+        {"action": "result", "job_id": "j1", "success": True, "output": "first"},
+        {"action": "result", "job_id": "j2", "success": False, "output": ""},
+        {"action": "result", "job_id": "j3", "success": True, "output": "third é"},
+    ]
+    results = delivered(node_wire.encode_results(msgs))
+    assert [r["job_id"] for r in results] == ["j1", "j2", "j3"]
+    assert [r["success"] for r in results] == [True, False, True]
+    assert [wire.output_text(r) for r in results] == ["first", "", "third é"]
+
+
+@pytest.mark.parametrize("frame", [
+    b"PNB",                                              # shorter than the prefix
+    b"XXXX" + node_wire.encode_result({"job_id": "j1", "output": "x"})[4:],
+    node_wire.encode_result({"job_id": "j1", "output": "x"})[:10],   # header cut off
+])
+def test_bad_frames_are_rejected(frame):
+    with pytest.raises(wire.FrameError):
+        wire.decode_frame(frame)
+
+
+def test_truncated_batch_payload_is_rejected():
+    frame = node_wire.encode_results([
+        {"job_id": "j1", "output": "first"},
+        {"job_id": "j2", "output": "second"},
+    ])
+    with pytest.raises(wire.FrameError):
+        list(wire.iter_results(frame[:-3]))
+
+
+def test_unexpected_action_is_rejected():
+    with pytest.raises(wire.FrameError):
+        list(wire.iter_results(node_wire.encode_frame({"action": "ping"})))
+
+
+def test_large_output_is_compressed_and_restored():
+    output = "64 bytes from 93.184.216.34: icmp_seq=1 time=11.2 ms\n" * 200
+    frame = node_wire.encode_result({"action": "result", "job_id": "j1", "output": output}, compress=True)
+    assert len(frame) < len(output)
+    [result] = delivered(frame)
+    assert result["encoding"] == "zlib"
+    assert wire.output_text(result) == output
+
+
+def test_batch_compresses_only_large_outputs():
+    large = "x" * (node_wire.COMPRESS_MIN_BYTES * 4)
+    msgs = [{"job_id": "j1", "output": "small"}, {"job_id": "j2", "output": large}]
+    results = delivered(node_wire.encode_results(msgs, compress=True))
+    assert [r["encoding"] for r in results] == ["identity", "zlib"]
+    assert [wire.output_text(r) for r in results] == ["small", large]
+
+
+def test_output_is_not_compressed_unless_negotiated():
+    output = "x" * (node_wire.COMPRESS_MIN_BYTES * 4)
+    [result] = delivered(node_wire.encode_result({"action": "result", "job_id": "j1", "output": output}))
+    assert result["encoding"] == "identity"
+    assert wire.output_text(result) == output
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(wire.FrameError):
+        wire.output_text({"output": b"data", "encoding": "brotli"})
@@ -1,10 +1,16 @@
-from fastapi import Depends, HTTPException, Header
+from fastapi import Depends, HTTPException, Header, Request
 from sqlalchemy.orm import Session
 from core.database import get_db
 from models.api_key import ApiKey
+from core.rate_limiter import enforce_rate_limit
 
 def get_api_key(x_api_key: str = Header(...), db: Session = Depends(get_db)):
     key_obj = db.query(ApiKey).filter_by(key=x_api_key, is_active=True).first()
     if not key_obj:
         raise HTTPException(status_code=403, detail="Invalid or missing API key")
     return key_obj
+
+async def get_rate_limited_api_key(request: Request, api_key=Depends(get_api_key)):
+    """get_api_key, charging the request to the key owner's tier rate limits."""
+    await enforce_rate_limit(request, api_key.user_id)
+    return api_key
@@ -4,7 +4,7 @@ from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 from schemas.user_schema import UserRead
 from models.user import User as UserModel
-from models.database import get_db
+from core.database import get_db
 from auth.jwt_handler import decode_access_token
 from models.user import User
 from utils.settings import SECRET_KEY, ALGORITHM
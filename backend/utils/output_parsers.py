@@ -0,0 +1,291 @@
+import json
+import re
+from typing import Optional
+
+from models.probe_metric import ProbeMetric
+
+# Parsers that turn a probe's raw output into a compact metrics dict, stored
+# as a ProbeMetric row next to the text. They understand both the node
+# engines' output (text or params.format == "json") and the classic
+# ping/traceroute/dig/curl/nmap/nc text. Unknown or garbled output just
+# yields fewer fields; parsing never fails a result.
+
+_PING_COUNTS = re.compile(r"(\d+) packets transmitted, (\d+) (?:packets )?received")
+_PING_RTT = re.compile(
+    r"(?:rtt|round-trip) min/avg/max/(?:mdev|stddev) = ([\d.]+)/([\d.]+)/([\d.]+)/([\d.]+)"
+)
+_TRACE_HEADER = re.compile(r"^traceroute to \S+ \(([^)]+)\)")
+_TRACE_HOP = re.compile(r"^\s*(\d+)\s+(.*)$")
+_MTR_HOP = re.compile(
+    r"^\s*(\d+)\.\|--\s+(\S+)\s+([\d.]+)%?\s+(\d+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)"
+)
+_MS = re.compile(r"([\d.]+) ms")
+_IP = re.compile(r"^[\d.]+$|^[0-9a-fA-F:]+:[0-9a-fA-F:]*$")
+_DIG_STATUS = re.compile(r"status: ([A-Z]+)")
+_DIG_QUERY_TIME = re.compile(r";; Query time: (\d+) msec")
+_HTTP_STATUS = re.compile(r"^HTTP/[\d.]+ (\d{3})", re.M)
+_CURL_TIME = re.compile(r"^(time_\w+): ([\d.]+)$", re.M)
+_CERT_DAYS = re.compile(r"^ssl_cert_expiry: .* \((-?[\d.]+) days\)$", re.M)
+_NMAP_OPEN = re.compile(r"^(\d+)/(?:tcp|udp)\s+open\b", re.M)
+_NMAP_LATENCY = re.compile(r"Host is up \(([\d.]+)s latency\)")
+_NMAP_HOSTS_UP = re.compile(r"\((\d+) hosts? up\)")
+_PORT_STATE = re.compile(r"Port (\d+) (open|closed|filtered)")
+_CONNECT_TIME = re.compile(r"connect time ([\d.]+) ms")
+_NC_PORT = re.compile(r"(?:Connection to|connect to) \S+ (?:\(\S+\) )?(?:port )?(\d+)")
+
+CURL_TIMINGS = {
+    "time_namelookup": "dns_done_ms",
+    "time_connect": "connect_done_ms",
+    "time_appconnect": "tls_done_ms",
+    "time_starttransfer": "ttfb_ms",
+    "time_total": "total_ms",
+}
+
+
+def _as_json(output: str):
+    text = output.lstrip()
+    if not text or text[0] not in "[{":
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def _rtt(min_ms=None, avg_ms=None, max_ms=None, stddev_ms=None) -> dict:
+    return {
+        "rtt_min_ms": min_ms,
+        "rtt_avg_ms": avg_ms,
+        "rtt_max_ms": max_ms,
+        "rtt_stddev_ms": stddev_ms,
+    }
+
+
+def _combine_ping(targets: list) -> dict:
+    """Fold per-target ping stats into one record; per-target detail goes in details."""
+    sent = sum(t["sent"] for t in targets)
+    received = sum(t["received"] for t in targets)
+    replied = [t for t in targets if t["received"] and t.get("avg_ms") is not None]
+    metrics = {
+        "packet_loss_pct": round(100.0 * (sent - received) / sent, 1) if sent else None,
+        "details": {"sent": sent, "received": received},
+    }
+    if len(targets) == 1 and replied:
+        t = replied[0]
+        metrics.update(_rtt(t["min_ms"], t["avg_ms"], t["max_ms"], t.get("stddev_ms")))
+    elif replied:
+        metrics.update(_rtt(
+            min(t["min_ms"] for t in replied),
+            round(sum(t["avg_ms"] * t["received"] for t in replied) / sum(t["received"] for t in replied), 3),
+            max(t["max_ms"] for t in replied),
+        ))
+    if len(targets) > 1:
+        metrics["details"].update(targets=len(targets), reachable=len(replied))
+    return metrics
+
+
+def parse_ping(output: str) -> dict:
+    data = _as_json(output)
+    if isinstance(data, list):
+        return _combine_ping([t for t in data if isinstance(t, dict) and "sent" in t])
+    targets = []
+    for block in re.split(r"^--- .* ping statistics ---$", output, flags=re.M)[1:]:
+        counts = _PING_COUNTS.search(block)
+        if not counts:
+            continue
+        target = {"sent": int(counts.group(1)), "received": int(counts.group(2))}
+        rtt = _PING_RTT.search(block)
+        if rtt:
+            target.update(zip(("min_ms", "avg_ms", "max_ms", "stddev_ms"), map(float, rtt.groups())))
+        targets.append(target)
+    return _combine_ping(targets) if targets else {}
+
+
+def parse_traceroute(output: str) -> dict:
+    data = _as_json(output)
+    if isinstance(data, dict) and "hops" in data:
+        hops = data["hops"]
+        if not hops:
+            return {"hop_count": 0}
+        last = hops[-1]
+        return {
+            "hop_count": len(hops),
+            "packet_loss_pct": last.get("loss_pct"),
+            **_rtt(last.get("min_ms"), last.get("avg_ms"), last.get("max_ms"), last.get("stddev_ms")),
+            "details": {"reached": data.get("reached"), "rounds": data.get("rounds")},
+        }
+
+    mtr = [m for m in map(_MTR_HOP.match, output.splitlines()) if m]
+    if mtr:
+        last = mtr[-1]
+        return {
+            "hop_count": int(last.group(1)),
+            "packet_loss_pct": float(last.group(3)),
+            **_rtt(float(last.group(7)), float(last.group(6)), float(last.group(8)), float(last.group(9))),
+            "details": {"rounds": int(last.group(4))},
+        }
+
+    lines = output.splitlines()
+    header = _TRACE_HEADER.match(lines[0]) if lines else None
+    hops = [m for m in map(_TRACE_HOP.match, lines[1:]) if m]
+    if not hops:
+        return {}
+    last_ttl, last_line = int(hops[-1].group(1)), hops[-1].group(2)
+    rtts = [float(v) for v in _MS.findall(last_line)]
+    metrics = {"hop_count": last_ttl}
+    if rtts:
+        metrics.update(_rtt(min(rtts), round(sum(rtts) / len(rtts), 3), max(rtts)))
+    if header:
+        responders = [w.strip("()") for w in last_line.split() if _IP.match(w.strip("()"))]
+        metrics["details"] = {"reached": header.group(1) in responders}
+    return metrics
+
+
+def parse_dig(output: str) -> dict:
+    data = _as_json(output)
+    if isinstance(data, dict) and "rcode" in data:
+        answers = data.get("answers") or []
+        details = {"rcode": data["rcode"], "answers": len(answers), "cached": data.get("cached")}
+        if answers:
+            details["min_ttl"] = min(a["ttl"] for a in answers)
+        # A cached answer says nothing about the resolver's latency
+        rtt = None if data.get("cached") else data.get("query_time_ms")
+        return {"rtt_avg_ms": rtt, "details": details}
+
+    status = _DIG_STATUS.search(output)
+    query_time = _DIG_QUERY_TIME.search(output)
+    answers = [
+        line for line in output.splitlines()
+        if line.strip() and not line.startswith(";") and "=" not in line and "Server:" not in line
+    ]
+    details = {"rcode": status.group(1) if status else ("NOERROR" if answers else None)}
+    if not query_time:
+        # +short output is one answer per line
+        details["answers"] = len(answers)
+    metrics = {"details": details}
+    if query_time:
+        metrics["rtt_avg_ms"] = float(query_time.group(1))
+    return metrics
+
+
+def parse_curl(output: str) -> dict:
+    data = _as_json(output)
+    if isinstance(data, dict) and "status" in data:
+        details = dict(data.get("timings") or {})
+        if data.get("tls"):
+            details["cert_expires_in_days"] = data["tls"].get("expires_in_days")
+        details["reused_connection"] = data.get("reused_connection")
+        return {"http_status": data["status"], "details": details}
+
+    statuses = _HTTP_STATUS.findall(output)
+    metrics = {}
+    if statuses:
+        # Proxies and 100-continue add earlier status lines; the last is the response
+        metrics["http_status"] = int(statuses[-1])
+    details = {CURL_TIMINGS[name]: round(float(value) * 1000, 3)
+               for name, value in _CURL_TIME.findall(output) if name in CURL_TIMINGS}
+    cert = _CERT_DAYS.search(output)
+    if cert:
+        details["cert_expires_in_days"] = float(cert.group(1))
+    if details:
+        metrics["details"] = details
+    return metrics
+
+
+def parse_nmap(output: str) -> dict:
+    data = _as_json(output)
+    if isinstance(data, list):
+        hosts = [h for h in data if isinstance(h, dict) and "open" in h]
+        rtts = [h["rtt_ms"] for h in hosts if h.get("rtt_ms") is not None]
+        metrics = {
+            "open_ports": sorted({p for h in hosts for p in h["open"]}),
+            "details": {
+                "hosts": len(hosts),
+                "hosts_up": len(rtts),
+                "closed": sum(len(h["closed"]) for h in hosts),
+                "filtered": sum(len(h["filtered"]) for h in hosts),
+            },
+        }
+        if rtts:
+            metrics["rtt_avg_ms"] = round(sum(rtts) / len(rtts), 3)
+        return metrics
+
+    metrics = {"open_ports": sorted({int(p) for p in _NMAP_OPEN.findall(output)})}
+    latency = _NMAP_LATENCY.findall(output)
+    if latency:
+        metrics["rtt_avg_ms"] = round(1000 * sum(map(float, latency)) / len(latency), 3)
+    hosts_up = _NMAP_HOSTS_UP.search(output)
+    if hosts_up:
+        metrics["details"] = {"hosts_up": int(hosts_up.group(1))}
+    return metrics
+
+
+def parse_port_check(output: str) -> dict:
+    data = _as_json(output)
+    if isinstance(data, dict) and "open" in data:
+        metrics = {"open_ports": data["open"], "details": {
+            "state": "open" if data["open"] else "closed" if data.get("closed") else "filtered",
+        }}
+        if data.get("rtt_ms") is not None:
+            metrics["rtt_avg_ms"] = data["rtt_ms"]
+        return metrics
+
+    state = _PORT_STATE.search(output)
+    if state:
+        port, port_state = int(state.group(1)), state.group(2)
+    elif "succeeded" in output or "refused" in output:
+        # Classic `nc -zv` output
+        nc_port = _NC_PORT.search(output)
+        port = int(nc_port.group(1)) if nc_port else None
+        port_state = "open" if "succeeded" in output else "closed"
+    else:
+        return {}
+    metrics = {"details": {"state": port_state}}
+    if port_state == "open":
+        metrics["open_ports"] = [port] if port else []
+    connect = _CONNECT_TIME.search(output)
+    if connect:
+        metrics["rtt_avg_ms"] = float(connect.group(1))
+    return metrics
+
+
+PARSERS = {
+    "ping": parse_ping,
+    "traceroute": parse_traceroute,
+    "dns": parse_dig,
+    "rdns": parse_dig,
+    "curl": parse_curl,
+    "http": parse_curl,
+    "nmap": parse_nmap,
+    "port_check": parse_port_check,
+    "nc": parse_port_check,
+}
+
+
+def parse_output(tool: str, output) -> dict:
+    """Metrics for one probe output, keyed by ProbeMetric column."""
+    parser = PARSERS.get(tool)
+    if parser is None or not isinstance(output, str) or not output:
+        return {}
+    try:
+        return parser(output)
+    except Exception:
+        return {}
+
+
+def build_probe_metric(tool: str, target: str, output, success: bool,
+                       duration_ms: Optional[float] = None, job_id: Optional[str] = None,
+                       scheduled_probe_id: Optional[int] = None, created_at=None):
+    """A ProbeMetric row for a result, to add in the same session as the result itself."""
+    metric = ProbeMetric(
+        job_id=job_id,
+        scheduled_probe_id=scheduled_probe_id,
+        tool=tool,
+        target=target,
+        success=success,
+        duration_ms=duration_ms,
+        **parse_output(tool, output),
+    )
+    if created_at is not None:
+        metric.created_at = created_at
+    return metric
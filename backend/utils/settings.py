@@ -4,6 +4,68 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "super-secret-key")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRATION_MINUTES", "60"))
 
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+psycopg2://postgres:postgres@db:5432/probeops")
+
+# Connection pool of each engine (sync and async) in every worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))
+
+# "memory" keeps jobs inside one process; "postgres" routes them between
+# workers and replicas over LISTEN/NOTIFY
+BROKER_BACKEND = os.getenv("BROKER_BACKEND", "memory")
+
+# Scheduled probes: upper bound on how many runs are dispatched per second
+SCHEDULER_MAX_DISPATCH_PER_SECOND = float(os.getenv("SCHEDULER_MAX_DISPATCH_PER_SECOND", "20"))
+
+
+def tool_seconds(env_name: str, defaults: dict) -> dict:
+    """Per-tool durations from an env var like "ping=2,traceroute=5", over the defaults."""
+    values = dict(defaults)
+    for item in os.getenv(env_name, "").split(","):
+        tool, _, seconds = item.partition("=")
+        if tool.strip() and seconds.strip():
+            values[tool.strip()] = float(seconds)
+    return values
+
+# Identical probes dispatched within this many seconds of each other share
+# one node execution; 0 turns coalescing off for a tool
+COALESCE_WINDOWS = tool_seconds("COALESCE_WINDOWS", {
+    "ping": 2,
+    "traceroute": 5,
+    "curl": 1,
+    "http": 1,
+    "port_check": 1,
+    "nmap": 5,
+    "dns": 1,
+    "rdns": 1,
+    "whois": 10,
+})
+
+# Successful results of slow-changing probes are reused for this many
+# seconds; DNS answers in JSON form use their record TTL instead
+RESULT_CACHE_TTLS = tool_seconds("RESULT_CACHE_TTLS", {
+    "whois": 6 * 3600,
+    "rdns": 3600,
+    "dns": 60,
+})
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# User probes waiting for a node: at most this many per worker, each for
+# at most this long before it is shed with a 429
+MAX_QUEUED_JOBS = int(os.getenv("DISPATCH_MAX_QUEUED_JOBS", "1000"))
+MAX_QUEUE_WAIT_SECONDS = float(os.getenv("DISPATCH_MAX_QUEUE_WAIT_SECONDS", "10"))
+
+# "memory" counts rate limits per process; "postgres" shares the counters
+# between workers and replicas through the rate_limit_counters table
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+# Probe results are buffered and inserted in batches of up to this many
+# rows, at least every RESULT_WRITER_FLUSH_SECONDS
+RESULT_WRITER_BATCH_SIZE = int(os.getenv("RESULT_WRITER_BATCH_SIZE", "500"))
+RESULT_WRITER_FLUSH_SECONDS = float(os.getenv("RESULT_WRITER_FLUSH_SECONDS", "1.0"))
+
 # Example DB config (optional)
 # POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
 # POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+
+from core.result_writer import result_writer
+from models.logging import UsageLog
+
+
+def build_usage_log(entitlement, endpoint: str, success: bool, response_time_ms=None,
+                    queue_time_ms=None, api_key_id=None, ip_address=None) -> UsageLog:
+    """A UsageLog row for one dispatched probe; times are in milliseconds."""
+    return UsageLog(
+        user_id=entitlement.user_id,
+        endpoint=endpoint,
+        timestamp=datetime.now(timezone.utc),
+        success=success,
+        response_time=response_time_ms,
+        ip_address=ip_address,
+        tier_id=entitlement.tier_id,
+        api_key_id=api_key_id,
+        was_queued=bool(queue_time_ms),
+        queue_time=queue_time_ms,
+    )
+
+
+def save_usage_log(entitlement, endpoint: str, success: bool, **fields):
+    result_writer.add(build_usage_log(entitlement, endpoint, success, **fields))
@@ -0,0 +1,33 @@
+import asyncio
+import threading
+
+# One event loop shared by the in-process probe engines. Executor workers
+# hand it a coroutine and block on the result, so the executor's lanes still
+# bound how many jobs run while the sockets themselves are multiplexed here.
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="probe-aio", daemon=True).start()
+    return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop; cancelling the future cancels the task."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro, timeout=None):
+    """Run a coroutine on the shared loop from a worker thread and wait for it."""
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
@@ -0,0 +1,188 @@
+import asyncio
+import ipaddress
+import os
+import socket
+import time
+from collections import OrderedDict
+
+import dns.asyncquery
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+import dns.resolver
+import dns.reversename
+
+# DNS lookups run on the shared asyncio loop (see aio.py). Answers are cached
+# per node for their TTL. Negative answers (NXDOMAIN, or no data) are cached
+# for the SOA negative TTL, as RFC 2308 describes. Identical lookups that are
+# in flight at the same moment share one query.
+
+DNS_CACHE_MAX_ENTRIES = int(os.getenv("DNS_CACHE_MAX_ENTRIES", "10000"))
+NEGATIVE_TTL_DEFAULT = 60     # when the response carries no SOA
+NEGATIVE_TTL_MAX = 3600
+QUERY_TIMEOUT = 2.0           # per server attempt
+LOOKUP_TIMEOUT = 10.0
+
+_cache = OrderedDict()        # key: (expires_at, response dict)
+_in_flight = {}               # key: asyncio.Future
+_system_nameservers = None
+
+
+def system_nameservers():
+    global _system_nameservers
+    if _system_nameservers is None:
+        try:
+            _system_nameservers = dns.resolver.Resolver().nameservers
+        except dns.resolver.NoResolverConfiguration:
+            _system_nameservers = ["127.0.0.1"]
+    return _system_nameservers
+
+
+async def nameservers_for(resolver):
+    if not resolver:
+        return list(system_nameservers())
+    try:
+        ipaddress.ip_address(resolver)
+        return [resolver]
+    except ValueError:
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(resolver, 53, type=socket.SOCK_DGRAM)
+        return [infos[0][4][0]]
+
+
+def _record(rrset, rdata):
+    return {
+        "name": rrset.name.to_text(),
+        "type": dns.rdatatype.to_text(rrset.rdtype),
+        "ttl": rrset.ttl,
+        "data": rdata.to_text(),
+    }
+
+
+def _negative_ttl(response):
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return min(rrset.ttl, rrset[0].minimum, NEGATIVE_TTL_MAX)
+    return NEGATIVE_TTL_DEFAULT
+
+
+async def _query(name, rdtype, nameservers, recursive):
+    request = dns.message.make_query(name, rdtype)
+    if not recursive:
+        request.flags &= ~dns.flags.RD
+    last_error = None
+    for server in nameservers:
+        started = time.monotonic()
+        try:
+            response, _ = await dns.asyncquery.udp_with_fallback(
+                request, server, timeout=QUERY_TIMEOUT
+            )
+        except (dns.exception.DNSException, OSError) as e:
+            last_error = e
+            continue
+        rcode = response.rcode()
+        if rcode in (dns.rcode.SERVFAIL, dns.rcode.REFUSED) and server != nameservers[-1]:
+            continue
+        answers = [_record(rrset, rdata) for rrset in response.answer for rdata in rrset]
+        result = {
+            "query": name.to_text(),
+            "type": dns.rdatatype.to_text(rdtype),
+            "resolver": server,
+            "recursive": recursive,
+            "rcode": dns.rcode.to_text(rcode),
+            "flags": dns.flags.to_text(response.flags).lower().split(),
+            "answers": answers,
+            "query_time_ms": round((time.monotonic() - started) * 1000, 2),
+        }
+        if answers:
+            ttl = min(answer["ttl"] for answer in answers)
+        elif rcode in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+            ttl = _negative_ttl(response)
+        else:
+            ttl = 0
+        return result, ttl
+    raise dns.exception.Timeout(f"No response from {', '.join(nameservers)}: {last_error}")
+
+
+def _cache_get(key):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    expires_at, result = entry
+    remaining = expires_at - time.monotonic()
+    if remaining <= 0:
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    answers = [{**answer, "ttl": min(answer["ttl"], int(remaining))} for answer in result["answers"]]
+    return {**result, "answers": answers, "cached": True, "query_time_ms": 0}
+
+
+def _cache_put(key, result, ttl):
+    if ttl <= 0:
+        return
+    _cache[key] = (time.monotonic() + ttl, result)
+    _cache.move_to_end(key)
+    while len(_cache) > DNS_CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+
+
+async def lookup(target, record_type="A", resolver=None, recursive=True, use_cache=True):
+    """Resolve one name and return its answers as a dict."""
+    name = dns.name.from_text(target)
+    rdtype = dns.rdatatype.from_text(str(record_type).upper())
+    nameservers = await nameservers_for(resolver)
+    key = (name, rdtype, tuple(nameservers), bool(recursive))
+
+    if use_cache:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+        if key in _in_flight:
+            result = await asyncio.shield(_in_flight[key])
+            return {**result, "cached": True}
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight.setdefault(key, future)
+    try:
+        result, ttl = await asyncio.wait_for(
+            _query(name, rdtype, nameservers, bool(recursive)), LOOKUP_TIMEOUT
+        )
+        result["cached"] = False
+        _cache_put(key, result, ttl)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        # Nobody may be waiting on it; don't warn about an unretrieved exception
+        future.exception()
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+
+
+async def reverse_lookup(target, resolver=None, use_cache=True):
+    """PTR lookup for an address; a hostname gets a forward A lookup instead, like nslookup."""
+    try:
+        name = dns.reversename.from_address(target).to_text()
+    except (ValueError, dns.exception.SyntaxError):
+        return await lookup(target, "A", resolver, use_cache=use_cache)
+    return await lookup(name, "PTR", resolver, use_cache=use_cache)
+
+
+def format_short(result):
+    """Text like `dig +short`, with the status when there is no answer."""
+    lines = [answer["data"] for answer in result["answers"]]
+    if not lines:
+        lines.append(f";; status: {result['rcode']}")
+    return "\n".join(lines)
+
+
+def cache_stats():
+    return {"dns_cache_entries": len(_cache)}
@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import deque
+
+# Share of the node's concurrency each slow tool may hold at once. Tools not
+# listed here may use the whole pool, so fast jobs always keep some headroom.
+LANE_SHARES = {
+    "nmap": 0.25,
+    "traceroute": 0.25,
+    "whois": 0.2,
+}
+
+
+class JobExecutor:
+    """Bounded worker pool with one FIFO lane per tool.
+
+    Jobs are queued on the lane of their job_type. A worker picks the next
+    job round-robin across lanes, skipping lanes that are already at their
+    cap, so a burst of slow jobs cannot occupy every worker.
+    """
+
+    def __init__(self, handler, max_concurrent=10):
+        self._handler = handler
+        self._cond = threading.Condition()
+        self._lanes = {}        # lane -> deque of jobs
+        self._lane_order = deque()
+        self._running = {}      # lane -> running job count
+        self._total_running = 0
+        self._workers = 0
+        self._max_concurrent = 0
+        self.resize(max_concurrent)
+
+    @property
+    def max_concurrent(self):
+        return self._max_concurrent
+
+    def lane_limit(self, lane):
+        share = LANE_SHARES.get(lane, 1.0)
+        return max(1, int(self._max_concurrent * share))
+
+    def resize(self, max_concurrent):
+        max_concurrent = max(1, int(max_concurrent))
+        with self._cond:
+            self._max_concurrent = max_concurrent
+            while self._workers < max_concurrent:
+                self._workers += 1
+                threading.Thread(target=self._worker, daemon=True).start()
+            # Surplus workers notice the smaller limit and exit on their own
+            self._cond.notify_all()
+        print(f"[*] Executor sized to {max_concurrent} concurrent jobs")
+
+    def submit(self, job):
+        lane = job.get("job_type") or "unknown"
+        with self._cond:
+            if lane not in self._lanes:
+                self._lanes[lane] = deque()
+                self._running.setdefault(lane, 0)
+                self._lane_order.append(lane)
+            self._lanes[lane].append(job)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "running": self._total_running,
+                "queued": sum(len(q) for q in self._lanes.values()),
+                "max_concurrent": self._max_concurrent,
+            }
+
+    def _next_job(self):
+        # Caller holds self._cond
+        for _ in range(len(self._lane_order)):
+            lane = self._lane_order[0]
+            self._lane_order.rotate(-1)
+            queue = self._lanes[lane]
+            if queue and self._running[lane] < self.lane_limit(lane):
+                return lane, queue.popleft()
+        return None, None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._workers > self._max_concurrent:
+                        self._workers -= 1
+                        return
+                    if self._total_running < self._max_concurrent:
+                        lane, job = self._next_job()
+                        if job is not None:
+                            break
+                    self._cond.wait()
+                self._running[lane] += 1
+                self._total_running += 1
+
+            started = time.time()
+            try:
+                self._handler(job)
+            except Exception as e:
+                print(f"[!] Unhandled error running job {job.get('job_id')}: {e}")
+            finally:
+                with self._cond:
+                    self._running[lane] -= 1
+                    self._total_running -= 1
+                    self._cond.notify_all()
+            print(f"[*] Job {job.get('job_id')} ({lane}) finished in {time.time() - started:.2f}s")
@@ -0,0 +1,286 @@
+import asyncio
+import socket
+import ssl
+import time
+from urllib.parse import urlsplit
+
+# HTTP/1.1 probe run on the shared asyncio loop (see aio.py).
+#
+# Each phase is timed separately: DNS, TCP connect, TLS handshake, time to
+# the first response byte, and the full body read. By default every probe
+# opens a fresh connection, so the timings cover a full handshake as curl's
+# do. With keep_alive the connection goes back to a small per-origin pool,
+# and later probes to that origin skip straight to the request. TLS contexts
+# are built once and shared, since loading the CA bundle dominates the cost
+# of a new context.
+
+DEFAULT_TIMEOUT = 15
+USER_AGENT = "ProbeOps-Node/1.0"
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 10 * 1024 * 1024
+READ_CHUNK = 64 * 1024
+
+POOL_MAX_PER_ORIGIN = 4
+POOL_IDLE_SECONDS = 30
+
+_pool = {}          # (scheme, host, port, verify): [(reader, writer, address, tls, idle_since)]
+_ssl_contexts = {}  # verify: ssl.SSLContext
+
+
+class HTTPProbeError(Exception):
+    pass
+
+
+def ssl_context(verify=True):
+    context = _ssl_contexts.get(verify)
+    if context is None:
+        context = ssl.create_default_context()
+        if not verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        context.set_alpn_protocols(["http/1.1"])
+        _ssl_contexts[verify] = context
+    return context
+
+
+def parse_url(target):
+    # curl assumes http:// when the target has no scheme
+    if "://" not in target:
+        target = "http://" + target
+    url = urlsplit(target)
+    if url.scheme not in ("http", "https"):
+        raise HTTPProbeError(f"Unsupported scheme: {url.scheme}")
+    if not url.hostname:
+        raise HTTPProbeError(f"No host in URL: {target}")
+    port = url.port or (443 if url.scheme == "https" else 80)
+    path = url.path or "/"
+    if url.query:
+        path += "?" + url.query
+    return url.scheme, url.hostname, port, path
+
+
+def certificate_info(ssl_object):
+    cert = ssl_object.getpeercert() if ssl_object else None
+    if not cert:
+        # Unverified connections expose no parsed certificate
+        return None
+    expires_at = ssl.cert_time_to_seconds(cert["notAfter"])
+    subject = dict(item[0] for item in cert.get("subject", ()))
+    issuer = dict(item[0] for item in cert.get("issuer", ()))
+    return {
+        "subject": subject.get("commonName"),
+        "issuer": issuer.get("organizationName") or issuer.get("commonName"),
+        "not_after": cert["notAfter"],
+        "expires_in_days": round((expires_at - time.time()) / 86400, 1),
+        "tls_version": ssl_object.version(),
+    }
+
+
+def _pool_get(key):
+    connections = _pool.get(key)
+    now = time.monotonic()
+    while connections:
+        reader, writer, address, tls, idle_since = connections.pop()
+        if now - idle_since < POOL_IDLE_SECONDS and not writer.is_closing() and not reader.at_eof():
+            return reader, writer, address, tls
+        writer.close()
+    return None
+
+
+def _pool_put(key, reader, writer, address, tls):
+    connections = _pool.setdefault(key, [])
+    if len(connections) >= POOL_MAX_PER_ORIGIN:
+        writer.close()
+        return
+    connections.append((reader, writer, address, tls, time.monotonic()))
+
+
+async def _connect(scheme, host, port, verify, timings):
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    family, _, _, _, sockaddr = infos[0]
+    timings["dns_ms"] = _ms(started)
+
+    started = time.monotonic()
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        await loop.sock_connect(sock, sockaddr)
+    except BaseException:
+        sock.close()
+        raise
+    timings["connect_ms"] = _ms(started)
+
+    started = time.monotonic()
+    if scheme == "https":
+        reader, writer = await asyncio.open_connection(
+            sock=sock, ssl=ssl_context(verify), server_hostname=host,
+            limit=MAX_HEADER_BYTES,
+        )
+        timings["tls_ms"] = _ms(started)
+    else:
+        reader, writer = await asyncio.open_connection(sock=sock, limit=MAX_HEADER_BYTES)
+        timings["tls_ms"] = 0.0
+    return reader, writer, sockaddr[0]
+
+
+def _ms(started):
+    return round((time.monotonic() - started) * 1000, 2)
+
+
+def _parse_head(head):
+    lines = head.decode("iso-8859-1").split("\r\n")
+    status_line = lines[0]
+    parts = status_line.split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise HTTPProbeError(f"Malformed status line: {status_line!r}")
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(":")
+        headers.append((name.strip(), value.strip()))
+    return parts[0], int(parts[1]), parts[2] if len(parts) > 2 else "", headers
+
+
+async def _read_body(reader, method, status, headers):
+    """Read and discard the body. Returns (bytes read, connection reusable)."""
+    if method == "HEAD" or status < 200 or status in (204, 304):
+        return 0, True
+    values = {name.lower(): value for name, value in headers}
+    received = 0
+    if "chunked" in values.get("transfer-encoding", "").lower():
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                # Trailers end with an empty line
+                while (await reader.readline()).strip():
+                    pass
+                return received, True
+            if received + size > MAX_BODY_BYTES:
+                return received, False
+            await reader.readexactly(size + 2)
+            received += size
+    if "content-length" in values:
+        remaining = int(values["content-length"])
+        if remaining > MAX_BODY_BYTES:
+            return received, False
+        while remaining:
+            chunk = await reader.read(min(READ_CHUNK, remaining))
+            if not chunk:
+                raise HTTPProbeError("Connection closed before the end of the body")
+            received += len(chunk)
+            remaining -= len(chunk)
+        return received, True
+    # No framing: the body runs until the server closes
+    while received < MAX_BODY_BYTES:
+        chunk = await reader.read(READ_CHUNK)
+        if not chunk:
+            break
+        received += len(chunk)
+    return received, False
+
+
+async def _exchange(reader, writer, request, method, started, timings):
+    writer.write(request)
+    await writer.drain()
+    first = await reader.read(1)
+    if not first:
+        raise ConnectionResetError("Server closed the connection")
+    timings["ttfb_ms"] = _ms(started)
+    head = first + await reader.readuntil(b"\r\n\r\n")
+    version, status, reason, headers = _parse_head(head[:-4])
+    body_bytes, reusable = await _read_body(reader, method, status, headers)
+    connection = {name.lower(): value.lower() for name, value in headers}.get("connection", "")
+    reusable = reusable and version == "HTTP/1.1" and connection != "close"
+    return version, status, reason, headers, body_bytes, reusable
+
+
+async def probe(target, method="GET", headers=None, verify=True, keep_alive=False):
+    """Make one HTTP request and return the status, headers and phase timings."""
+    scheme, host, port, path = parse_url(target)
+    method = method.upper()
+    key = (scheme, host, port, bool(verify))
+    default_port = 443 if scheme == "https" else 80
+    host_header = host if port == default_port else f"{host}:{port}"
+    lines = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {host_header}",
+        f"User-Agent: {USER_AGENT}",
+        "Accept: */*",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    request = ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    started = time.monotonic()
+    timings = {"dns_ms": 0.0, "connect_ms": 0.0, "tls_ms": 0.0}
+    pooled = _pool_get(key) if keep_alive else None
+    response = None
+    if pooled:
+        reader, writer, address, tls = pooled
+        try:
+            response = await _exchange(reader, writer, request, method, started, timings)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # The server dropped the idle connection; start over on a new one
+            writer.close()
+            started = time.monotonic()
+        except BaseException:
+            writer.close()
+            raise
+    if response is None:
+        pooled = None
+        reader, writer, address = await _connect(scheme, host, port, verify, timings)
+        tls = certificate_info(writer.get_extra_info("ssl_object"))
+        try:
+            response = await _exchange(reader, writer, request, method, started, timings)
+        except BaseException:
+            writer.close()
+            raise
+
+    version, status, reason, response_headers, body_bytes, reusable = response
+    timings["total_ms"] = _ms(started)
+    if keep_alive and reusable:
+        _pool_put(key, reader, writer, address, tls)
+    else:
+        writer.close()
+
+    return {
+        "url": f"{scheme}://{host_header}{path}",
+        "address": address,
+        "method": method,
+        "http_version": version,
+        "status": status,
+        "reason": reason,
+        "headers": response_headers,
+        "body_bytes": body_bytes,
+        "reused_connection": pooled is not None,
+        "timings": timings,
+        "tls": tls,
+    }
+
+
+def format_curl(result):
+    """Headers as `curl -s -D -` prints them, then curl -w style cumulative timings."""
+    lines = [f"{result['http_version']} {result['status']} {result['reason']}".rstrip()]
+    lines += [f"{name}: {value}" for name, value in result["headers"]]
+    lines.append("")
+    timings = result["timings"]
+    namelookup = timings["dns_ms"]
+    connect = namelookup + timings["connect_ms"]
+    appconnect = connect + timings["tls_ms"] if result["tls"] or timings["tls_ms"] else 0.0
+    for name, value in (
+        ("time_namelookup", namelookup),
+        ("time_connect", connect),
+        ("time_appconnect", appconnect),
+        ("time_starttransfer", timings["ttfb_ms"]),
+        ("time_total", timings["total_ms"]),
+    ):
+        lines.append(f"{name}: {value / 1000:.6f}")
+    if result["tls"]:
+        tls = result["tls"]
+        lines.append(f"ssl_cert_expiry: {tls['not_after']} ({tls['expires_in_days']} days)")
+    return "\n".join(lines)
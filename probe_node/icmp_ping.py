@@ -0,0 +1,318 @@
+import asyncio
+import math
+import os
+import random
+import socket
+import struct
+import time
+
+# fping-style ICMP echo engine run on the shared asyncio loop (see aio.py).
+#
+# Every ping job on the node shares one ICMP socket per address family.
+# Each echo request gets a node-wide sequence number. Replies are matched
+# back to the waiting probe by that sequence number and by the source
+# address. We use an unprivileged datagram ICMP socket where the kernel
+# allows one (net.ipv4.ping_group_range), because the kernel then fills in
+# the identifier and only hands us our own replies. Otherwise we fall back
+# to a raw socket and filter on our own identifier. If neither socket can be
+# opened, ping jobs keep using the ping binary.
+
+DEFAULT_COUNT = 4
+DEFAULT_INTERVAL = 1.0      # between probes to the same target
+DEFAULT_TIMEOUT = 1.0       # wait for the last reply
+TARGET_SPACING = 0.001      # between probes to different targets in one round
+MAX_COUNT = 20
+PAYLOAD = b"ProbeOps".ljust(56, b"\x00")
+
+ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+TIME_EXCEEDED = {socket.AF_INET: 11, socket.AF_INET6: 3}
+UNREACHABLE = {socket.AF_INET: 3, socket.AF_INET6: 1}
+PROTOCOL = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+TTL_OPTION = {
+    socket.AF_INET: (socket.IPPROTO_IP, socket.IP_TTL),
+    socket.AF_INET6: (socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS),
+}
+RECVERR_OPTION = {
+    socket.AF_INET: (socket.IPPROTO_IP, getattr(socket, "IP_RECVERR", 11)),
+    socket.AF_INET6: (socket.IPPROTO_IPV6, getattr(socket, "IPV6_RECVERR", 25)),
+}
+DEFAULT_TTL = 64
+MSG_ERRQUEUE = getattr(socket, "MSG_ERRQUEUE", 0x2000)
+_EXTENDED_ERR = struct.Struct("=IBBBBII")   # struct sock_extended_err
+
+# Reply kinds a probe future can resolve with
+REPLY, HOP, UNREACHABLE_KIND = "reply", "ttl_exceeded", "unreachable"
+
+
+class PingUnavailable(Exception):
+    pass
+
+
+def checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class IcmpSocket:
+    """One ICMP socket shared by every probe of its address family.
+
+    send() returns a future that resolves to (rtt, responder, kind). kind
+    is "reply" for an echo reply, or "ttl_exceeded" or "unreachable" when a
+    router answered for a probe sent with a small TTL.
+    """
+
+    def __init__(self, family, loop):
+        self.family = family
+        self.loop = loop
+        self.raw = False
+        try:
+            self.sock = socket.socket(family, socket.SOCK_DGRAM, PROTOCOL[family])
+            # Routers' errors for datagram sockets arrive on the error queue
+            self.sock.setsockopt(*RECVERR_OPTION[family], 1)
+        except (PermissionError, OSError):
+            try:
+                self.sock = socket.socket(family, socket.SOCK_RAW, PROTOCOL[family])
+            except (PermissionError, OSError) as e:
+                raise PingUnavailable(f"No ICMP socket available: {e}")
+            self.raw = True
+        self.sock.setblocking(False)
+        self.ident = (os.getpid() ^ random.getrandbits(16)) & 0xFFFF
+        self.pending = {}  # seq: (address, sent_at, future)
+        self._seq = random.getrandbits(16)
+        self._ttl = DEFAULT_TTL
+        loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def _next_seq(self):
+        for _ in range(0x10000):
+            self._seq = (self._seq + 1) & 0xFFFF
+            if self._seq not in self.pending:
+                return self._seq
+        raise PingUnavailable("Too many probes in flight")
+
+    def send(self, address, ttl=DEFAULT_TTL):
+        """Send one echo request; returns (seq, future)."""
+        seq = self._next_seq()
+        # The last payload word cancels the sequence number out of the
+        # checksum, so every probe has the same ICMP flow for load balancers
+        payload = PAYLOAD[:-2] + struct.pack("!H", 0xFFFF - seq)
+        header = struct.pack("!BBHHH", ECHO_REQUEST[self.family], 0, 0, self.ident, seq)
+        if self.family == socket.AF_INET:
+            header = header[:2] + struct.pack("!H", checksum(header + payload)) + header[4:]
+        future = self.loop.create_future()
+        self.pending[seq] = (address, time.monotonic(), future)
+        try:
+            if ttl != self._ttl:
+                self.sock.setsockopt(*TTL_OPTION[self.family], ttl)
+                self._ttl = ttl
+            self.sock.sendto(header + payload, (address, 0))
+        except OSError as e:
+            del self.pending[seq]
+            future.set_exception(e)
+        return seq, future
+
+    def forget(self, seq):
+        self.pending.pop(seq, None)
+
+    def _resolve(self, seq, ident, target, responder, kind):
+        if self.raw and ident != self.ident:
+            # Datagram sockets get the identifier rewritten by the kernel
+            return
+        entry = self.pending.get(seq)
+        if entry is None or (target is not None and entry[0] != target):
+            return
+        del self.pending[seq]
+        _, sent_at, future = entry
+        if not future.done():
+            future.set_result((time.monotonic() - sent_at, responder, kind))
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, source = self.sock.recvfrom(2048)
+            except OSError:
+                # Drained, or a pending error that the error queue explains
+                break
+            self._on_packet(data, source[0])
+        if not self.raw:
+            self._drain_errors()
+
+    def _on_packet(self, data, source):
+        if self.raw and self.family == socket.AF_INET:
+            data = data[(data[0] & 0x0F) * 4:]
+        if len(data) < 8:
+            return
+        kind, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+        if kind == ECHO_REPLY[self.family]:
+            self._resolve(seq, ident, source, source, REPLY)
+            return
+        if not self.raw or kind not in (TIME_EXCEEDED[self.family], UNREACHABLE[self.family]):
+            return
+        # Errors quote the packet that caused them: our IP header, then our echo header
+        quoted = data[8:]
+        if self.family == socket.AF_INET:
+            if len(quoted) < 20:
+                return
+            target = socket.inet_ntop(socket.AF_INET, quoted[16:20])
+            quoted = quoted[(quoted[0] & 0x0F) * 4:]
+        else:
+            if len(quoted) < 40:
+                return
+            target = socket.inet_ntop(socket.AF_INET6, quoted[24:40])
+            quoted = quoted[40:]
+        if len(quoted) < 8 or quoted[0] != ECHO_REQUEST[self.family]:
+            return
+        _, _, _, ident, seq = struct.unpack("!BBHHH", quoted[:8])
+        reply_kind = HOP if kind == TIME_EXCEEDED[self.family] else UNREACHABLE_KIND
+        self._resolve(seq, ident, target, source, reply_kind)
+
+    def _drain_errors(self):
+        while True:
+            try:
+                data, ancdata, _, _ = self.sock.recvmsg(512, 512, MSG_ERRQUEUE)
+            except OSError:
+                return
+            if len(data) < 8:
+                continue
+            _, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+            for level, kind, cmsg in ancdata:
+                if len(cmsg) < _EXTENDED_ERR.size + 8:
+                    continue
+                _, _, icmp_type, _, _, _, _ = _EXTENDED_ERR.unpack_from(cmsg)
+                # The offending router's sockaddr follows the extended error
+                offender = cmsg[_EXTENDED_ERR.size:]
+                if self.family == socket.AF_INET:
+                    responder = socket.inet_ntop(socket.AF_INET, offender[4:8])
+                else:
+                    responder = socket.inet_ntop(socket.AF_INET6, offender[8:24])
+                if icmp_type == TIME_EXCEEDED[self.family]:
+                    self._resolve(seq, ident, None, responder, HOP)
+                elif icmp_type == UNREACHABLE[self.family]:
+                    self._resolve(seq, ident, None, responder, UNREACHABLE_KIND)
+
+
+_sockets = {}  # family: IcmpSocket
+
+
+def icmp_socket(family):
+    if family not in _sockets:
+        _sockets[family] = IcmpSocket(family, asyncio.get_running_loop())
+    return _sockets[family]
+
+
+async def wait_probe(sock, seq, future, sent_at, timeout):
+    """The (rtt, responder, kind) of a probe, or None if nothing came back within timeout of sent_at."""
+    remaining = sent_at + timeout - asyncio.get_running_loop().time()
+    try:
+        reply = await asyncio.wait_for(future, max(0, remaining))
+    except (asyncio.TimeoutError, OSError):
+        return None
+    finally:
+        sock.forget(seq)
+    # Probes are awaited after the whole send loop, so a late reply may already be here
+    if reply[0] > timeout:
+        return None
+    return reply
+
+
+async def resolve(target):
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(target, None, type=socket.SOCK_DGRAM)
+    family, _, _, _, sockaddr = infos[0]
+    return family, sockaddr[0]
+
+
+def _summary(target, address, rtts, sent, error=None):
+    replies = [rtt * 1000 for rtt in rtts if rtt is not None]
+    result = {
+        "target": target,
+        "address": address,
+        "sent": sent,
+        "received": len(replies),
+        "loss_pct": round(100.0 * (sent - len(replies)) / sent, 1) if sent else 100.0,
+        "rtts_ms": [round(rtt * 1000, 3) if rtt is not None else None for rtt in rtts],
+        "min_ms": None,
+        "avg_ms": None,
+        "max_ms": None,
+        "stddev_ms": None,
+    }
+    if replies:
+        avg = sum(replies) / len(replies)
+        result.update(
+            min_ms=round(min(replies), 3),
+            avg_ms=round(avg, 3),
+            max_ms=round(max(replies), 3),
+            stddev_ms=round(math.sqrt(sum((r - avg) ** 2 for r in replies) / len(replies)), 3),
+        )
+    if error:
+        result["error"] = error
+    return result
+
+
+async def ping(targets, count=DEFAULT_COUNT, interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT):
+    """Ping every target `count` times over the shared socket and summarise each."""
+    count = max(1, min(int(count), MAX_COUNT))
+    interval = max(0.01, float(interval))
+    timeout = max(0.05, float(timeout))
+
+    resolved = await asyncio.gather(*(resolve(t) for t in targets), return_exceptions=True)
+    live = []      # (index, socket, address)
+    results = [None] * len(targets)
+    for i, (target, resolution) in enumerate(zip(targets, resolved)):
+        if isinstance(resolution, Exception):
+            results[i] = _summary(target, None, [], 0, f"Could not resolve {target}: {resolution}")
+            continue
+        family, address = resolution
+        live.append((i, icmp_socket(family), address))
+
+    probes = {i: [] for i, _, _ in live}  # index: [(sock, sent_at, seq, future)]
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for round_no in range(count):
+        for i, sock, address in live:
+            probes[i].append((sock, loop.time()) + sock.send(address))
+            await asyncio.sleep(TARGET_SPACING)
+        if round_no < count - 1:
+            await asyncio.sleep(max(0, started + (round_no + 1) * interval - loop.time()))
+
+    async def wait_reply(sock, sent_at, seq, future):
+        reply = await wait_probe(sock, seq, future, sent_at, timeout)
+        return reply[0] if reply and reply[2] == REPLY else None
+
+    for i, sock, address in live:
+        rtts = await asyncio.gather(*(wait_reply(*probe) for probe in probes[i]))
+        results[i] = _summary(targets[i], address, rtts, len(rtts))
+    return results
+
+
+def format_ping(results):
+    """iputils-style statistics per target, with the replies when there is only one."""
+    lines = []
+    for result in results:
+        target, address = result["target"], result["address"]
+        if result.get("error"):
+            lines.append(f"ping: {result['error']}")
+            lines.append("")
+            continue
+        if len(results) == 1:
+            lines.append(f"PING {target} ({address}) {len(PAYLOAD)}({len(PAYLOAD) + 28}) bytes of data.")
+            for seq, rtt in enumerate(result["rtts_ms"], 1):
+                if rtt is not None:
+                    lines.append(f"{len(PAYLOAD) + 8} bytes from {address}: icmp_seq={seq} time={rtt:.3g} ms")
+            lines.append("")
+        lines.append(f"--- {target} ping statistics ---")
+        lines.append(
+            f"{result['sent']} packets transmitted, {result['received']} received, "
+            f"{result['loss_pct']:g}% packet loss"
+        )
+        if result["received"]:
+            lines.append(
+                f"rtt min/avg/max/mdev = {result['min_ms']:.3f}/{result['avg_ms']:.3f}/"
+                f"{result['max_ms']:.3f}/{result['stddev_ms']:.3f} ms"
+            )
+        lines.append("")
+    return "\n".join(lines).rstrip()
@@ -0,0 +1,133 @@
+import subprocess
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import aio
+
+# Deadlines and cancellation for running jobs.
+#
+# A job message may carry "deadline" (epoch seconds), after which the backend
+# has stopped waiting; every tool timeout is cut short to fit it. The backend
+# can also send {"action": "cancel"} for a job it gave up on. A queued job is
+# then skipped when a worker reaches it, and a running one has its subprocess
+# killed or its coroutine cancelled on the shared loop.
+
+
+class JobCancelled(Exception):
+    pass
+
+
+_lock = threading.Lock()
+_active = {}        # job_id: callback stopping the running step, or None
+_cancelled = set()
+_current = threading.local()
+
+
+def accept(job_id):
+    """Note a job the backend may later cancel, as soon as it arrives."""
+    with _lock:
+        _active.setdefault(job_id, None)
+
+
+def cancel(job_id):
+    with _lock:
+        if job_id not in _active:
+            # Already finished, or never seen
+            return False
+        _cancelled.add(job_id)
+        stop = _active[job_id]
+    if stop is not None:
+        stop()
+    return True
+
+
+def is_cancelled(job_id):
+    with _lock:
+        return job_id in _cancelled
+
+
+def begin(job_id, deadline=None):
+    _current.job_id = job_id
+    _current.deadline = deadline
+
+
+def end(job_id):
+    _current.job_id = None
+    _current.deadline = None
+    with _lock:
+        _active.pop(job_id, None)
+        _cancelled.discard(job_id)
+
+
+def expired(deadline):
+    return deadline is not None and time.time() >= deadline
+
+
+def time_left(limit):
+    """`limit` seconds, or less if the current job's deadline comes first."""
+    deadline = getattr(_current, "deadline", None)
+    if deadline is None:
+        return limit
+    remaining = max(0.0, deadline - time.time())
+    return remaining if limit is None else min(limit, remaining)
+
+
+def _watch(stop):
+    job_id = getattr(_current, "job_id", None)
+    if job_id is None:
+        return
+    with _lock:
+        if job_id in _active:
+            _active[job_id] = stop
+        cancelled = job_id in _cancelled
+    if cancelled:
+        stop()
+
+
+def _unwatch():
+    job_id = getattr(_current, "job_id", None)
+    with _lock:
+        if job_id in _active:
+            _active[job_id] = None
+
+
+def _check_cancelled():
+    job_id = getattr(_current, "job_id", None)
+    if job_id is not None and is_cancelled(job_id):
+        raise JobCancelled(job_id)
+
+
+def run_async(coro, timeout=None):
+    """aio.run for the current job: bounded by its deadline, stopped by cancel."""
+    _check_cancelled()
+    future = aio.submit(coro)
+    _watch(future.cancel)
+    try:
+        return future.result(time_left(timeout))
+    except TimeoutError:
+        future.cancel()
+        raise
+    except CancelledError:
+        raise JobCancelled(getattr(_current, "job_id", None))
+    finally:
+        _unwatch()
+
+
+def run_command(cmd, timeout):
+    """subprocess.check_output for the current job, killed on cancel."""
+    _check_cancelled()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    _watch(proc.kill)
+    try:
+        output, _ = proc.communicate(timeout=time_left(timeout))
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise
+    finally:
+        _unwatch()
+    _check_cancelled()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+    return output.decode()
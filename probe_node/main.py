@@ -2,21 +2,115 @@ import websocket
 import threading
 import time
 import json
+import os
+import random
 import subprocess
+import dns_client
+import http_probe
+import icmp_ping
+import job_control
+import port_scanner
+import traceroute
+from executor import JobExecutor
+from outbox import Outbox
+from targets import expand_targets
+from wire import encode_result, encode_results
 
 print("Probe Node: Starting up!")
 
-WS_URL = "ws://backend:8000/ws/node"
+WS_URL = os.getenv("WS_URL", "ws://backend:8000/ws/node")
+NODE_NAME = os.getenv("NODE_NAME", "probe-node-1")
+NODE_REGION = os.getenv("NODE_REGION")
+# Fallback until the backend sends the value stored on the ProbeNode row
+MAX_CONCURRENT_PROBES = int(os.getenv("MAX_CONCURRENT_PROBES", "10"))
+
+SUPPORTED_TOOLS = ["ping", "traceroute", "curl", "port_check", "nmap", "dns", "rdns", "whois"]
+
+# Protocol features we offer at register; the backend answers with the subset it speaks
+CAPABILITIES = ["batch", "binary", "zlib", "resume", "cancel"]
+negotiated = set()
+
+# With "batch", results finishing within this window share one frame
+RESULT_FLUSH_SECONDS = 0.02
+RESULT_BATCH_MAX = 50
+result_buffer = []
+result_cond = threading.Condition()
+
+# Overall limits for jobs run by the in-process engines
+SCAN_JOB_TIMEOUT = 30
+DNS_JOB_TIMEOUT = 12
+PING_JOB_TIMEOUT = 60
+TRACE_JOB_TIMEOUT = 90
+
+# Results wait here until the backend acks them, and are replayed after a reconnect
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+outbox = Outbox(OUTBOX_PATH)
+
+# Reconnect delay doubles per failed attempt up to the cap, with full jitter so
+# a fleet that lost the backend together doesn't come back in lockstep
+RECONNECT_BASE_SECONDS = 1
+RECONNECT_MAX_SECONDS = 60
+STABLE_CONNECTION_SECONDS = 30
+
+# The heartbeat thread and every executor worker write to the same socket
+current_ws = None
+send_lock = threading.Lock()
+
+def send_message(msg):
+    with send_lock:
+        if current_ws is None:
+            raise ConnectionError("Not connected to backend")
+        current_ws.send(json.dumps(msg))
+
+def send_frame(frame):
+    with send_lock:
+        if current_ws is None:
+            raise ConnectionError("Not connected to backend")
+        current_ws.send(frame, opcode=websocket.ABNF.OPCODE_BINARY)
+
+def send_results(result_msgs):
+    """Send results as one frame in the best format the backend agreed to."""
+    if "binary" in negotiated:
+        compress = "zlib" in negotiated
+        if len(result_msgs) == 1:
+            send_frame(encode_result(result_msgs[0], compress))
+        else:
+            send_frame(encode_results(result_msgs, compress))
+    elif len(result_msgs) == 1:
+        send_message(result_msgs[0])
+    else:
+        send_message({"action": "results", "results": result_msgs})
+
+def deliver_results(result_msgs):
+    send_results(result_msgs)
+    if "resume" not in negotiated:
+        # The backend won't ack; sent is as good as it gets
+        outbox.ack([r["job_id"] for r in result_msgs])
+
+def replay_outbox():
+    stored = outbox.pending()
+    if not stored:
+        return
+    print(f"[*] Replaying {len(stored)} results from the outbox")
+    for i in range(0, len(stored), RESULT_BATCH_MAX):
+        try:
+            deliver_results(stored[i:i + RESULT_BATCH_MAX])
+        except Exception as e:
+            print(f"[!] Outbox replay stopped: {e}")
+            return
 
 def send_heartbeat(ws):
-    while True:
+    while current_ws is ws:
         try:
             heartbeat_msg = {
                 "action": "heartbeat",
                 "status": "ok",
-                "node_name": "probe-node-1"
+                "node_name": NODE_NAME,
+                **executor.stats(),
+                **dns_client.cache_stats(),
+                "outbox_pending": outbox.count(),
             }
-            ws.send(json.dumps(heartbeat_msg))
+            send_message(heartbeat_msg)
             print("Sent heartbeat")
         except Exception as e:
             print("Heartbeat error:", e)
@@ -24,136 +118,237 @@ def send_heartbeat(ws):
         time.sleep(10)
 
 def on_open(ws):
+    global current_ws
     print("[+] Connected to backend WebSocket!")
+    with send_lock:
+        current_ws = ws
+    # Until the backend confirms, speak the plain protocol
+    negotiated.clear()
     registration_msg = {
         "action": "register",
-        "node_name": "probe-node-1"
+        "node_name": NODE_NAME,
+        "region": NODE_REGION,
+        "supported_tools": SUPPORTED_TOOLS,
+        "max_concurrent_probes": executor.max_concurrent,
+        "capabilities": CAPABILITIES,
     }
-    ws.send(json.dumps(registration_msg))
+    send_message(registration_msg)
     # Start heartbeat in background
     threading.Thread(target=send_heartbeat, args=(ws,), daemon=True).start()
 
-def on_message(ws, message):
-    try:
-        msg = json.loads(message)
-        print("[*] Message from backend:", msg)
+def format_output(params, data, text):
+    """Engine results go out as text by default, or as JSON with params.format == "json"."""
+    if params.get("format") == "json":
+        return json.dumps(data)
+    return text
 
-        if msg.get("action") == "job":
-            job_id = msg.get("job_id")
-            job_type = msg.get("job_type")
-            target = msg.get("target")
-            port = msg.get("port", None)
-            params = msg.get("params", {})  # <- Add this line
+def run_job(msg):
+    job_type = msg.get("job_type")
+    target = msg.get("target")
+    port = msg.get("port", None)
+    params = msg.get("params") or {}
 
-            output = ""
-            success = True
+    output = ""
+    success = True
 
+    try:
+        if job_type == "ping":
+            try:
+                results = job_control.run_async(icmp_ping.ping(
+                    expand_targets(target),
+                    count=params.get("count", icmp_ping.DEFAULT_COUNT),
+                    interval=params.get("interval", icmp_ping.DEFAULT_INTERVAL),
+                    timeout=params.get("timeout", icmp_ping.DEFAULT_TIMEOUT),
+                ), timeout=PING_JOB_TIMEOUT)
+                success = any(result["received"] for result in results)
+                output = format_output(params, results, icmp_ping.format_ping(results))
+            except icmp_ping.PingUnavailable as e:
+                print(f"[!] {e}, falling back to the ping binary")
+                output = job_control.run_command(["ping", "-c", "4", target], timeout=10)
+        elif job_type == "traceroute":
+            mtr = params.get("mode") == "mtr"
             try:
-                if job_type == "ping":
-                    output = subprocess.check_output(
-                        ["ping", "-c", "4", target],
-                        stderr=subprocess.STDOUT,
-                        timeout=10
-                    ).decode()
-                elif job_type == "traceroute":
-                    output = subprocess.check_output(
-                        ["traceroute", target],
-                        stderr=subprocess.STDOUT,
-                        timeout=20
-                    ).decode()
-                elif job_type == "curl":
-                    output = subprocess.check_output(
-                        ["curl", "-s", "-D", "-", target, "-o", "/dev/null"],
-                        stderr=subprocess.STDOUT,
-                        timeout=15
-                    ).decode()
-                elif job_type == "port_check":
-                    if port is None:
-                        output = "Missing 'port' argument for port_check"
-                        success = False
-                    else:
-                        try:
-                            port = int(port)
-                            result = subprocess.check_output(
-                                ["nc", "-zv", target, str(port)],
-                                stderr=subprocess.STDOUT,
-                                timeout=10
-                            ).decode()
-                            output = f"Port {port} open:\n" + result
-                        except subprocess.CalledProcessError as e:
-                            output = f"Port {port} closed or error:\n" + e.output.decode()
-                        except subprocess.TimeoutExpired:
-                            output = f"Port check to {target}:{port} timed out"
-                            success = False
-                        except Exception as e:
-                            output = f"Port check error: {e}"
-                            success = False
-                elif job_type == "nmap":
-                    ports = params.get("ports", None)
-                    if ports:
-                        port_str = str(ports)
-                    else:
-                        port_str = "1-1024"
-                    cmd = ["nmap", "-p", port_str, target]
-                    output = subprocess.check_output(
-                        cmd,
-                        stderr=subprocess.STDOUT,
-                        timeout=30
-                    ).decode()
-                elif job_type == "dns":
-                    record_type = params.get("record_type", "A")
-                    resolver = params.get("resolver", None)
-                    recursive = params.get("recursive", True)
-                    cmd = ["dig", "+short", target, record_type]
-                    if resolver:
-                        cmd = ["dig", f"@{resolver}", "+short", target, record_type]
-                    if not recursive:
-                        cmd.append("+norecurse")
-                    try:
-                        output = subprocess.check_output(
-                            cmd,
-                            stderr=subprocess.STDOUT,
-                            timeout=10
-                        ).decode()
-                    except Exception as e:
-                        # fallback to nslookup
-                        output = subprocess.check_output(
-                            ["nslookup", target],
-                            stderr=subprocess.STDOUT,
-                            timeout=10
-                        ).decode()
-                elif job_type == "rdns":
-                    # Reverse DNS Lookup
-                    output = subprocess.check_output(
-                        ["nslookup", target],
-                        stderr=subprocess.STDOUT,
-                        timeout=10
-                    ).decode()
-                elif job_type == "whois":
-                    output = subprocess.check_output(
-                        ["whois", target],
-                        stderr=subprocess.STDOUT,
-                        timeout=20
-                    ).decode()
-                else:
-                    output = f"Unknown job_type: {job_type}"
-                    success = False
-            except subprocess.TimeoutExpired:
-                output = f"{job_type} command timed out"
+                result = job_control.run_async(traceroute.trace(
+                    target,
+                    max_hops=params.get("max_hops", traceroute.DEFAULT_MAX_HOPS),
+                    queries=params.get("queries", 1 if mtr else traceroute.DEFAULT_QUERIES),
+                    timeout=params.get("timeout", traceroute.DEFAULT_TIMEOUT),
+                    rounds=params.get("rounds", traceroute.MTR_ROUNDS if mtr else 1),
+                    interval=params.get("interval", traceroute.MTR_INTERVAL),
+                ), timeout=TRACE_JOB_TIMEOUT)
+                text = traceroute.format_mtr(result, NODE_NAME) if mtr else traceroute.format_traceroute(result)
+                output = format_output(params, result, text)
+            except icmp_ping.PingUnavailable as e:
+                print(f"[!] {e}, falling back to the traceroute binary")
+                output = job_control.run_command(["traceroute", target], timeout=20)
+        elif job_type == "curl":
+            result = job_control.run_async(http_probe.probe(
+                target,
+                method=params.get("method", "GET"),
+                headers=params.get("headers"),
+                verify=params.get("verify", True),
+                keep_alive=params.get("keep_alive", False),
+            ), timeout=params.get("timeout", http_probe.DEFAULT_TIMEOUT))
+            output = format_output(params, result, http_probe.format_curl(result))
+        elif job_type == "port_check":
+            if port is None:
+                output = "Missing 'port' argument for port_check"
                 success = False
+            else:
+                port = int(port)
+                result = job_control.run_async(port_scanner.scan_host(
+                    target, [port],
+                    timeout=params.get("timeout", 5),
+                    retries=params.get("retries", port_scanner.DEFAULT_RETRIES),
+                ), timeout=SCAN_JOB_TIMEOUT)
+                success = not result.get("error") and port not in result["filtered"]
+                output = format_output(params, result, port_scanner.format_port_check(result, port))
+        elif job_type == "nmap" and params.get("mode") == "fast" and params.get("protocol", "tcp") == "tcp":
+            # In-process connect scan; same ports/target syntax, nmap-style report
+            started = time.monotonic()
+            results = job_control.run_async(port_scanner.scan(
+                expand_targets(target),
+                port_scanner.parse_ports(params.get("ports") or "1-1024"),
+                concurrency=params.get("concurrency", port_scanner.DEFAULT_CONCURRENCY),
+                timeout=params.get("timeout", port_scanner.DEFAULT_TIMEOUT),
+                retries=params.get("retries", port_scanner.DEFAULT_RETRIES),
+            ), timeout=SCAN_JOB_TIMEOUT)
+            output = format_output(
+                params, results, port_scanner.format_nmap(results, time.monotonic() - started)
+            )
+        elif job_type == "nmap":
+            ports = params.get("ports", None)
+            if ports:
+                port_str = str(ports)
+            else:
+                port_str = "1-1024"
+            cmd = ["nmap", "-p", port_str, target]
+            output = job_control.run_command(cmd, timeout=30)
+        elif job_type == "dns":
+            result = job_control.run_async(dns_client.lookup(
+                target,
+                params.get("record_type", "A"),
+                resolver=params.get("resolver"),
+                recursive=params.get("recursive", True),
+                use_cache=not params.get("no_cache", False),
+            ), timeout=DNS_JOB_TIMEOUT)
+            success = result["rcode"] in ("NOERROR", "NXDOMAIN")
+            output = format_output(params, result, dns_client.format_short(result))
+        elif job_type == "rdns":
+            result = job_control.run_async(dns_client.reverse_lookup(
+                target,
+                resolver=params.get("resolver"),
+                use_cache=not params.get("no_cache", False),
+            ), timeout=DNS_JOB_TIMEOUT)
+            success = result["rcode"] in ("NOERROR", "NXDOMAIN")
+            output = format_output(params, result, dns_client.format_short(result))
+        elif job_type == "whois":
+            output = job_control.run_command(["whois", target], timeout=20)
+        else:
+            output = f"Unknown job_type: {job_type}"
+            success = False
+    except job_control.JobCancelled:
+        output = f"{job_type} cancelled"
+        success = False
+    except subprocess.TimeoutExpired:
+        output = f"{job_type} command timed out"
+        success = False
+    except TimeoutError:
+        output = f"{job_type} timed out"
+        success = False
+    except Exception as e:
+        output = f"{job_type} error: {e}"
+        success = False
+
+    return output, success
+
+def handle_job(msg):
+    job_id = msg.get("job_id")
+    deadline = msg.get("deadline")
+    started = time.monotonic()
+    job_control.begin(job_id, deadline)
+    try:
+        cancelled = True
+        if job_control.is_cancelled(job_id):
+            output, success = "Job cancelled before it started", False
+        elif job_control.expired(deadline):
+            # Sat in the queue past the point anyone is waiting for it
+            output, success = "Job deadline passed before it started", False
+        else:
+            output, success = run_job(msg)
+            cancelled = job_control.is_cancelled(job_id)
+    finally:
+        job_control.end(job_id)
+    result_msg = {
+        "action": "result",
+        "job_id": job_id,
+        "output": output,
+        "success": success,
+        "duration_ms": round((time.monotonic() - started) * 1000, 1),
+    }
+    if cancelled:
+        # Still reported, so the backend frees the slot, but never stored as a result
+        result_msg["cancelled"] = True
+    if msg.get("origin"):
+        result_msg["origin"] = msg["origin"]
+    outbox.put(result_msg)
+    if "batch" in negotiated:
+        with result_cond:
+            result_buffer.append(result_msg)
+            result_cond.notify()
+        return
+    try:
+        deliver_results([result_msg])
+        print(f"[*] Sent result for job {job_id}")
+    except Exception as e:
+        print(f"[!] Could not send result for job {job_id}: {e}")
+
+def flush_results():
+    while True:
+        with result_cond:
+            while not result_buffer:
+                result_cond.wait()
+        # Give results finishing right behind this one a chance to share the frame
+        time.sleep(RESULT_FLUSH_SECONDS)
+        with result_cond:
+            batch = result_buffer[:]
+            del result_buffer[:]
+        for i in range(0, len(batch), RESULT_BATCH_MAX):
+            chunk = batch[i:i + RESULT_BATCH_MAX]
+            try:
+                deliver_results(chunk)
+                print(f"[*] Sent {len(chunk)} results")
             except Exception as e:
-                output = f"{job_type} error: {e}"
-                success = False
+                print(f"[!] Could not send {len(chunk)} results: {e}")
 
-            result_msg = {
-                "action": "result",
-                "job_id": job_id,
-                "output": output,
-                "success": success
-            }
-            ws.send(json.dumps(result_msg))
-            print(f"[*] Sent result for job {job_id}")
+executor = JobExecutor(handle_job, MAX_CONCURRENT_PROBES)
+threading.Thread(target=flush_results, daemon=True).start()
+
+def on_message(ws, message):
+    try:
+        msg = json.loads(message)
+        print("[*] Message from backend:", msg.get("action") or msg)
 
+        if msg.get("action") == "job":
+            # Hand off to the pool so this callback thread keeps reading
+            job_control.accept(msg.get("job_id"))
+            executor.submit(msg)
+        elif msg.get("action") == "jobs":
+            for job in msg.get("jobs", []):
+                job_control.accept(job.get("job_id"))
+                executor.submit(job)
+        elif msg.get("action") == "cancel":
+            if job_control.cancel(msg.get("job_id")):
+                print(f"[*] Cancelling job {msg.get('job_id')}")
+        elif msg.get("action") == "registered":
+            negotiated.clear()
+            negotiated.update(msg.get("capabilities") or [])
+            max_concurrent = msg.get("max_concurrent_probes")
+            if max_concurrent and int(max_concurrent) != executor.max_concurrent:
+                executor.resize(max_concurrent)
+            threading.Thread(target=replay_outbox, daemon=True).start()
+        elif msg.get("action") == "ack":
+            outbox.ack(msg.get("job_ids") or [])
         else:
             print("[*] Non-job message from backend:", msg)
 
@@ -164,10 +359,19 @@ def on_error(ws, error):
     print("[!] WebSocket error:", error)
 
 def on_close(ws, close_status_code, close_msg):
+    global current_ws
     print("[!] WebSocket closed:", close_status_code, close_msg)
+    with send_lock:
+        if current_ws is ws:
+            current_ws = None
+
+def reconnect_delay(attempt):
+    return random.uniform(0, min(RECONNECT_MAX_SECONDS, RECONNECT_BASE_SECONDS * 2 ** attempt))
 
 def run_ws():
+    attempt = 0
     while True:
+        started = time.monotonic()
         try:
             ws = websocket.WebSocketApp(
                 WS_URL,
@@ -178,8 +382,13 @@ def run_ws():
             )
             ws.run_forever()
         except Exception as e:
-            print("[!] Exception, retrying in 5s:", e)
-            time.sleep(5)
+            print("[!] WebSocket exception:", e)
+        if time.monotonic() - started >= STABLE_CONNECTION_SECONDS:
+            attempt = 0
+        delay = reconnect_delay(attempt)
+        attempt += 1
+        print(f"[!] Reconnecting in {delay:.1f}s (attempt {attempt})")
+        time.sleep(delay)
 
 if __name__ == "__main__":
     print("Starting Probe Node WebSocket client...")
@@ -0,0 +1,52 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Results are written here before they are sent and deleted once the backend
+# acks them (capability "resume"). Whatever is left when the websocket drops
+# is replayed after the next register, so a flaky link costs a delay rather
+# than the work. Results nobody collected within max_age are dropped.
+
+
+class Outbox:
+    def __init__(self, path, max_age=86400, max_rows=10000):
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "job_id TEXT PRIMARY KEY, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def put(self, result_msg):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (job_id, payload, created_at) VALUES (?, ?, ?)",
+                (result_msg["job_id"], json.dumps(result_msg), time.time()),
+            )
+
+    def ack(self, job_ids):
+        if not job_ids:
+            return
+        with self._lock:
+            self._db.executemany("DELETE FROM results WHERE job_id = ?", [(j,) for j in job_ids])
+
+    def pending(self):
+        """Every stored result, oldest first, after dropping expired ones."""
+        with self._lock:
+            self._db.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.max_age,))
+            self._db.execute(
+                "DELETE FROM results WHERE job_id NOT IN "
+                "(SELECT job_id FROM results ORDER BY created_at DESC LIMIT ?)",
+                (self.max_rows,),
+            )
+            rows = self._db.execute("SELECT payload FROM results ORDER BY created_at").fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
@@ -0,0 +1,222 @@
+import asyncio
+import errno
+import os
+import socket
+import struct
+import time
+
+# TCP connect scanner run on the shared asyncio loop (see aio.py).
+#
+# Every port gets one non-blocking connect. A completed handshake is "open",
+# a RST is "closed", and silence or an ICMP unreachable is "filtered". Per
+# host we keep an RTT estimate (srtt + 4 * rttvar, as TCP does) from the
+# ports that answered. Once a host has answered, the remaining ports only
+# wait that long instead of the full timeout. Ports that time out are retried
+# with the full timeout, so a tight estimate costs a retry, not a wrong answer.
+
+# Sockets open at once across every scan on this node
+MAX_OPEN_SOCKETS = int(os.getenv("SCAN_MAX_SOCKETS", "512"))
+DEFAULT_CONCURRENCY = 200
+DEFAULT_TIMEOUT = 1.5
+MIN_TIMEOUT = 0.05
+MAX_TIMEOUT = 10.0
+DEFAULT_RETRIES = 1
+MAX_PORTS = 65535
+
+OPEN, CLOSED, FILTERED = "open", "closed", "filtered"
+
+_UNREACHABLE = {errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EACCES, errno.EPERM}
+_NO_LINGER = struct.pack("ii", 1, 0)
+
+_socket_slots = asyncio.Semaphore(MAX_OPEN_SOCKETS)
+
+
+def parse_ports(spec):
+    """Parse "22,80,8000-8100" (or an int or list) into a sorted list of ports."""
+    if isinstance(spec, int):
+        items = [str(spec)]
+    elif isinstance(spec, (list, tuple)):
+        items = [str(item) for item in spec]
+    else:
+        items = str(spec).replace(" ", "").split(",")
+    ports = set()
+    for item in items:
+        if not item:
+            continue
+        if "-" in item:
+            low, high = item.split("-", 1)
+            low, high = int(low or 1), int(high or 65535)
+        else:
+            low = high = int(item)
+        if not 1 <= low <= high <= 65535:
+            raise ValueError(f"Invalid port range: {item}")
+        ports.update(range(low, high + 1))
+    if not ports:
+        raise ValueError("No ports given")
+    if len(ports) > MAX_PORTS:
+        raise ValueError(f"More than {MAX_PORTS} ports")
+    return sorted(ports)
+
+
+class RttEstimator:
+    def __init__(self, max_timeout):
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def timeout(self):
+        if self.srtt is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(MIN_TIMEOUT, self.srtt + 4 * self.rttvar))
+
+
+async def resolve(host):
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    family, _, _, _, sockaddr = infos[0]
+    return family, sockaddr[0]
+
+
+async def probe_port(family, address, port, timeout):
+    """Connect once. Returns (state, rtt seconds or None, retryable)."""
+    loop = asyncio.get_running_loop()
+    async with _socket_slots:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        # Reset instead of FIN on close so a big scan leaves no TIME_WAIT behind
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _NO_LINGER)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (address, port)), timeout)
+            return OPEN, time.monotonic() - start, False
+        except ConnectionRefusedError:
+            return CLOSED, time.monotonic() - start, False
+        except asyncio.TimeoutError:
+            return FILTERED, None, True
+        except OSError as e:
+            if e.errno in _UNREACHABLE:
+                return FILTERED, None, False
+            # Out of local resources (EMFILE, EADDRNOTAVAIL...): worth another go
+            return FILTERED, None, True
+        finally:
+            sock.close()
+
+
+async def scan_host(host, ports, concurrency=DEFAULT_CONCURRENCY,
+                    timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+    """Scan `ports` on one host and return the ports grouped by state."""
+    started = time.monotonic()
+    result = {"target": host, "address": None, "open": [], "closed": [], "filtered": []}
+    try:
+        family, address = await resolve(host)
+    except OSError as e:
+        result["error"] = f"Could not resolve {host}: {e}"
+        return result
+    result["address"] = address
+
+    timeout = min(MAX_TIMEOUT, max(MIN_TIMEOUT, float(timeout)))
+    rtt = RttEstimator(timeout)
+    states = {}
+    slots = asyncio.Semaphore(max(1, min(int(concurrency), MAX_OPEN_SOCKETS)))
+
+    async def probe(port, port_timeout):
+        async with slots:
+            state, sample, retryable = await probe_port(
+                family, address, port, port_timeout or rtt.timeout()
+            )
+        if sample is not None:
+            rtt.sample(sample)
+        states[port] = state
+        return port if retryable else None
+
+    pending = list(ports)
+    for attempt in range(max(0, int(retries)) + 1):
+        # First pass adapts to the host; retries always wait the full timeout
+        port_timeout = None if attempt == 0 else timeout
+        retry = await asyncio.gather(*(probe(port, port_timeout) for port in pending))
+        pending = [port for port in retry if port is not None]
+        if not pending:
+            break
+
+    for port in ports:
+        result[states[port]].append(port)
+    result["rtt_ms"] = round(rtt.srtt * 1000, 2) if rtt.srtt is not None else None
+    result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+async def scan(hosts, ports, concurrency=DEFAULT_CONCURRENCY,
+               timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+    """Scan several hosts at once; the socket cap is shared between them."""
+    return await asyncio.gather(*(
+        scan_host(host, ports, concurrency, timeout, retries) for host in hosts
+    ))
+
+
+def service_name(port):
+    try:
+        return socket.getservbyport(port, "tcp")
+    except OSError:
+        return "unknown"
+
+
+# Listing more ports than this in one state collapses them into "Not shown"
+LIST_LIMIT = 25
+
+
+def format_nmap(results, elapsed):
+    """Render scan results in nmap's normal output format."""
+    lines = ["Starting fast TCP connect scan"]
+    up = 0
+    for result in results:
+        host = result["target"]
+        label = host if result["address"] in (None, host) else f"{host} ({result['address']})"
+        if result.get("error"):
+            lines.append(f"Failed to resolve \"{host}\".")
+            continue
+        lines.append(f"Nmap scan report for {label}")
+        if result["rtt_ms"] is not None:
+            up += 1
+            lines.append(f"Host is up ({result['rtt_ms'] / 1000:.3f}s latency).")
+        total = len(result["open"]) + len(result["closed"]) + len(result["filtered"])
+        if not result["open"] and not result["closed"]:
+            lines.append(f"All {total} scanned ports on {label} are filtered")
+            lines.append("")
+            continue
+        hidden = []
+        shown = [(port, OPEN) for port in result["open"]]
+        for state, reason in ((CLOSED, "conn-refused"), (FILTERED, "no-response")):
+            if len(result[state]) > LIST_LIMIT:
+                hidden.append(f"{len(result[state])} {state} tcp ports ({reason})")
+            else:
+                shown.extend((port, state) for port in result[state])
+        if hidden:
+            lines.append("Not shown: " + ", ".join(hidden))
+        if shown:
+            lines.append("PORT      STATE    SERVICE")
+            for port, state in sorted(shown):
+                lines.append(f"{f'{port}/tcp':<9} {state:<8} {service_name(port)}")
+        lines.append("")
+    lines.append(
+        f"Scan done: {len(results)} IP address{'es' if len(results) != 1 else ''} "
+        f"({up} host{'s' if up != 1 else ''} up) scanned in {elapsed:.2f} seconds"
+    )
+    return "\n".join(lines)
+
+
+def format_port_check(result, port):
+    if result.get("error"):
+        return result["error"]
+    where = f"{result['target']} ({result['address']})"
+    if port in result["open"]:
+        return f"Port {port} open on {where}, connect time {result['rtt_ms']} ms"
+    if port in result["closed"]:
+        return f"Port {port} closed on {where} (connection refused)"
+    return f"Port {port} filtered on {where} (no response)"
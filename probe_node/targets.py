@@ -0,0 +1,31 @@
+import ipaddress
+import re
+
+MAX_TARGETS = 256
+
+
+def expand_targets(spec, limit=MAX_TARGETS):
+    """Turn "a.com, 10.0.0.0/30 b.com" (or a list) into a list of hosts.
+
+    CIDR blocks expand to their usable addresses. Raises ValueError when the
+    expansion would exceed `limit` hosts.
+    """
+    items = spec if isinstance(spec, (list, tuple)) else re.split(r"[,\s]+", str(spec or ""))
+    targets = []
+    for item in items:
+        item = str(item).strip()
+        if not item:
+            continue
+        if "/" in item:
+            network = ipaddress.ip_network(item, strict=False)
+            if network.num_addresses > limit + 2:
+                raise ValueError(f"{item} has more than {limit} addresses")
+            hosts = list(network.hosts()) or [network.network_address]
+            targets.extend(str(host) for host in hosts)
+        else:
+            targets.append(item)
+        if len(targets) > limit:
+            raise ValueError(f"More than {limit} targets")
+    if not targets:
+        raise ValueError("No targets given")
+    return targets
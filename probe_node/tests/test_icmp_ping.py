@@ -0,0 +1,43 @@
+import asyncio
+
+import icmp_ping
+
+
+class FakeSocket:
+    def __init__(self):
+        self.forgotten = []
+
+    def forget(self, seq):
+        self.forgotten.append(seq)
+
+
+def test_reply_later_than_timeout_is_lost():
+    async def run():
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Came back after 5s, but was only awaited once the send loop finished
+        future.set_result((5.0, "192.0.2.1", icmp_ping.REPLY))
+        return await icmp_ping.wait_probe(FakeSocket(), 1, future, loop.time() - 6, timeout=1)
+
+    assert asyncio.run(run()) is None
+
+
+def test_reply_within_timeout_is_kept():
+    async def run():
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        loop.call_later(0.01, future.set_result, (0.01, "192.0.2.1", icmp_ping.REPLY))
+        return await icmp_ping.wait_probe(FakeSocket(), 1, future, loop.time(), timeout=1)
+
+    assert asyncio.run(run()) == (0.01, "192.0.2.1", icmp_ping.REPLY)
+
+
+def test_no_reply_times_out():
+    sock = FakeSocket()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        return await icmp_ping.wait_probe(sock, 7, loop.create_future(), loop.time(), timeout=0.05)
+
+    assert asyncio.run(run()) is None
+    assert sock.forgotten == [7]
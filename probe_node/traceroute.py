@@ -0,0 +1,143 @@
+import asyncio
+import math
+from collections import Counter
+
+import icmp_ping
+
+# Parallel Paris-style traceroute over the shared ICMP socket (icmp_ping.py).
+#
+# A round sends one ICMP echo for every TTL from 1 to max_hops at once. The
+# probes keep the same identifier and checksum, so per-flow load balancers
+# send them all down one path. Routers' time-exceeded messages and the
+# target's echo replies are matched back by sequence number, and the trace
+# is done once the slowest probe answers or times out. After the first round
+# we know where the target sits, so later rounds stop at that hop.
+
+DEFAULT_MAX_HOPS = 30
+DEFAULT_QUERIES = 3          # probes per hop, as traceroute -q
+DEFAULT_TIMEOUT = 2.0
+QUERY_SPACING = 0.02         # between the waves of one round
+MTR_ROUNDS = 10
+MTR_INTERVAL = 1.0
+MAX_ROUNDS = 60
+
+
+def _stats(rtts):
+    if not rtts:
+        return {"min_ms": None, "avg_ms": None, "max_ms": None, "stddev_ms": None}
+    avg = sum(rtts) / len(rtts)
+    return {
+        "min_ms": round(min(rtts), 3),
+        "avg_ms": round(avg, 3),
+        "max_ms": round(max(rtts), 3),
+        "stddev_ms": round(math.sqrt(sum((r - avg) ** 2 for r in rtts) / len(rtts)), 3),
+    }
+
+
+async def _round(sock, address, ttls, queries, timeout):
+    """Send `queries` waves for every ttl; returns {ttl: [reply or None]}."""
+    loop = asyncio.get_running_loop()
+    probes = []
+    for wave in range(queries):
+        if wave:
+            await asyncio.sleep(QUERY_SPACING)
+        sent_at = loop.time()
+        for ttl in ttls:
+            seq, future = sock.send(address, ttl)
+            probes.append((ttl, sock, seq, future, sent_at))
+    replies = await asyncio.gather(*(
+        icmp_ping.wait_probe(sock, seq, future, sent_at, timeout)
+        for _, sock, seq, future, sent_at in probes
+    ))
+    by_ttl = {ttl: [] for ttl in ttls}
+    for (ttl, *_), reply in zip(probes, replies):
+        by_ttl[ttl].append(reply)
+    return by_ttl
+
+
+async def trace(target, max_hops=DEFAULT_MAX_HOPS, queries=DEFAULT_QUERIES,
+                timeout=DEFAULT_TIMEOUT, rounds=1, interval=MTR_INTERVAL):
+    """Trace the path to `target` and return per-hop responders and RTTs."""
+    max_hops = max(1, min(int(max_hops), 64))
+    queries = max(1, min(int(queries), 10))
+    rounds = max(1, min(int(rounds), MAX_ROUNDS))
+    timeout = max(0.1, float(timeout))
+    family, address = await icmp_ping.resolve(target)
+    sock = icmp_ping.icmp_socket(family)
+    loop = asyncio.get_running_loop()
+
+    hops = {ttl: [] for ttl in range(1, max_hops + 1)}  # ttl: [reply or None]
+    reached = None
+    started = loop.time()
+    for round_no in range(rounds):
+        last = reached or max_hops
+        replies = await _round(sock, address, range(1, last + 1), queries, timeout)
+        for ttl, answers in replies.items():
+            hops[ttl].extend(answers)
+            if any(a and a[1] == address for a in answers):
+                reached = ttl if reached is None else min(reached, ttl)
+        if round_no < rounds - 1:
+            await asyncio.sleep(max(0, started + (round_no + 1) * interval - loop.time()))
+
+    result_hops = []
+    for ttl in range(1, (reached or max_hops) + 1):
+        answers = hops[ttl]
+        responders = Counter(a[1] for a in answers if a)
+        rtts = [a[0] * 1000 for a in answers if a]
+        result_hops.append({
+            "ttl": ttl,
+            "address": responders.most_common(1)[0][0] if responders else None,
+            "addresses": sorted(responders),
+            "probes": [
+                {"address": a[1], "rtt_ms": round(a[0] * 1000, 3), "kind": a[2]} if a else None
+                for a in answers
+            ],
+            "sent": len(answers),
+            "received": len(rtts),
+            "loss_pct": round(100.0 * (len(answers) - len(rtts)) / len(answers), 1) if answers else 100.0,
+            **_stats(rtts),
+        })
+    return {
+        "target": target,
+        "address": address,
+        "max_hops": max_hops,
+        "rounds": rounds,
+        "reached": reached is not None,
+        "hops": result_hops,
+        "elapsed_ms": round((loop.time() - started) * 1000, 1),
+    }
+
+
+def format_traceroute(result):
+    """Numeric `traceroute -n` layout: responder, then its RTTs, per hop."""
+    lines = [
+        f"traceroute to {result['target']} ({result['address']}), "
+        f"{result['max_hops']} hops max, {len(icmp_ping.PAYLOAD) + 28} byte packets"
+    ]
+    for hop in result["hops"]:
+        parts = [f"{hop['ttl']:>2}"]
+        current = None
+        for probe in hop["probes"]:
+            if probe is None:
+                parts.append("*")
+                continue
+            if probe["address"] != current:
+                current = probe["address"]
+                parts.append(current)
+            flag = " !H" if probe["kind"] == icmp_ping.UNREACHABLE_KIND and current != result["address"] else ""
+            parts.append(f"{probe['rtt_ms']:.3f} ms{flag}")
+        lines.append("  ".join(parts))
+    return "\n".join(lines)
+
+
+def format_mtr(result, node_name):
+    """`mtr --report` layout with loss and RTT statistics per hop."""
+    lines = [f"HOST: {node_name:<28} Loss%   Snt   Last   Avg  Best  Wrst StDev"]
+    for hop in result["hops"]:
+        last = next((p["rtt_ms"] for p in reversed(hop["probes"]) if p), 0.0)
+        lines.append(
+            f"{hop['ttl']:>3}.|-- {hop['address'] or '???':<27}"
+            f"{hop['loss_pct']:>5.1f}% {hop['sent']:>5} {last:>6.1f} {hop['avg_ms'] or 0:>5.1f}"
+            f" {hop['min_ms'] or 0:>5.1f} {hop['max_ms'] or 0:>5.1f} {hop['stddev_ms'] or 0:>5.1f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,50 @@
+import json
+import os
+import struct
+import zlib
+
+# Binary result frames, mirrored from backend/core/wire.py:
+#
+#   MAGIC (4 bytes) | header length (uint32, big endian) | header JSON | payload
+#
+# The payload is the raw tool output (or the outputs of a batch, back to
+# back, with each header entry carrying its "length").
+MAGIC = b"PNB1"
+_PREFIX = struct.Struct(">4sI")
+
+# Outputs at least this large are zlib-compressed when "zlib" was negotiated
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = 6
+
+
+def encode_frame(header, payload=b""):
+    header_bytes = json.dumps(header).encode()
+    return _PREFIX.pack(MAGIC, len(header_bytes)) + header_bytes + payload
+
+
+def _encode_output(result_msg, header, compress):
+    output = (result_msg.get("output") or "").encode()
+    if compress and len(output) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(output, COMPRESS_LEVEL)
+        if len(packed) < len(output):
+            header["enc"] = "zlib"
+            return packed
+    return output
+
+
+def encode_result(result_msg, compress=False):
+    header = {k: v for k, v in result_msg.items() if k != "output"}
+    output = _encode_output(result_msg, header, compress)
+    return encode_frame(header, output)
+
+
+def encode_results(result_msgs, compress=False):
+    entries = []
+    payloads = []
+    for result_msg in result_msgs:
+        entry = {k: v for k, v in result_msg.items() if k not in ("output", "action")}
+        output = _encode_output(result_msg, entry, compress)
+        entry["length"] = len(output)
+        entries.append(entry)
+        payloads.append(output)
+    return encode_frame({"action": "results", "results": entries}, b"".join(payloads))